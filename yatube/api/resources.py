@@ -0,0 +1,196 @@
+"""Описание ресурсов API и их сериализация без моделей.
+
+Строки выбираются через values() только с нужными колонками и
+превращаются в словари по заранее заданной схеме, без создания
+экземпляров моделей и обхода их _meta. Связанные объекты из include=
+подгружаются одним запросом на тип по собранным id.
+"""
+from operator import itemgetter
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+
+from posts import shards
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class ApiError(Exception):
+    """Ошибка в параметрах запроса; отдаётся клиенту с кодом 400."""
+
+
+def _image(name):
+    return default_storage.url(name) if name else None
+
+
+class Resource:
+    """Ресурс API: колонки для values() и связи для include=.
+
+    fields - имя поля в API -> (колонка values(), преобразование или None).
+    relations - имя связи в include= -> (поле API с id, имя ресурса).
+    """
+
+    def __init__(self, type, model, fields, relations=None):
+        self.type = type
+        self.model = model
+        self.fields = fields
+        self.relations = relations or {}
+
+    def parse_fields(self, value):
+        """Список полей из параметра fields=; без него - все поля."""
+        if not value:
+            return list(self.fields)
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            raise ApiError(
+                f'{self.type}: нет полей {", ".join(unknown)}; '
+                f'доступны {", ".join(self.fields)}'
+            )
+        return names
+
+    def parse_include(self, value):
+        if not value:
+            return []
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.relations]
+        if unknown:
+            raise ApiError(
+                f'{self.type}: нельзя включить {", ".join(unknown)}; '
+                f'доступны {", ".join(self.relations) or "ничего"}'
+            )
+        return names
+
+    def columns(self, fields, extra=()):
+        """Колонки values() для полей fields и служебных полей extra."""
+        columns = [self.fields[name][0] for name in fields]
+        columns += [column for column in extra if column not in columns]
+        return columns
+
+    def serialize(self, row, fields):
+        data = {}
+        for name in fields:
+            column, convert = self.fields[name]
+            value = row[column]
+            data[name] = convert(value) if convert and value else value
+        return data
+
+    def by_ids(self, ids, fields):
+        columns = self.columns(fields, extra=['pk'])
+        if self.model is Post:
+            # Посты лежат на шардах своих авторов.
+            querysets = [
+                Post.objects.using(alias).filter(pk__in=pks)
+                for alias, pks in shards.by_alias(
+                    shards.for_posts(ids)
+                ).items()
+            ]
+        else:
+            querysets = [self.model.objects.filter(pk__in=ids)]
+        rows = sorted(
+            (row for queryset in querysets
+             for row in queryset.values(*columns)),
+            key=itemgetter('pk'),
+        )
+        return [self.serialize(row, fields) for row in rows]
+
+
+RESOURCES = {
+    'users': Resource('users', User, {
+        'id': ('pk', None),
+        'username': ('username', None),
+        'first_name': ('first_name', None),
+        'last_name': ('last_name', None),
+    }),
+    'groups': Resource('groups', Group, {
+        'id': ('pk', None),
+        'slug': ('slug', None),
+        'title': ('title', None),
+        'description': ('description', None),
+    }),
+    'posts': Resource('posts', Post, {
+        'id': ('pk', None),
+        'text': ('text', None),
+        'excerpt': ('excerpt', None),
+        'word_count': ('word_count', None),
+        'has_more': ('has_more', None),
+        'pub_date': ('pub_date', None),
+        'updated': ('updated', None),
+        'author': ('author_id', None),
+        'group': ('group_id', None),
+        'image': ('image', _image),
+        'image_width': ('image_width', None),
+        'image_height': ('image_height', None),
+        'comment_count': ('comment_count', None),
+    }, relations={
+        'author': ('author', 'users'),
+        'group': ('group', 'groups'),
+    }),
+    'comments': Resource('comments', Comment, {
+        'id': ('pk', None),
+        'post': ('post_id', None),
+        'author': ('author_id', None),
+        'text': ('text', None),
+        'created': ('created', None),
+    }, relations={'author': ('author', 'users'), 'post': ('post', 'posts')}),
+    'follows': Resource('follows', Follow, {
+        'id': ('pk', None),
+        'user': ('user_id', None),
+        'author': ('author_id', None),
+    }, relations={'user': ('user', 'users'), 'author': ('author', 'users')}),
+}
+
+
+class Selection:
+    """Что клиент запросил у ресурса: поля, связи и колонки выборки.
+
+    params - GET-параметры: fields= для основного ресурса,
+    fields[тип]= для включённых, include= через запятую.
+    """
+
+    def __init__(self, resource, params):
+        self.resource = resource
+        self.params = params
+        self.fields = resource.parse_fields(params.get('fields'))
+        self.include = resource.parse_include(params.get('include'))
+        for relation in self.include:
+            type = resource.relations[relation][1]
+            RESOURCES[type].parse_fields(params.get(f'fields[{type}]'))
+        # id связей нужны, даже если клиент не просил эти поля
+        self.needed = self.fields + [
+            field for field in (
+                resource.relations[relation][0] for relation in self.include
+            ) if field not in self.fields
+        ]
+
+    def values(self, queryset, extra=()):
+        """queryset.values() с колонками полей и служебными extra."""
+        return queryset.values(*self.resource.columns(self.needed, extra))
+
+    def body(self, rows, many=True):
+        """Тело ответа: data и, если есть include=, included по типам."""
+        data = [self.resource.serialize(row, self.needed) for row in rows]
+        body = {}
+        if self.include:
+            ids = {}
+            for relation in self.include:
+                field, type = self.resource.relations[relation]
+                ids.setdefault(type, set()).update(
+                    item[field] for item in data if item[field] is not None
+                )
+            body['included'] = {
+                type: RESOURCES[type].by_ids(
+                    type_ids,
+                    RESOURCES[type].parse_fields(
+                        self.params.get(f'fields[{type}]')
+                    ),
+                )
+                for type, type_ids in ids.items()
+            }
+        hidden = self.needed[len(self.fields):]
+        for item in data:
+            for name in hidden:
+                del item[name]
+        body['data'] = data if many else data[0]
+        return body
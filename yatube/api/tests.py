@@ -0,0 +1,151 @@
+import gzip
+import json
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post, User
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.authors = [
+            User.objects.create_user(username=f'author{i}') for i in range(3)
+        ]
+        cls.group = Group.objects.create(
+            title='Книги', slug='books', description='Про книги'
+        )
+        cls.posts = [
+            Post.objects.create(
+                author=cls.authors[i % 3],
+                group=cls.group if i % 2 else None,
+                text=f'Пост {i}',
+            )
+            for i in range(5)
+        ]
+        cls.comments = [
+            Comment.objects.create(
+                post=cls.posts[-1], author=cls.authors[0], text=f'Ответ {i}'
+            )
+            for i in range(3)
+        ]
+        Follow.objects.create(user=cls.authors[1], author=cls.authors[0])
+        Follow.objects.create(user=cls.authors[2], author=cls.authors[0])
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def get(self, name, args=(), **params):
+        response = self.client.get(reverse(f'api:{name}', args=args), params)
+        return response, json.loads(response.content)
+
+    def test_posts_list(self):
+        response, body = self.get('posts')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(
+            [post['id'] for post in body['data']],
+            [post.pk for post in reversed(self.posts)],
+        )
+        post = body['data'][0]
+        self.assertEqual(post['author'], self.posts[-1].author_id)
+        self.assertEqual(post['pub_date'],
+                         self.posts[-1].pub_date.isoformat())
+        self.assertIsNone(body['next_cursor'])
+        self.assertNotIn('included', body)
+
+    def test_cursor_pages(self):
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            _, body = self.get('posts', limit=2, cursor=cursor, fields='id')
+            seen += [post['id'] for post in body['data']]
+            cursor = body['next_cursor']
+        self.assertEqual(seen, [post.pk for post in reversed(self.posts)])
+
+    def test_sparse_fieldsets(self):
+        _, body = self.get('posts', fields='id,text')
+        self.assertEqual(list(body['data'][0]), ['id', 'text'])
+        _, body = self.get('groups', args=(), fields='slug')
+        self.assertEqual(body['data'], [{'slug': 'books'}])
+
+    def test_include_without_n_plus_one(self):
+        # Посты, авторы и группы - по одному запросу; с шардами посты
+        # читаются запросом на каждый шард, а остальное - из default.
+        with ExitStack() as stack:
+            for alias in settings.DATABASE_SHARDS:
+                stack.enter_context(self.assertNumQueries(1, using=alias))
+            stack.enter_context(
+                self.assertNumQueries(2 if settings.DATABASE_SHARDS else 3)
+            )
+            _, body = self.get(
+                'posts', include='author,group', fields='id',
+                **{'fields[users]': 'username'},
+            )
+        self.assertEqual(list(body['data'][0]), ['id'])
+        self.assertEqual(
+            sorted(user['username'] for user in body['included']['users']),
+            ['author0', 'author1', 'author2'],
+        )
+        self.assertEqual(body['included']['groups'][0]['slug'], 'books')
+
+    def test_filters(self):
+        _, body = self.get('posts', group='books', fields='id')
+        self.assertEqual(len(body['data']), 2)
+        _, body = self.get('posts', author='author0', fields='id')
+        self.assertEqual(len(body['data']), 2)
+
+    def test_post_comments_and_follows(self):
+        _, body = self.get('post_comments', args=(self.posts[-1].pk,),
+                           include='author')
+        self.assertEqual([comment['text'] for comment in body['data']],
+                         ['Ответ 0', 'Ответ 1', 'Ответ 2'])
+        self.assertEqual(len(body['included']['users']), 1)
+        _, body = self.get('followers', args=('author0',),
+                           include='user', fields='id')
+        self.assertEqual(len(body['data']), 2)
+        _, body = self.get('following', args=('author1',), fields='author')
+        self.assertEqual(body['data'], [{'author': self.authors[0].pk}])
+
+    def test_single_objects(self):
+        post = self.posts[1]
+        _, body = self.get('post', args=(post.pk,), include='group')
+        self.assertEqual(body['data']['text'], post.text)
+        self.assertEqual(body['included']['groups'][0]['id'], self.group.pk)
+        _, body = self.get('user', args=('author2',))
+        self.assertEqual(body['data']['username'], 'author2')
+
+    def test_errors(self):
+        cases = (
+            ('posts', (), {'fields': 'id,password'}, 400),
+            ('posts', (), {'include': 'comments'}, 400),
+            ('posts', (), {'limit': '1000'}, 400),
+            ('posts', (), {'include': 'author', 'fields[users]': 'email'},
+             400),
+            ('post', (10 ** 6,), {}, 404),
+            ('post_comments', (10 ** 6,), {}, 404),
+            ('followers', ('missing',), {}, 404),
+        )
+        for name, args, params, status in cases:
+            with self.subTest(name=name, params=params):
+                response, body = self.get(name, args, **params)
+                self.assertEqual(response.status_code, status)
+                self.assertIn('error', body)
+
+    def test_read_only(self):
+        response = self.client.post(reverse('api:posts'), {'text': 'Пост'})
+        self.assertEqual(response.status_code, 405)
+
+    @override_settings(API_PAGE_SIZE=100)
+    def test_gzip(self):
+        response = self.client.get(
+            reverse('api:posts'), HTTP_ACCEPT_ENCODING='gzip'
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        body = json.loads(gzip.decompress(response.content))
+        self.assertEqual(len(body['data']), len(self.posts))
@@ -0,0 +1,184 @@
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_safe
+
+from posts import shards
+from posts.models import Comment, Follow, Group, Post, User
+from posts.utils import CursorPaginator, MergedCursorPaginator
+
+from .resources import RESOURCES, ApiError, Selection
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ValuesCursorPaginator(CursorPaginator):
+    """Курсорная пагинация по словарям из values()."""
+
+    def _value(self, obj, name):
+        return obj[self._field(name)]
+
+
+class MergedValuesCursorPaginator(
+    ValuesCursorPaginator, MergedCursorPaginator
+):
+    """Слияние ValuesCursorPaginator нескольких шардов."""
+
+
+def _default(value):
+    # Тот же вид, что у orjson: ISO 8601 с часовым поясом.
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} не сериализуется в JSON')
+
+
+def dumps(body):
+    if orjson is not None:
+        return orjson.dumps(body)
+    return json.dumps(
+        body, ensure_ascii=False, separators=(',', ':'), default=_default
+    ).encode()
+
+
+def api_response(body, status=200):
+    return HttpResponse(
+        dumps(body), status=status, content_type='application/json'
+    )
+
+
+def api_view(view):
+    """GET и HEAD, gzip и ошибки в JSON, а не HTML-страницей."""
+    @gzip_page
+    @require_safe
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except ApiError as error:
+            return api_response({'error': str(error)}, status=400)
+        except Http404:
+            return api_response({'error': 'Не найдено'}, status=404)
+    return wrapper
+
+
+def _limit(request):
+    value = request.GET.get('limit')
+    if value is None:
+        return settings.API_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= settings.API_MAX_PAGE_SIZE:
+        raise ApiError(
+            f'limit должен быть от 1 до {settings.API_MAX_PAGE_SIZE}'
+        )
+    return limit
+
+
+def page_response(request, type, queryset, ordering, sharded=False):
+    """Страница ресурса; sharded - выборка постов со всех шардов."""
+    selection = Selection(RESOURCES[type], request.GET)
+    extra = [name.lstrip('-') for name in ordering]
+    limit = _limit(request)
+    querysets = shards.querysets(queryset) if sharded else [queryset]
+    sources = [
+        ValuesCursorPaginator(selection.values(shard, extra=extra), limit,
+                              ordering)
+        for shard in querysets
+    ]
+    paginator = sources[0] if len(sources) == 1 else \
+        MergedValuesCursorPaginator(sources, limit, ordering)
+    page = paginator.get_page(request.GET.get('cursor'))
+    body = selection.body(page)
+    body['next_cursor'] = page.next_cursor
+    body['previous_cursor'] = page.previous_cursor
+    return api_response(body)
+
+
+def object_response(request, type, queryset):
+    selection = Selection(RESOURCES[type], request.GET)
+    rows = list(selection.values(queryset)[:1])
+    if not rows:
+        raise Http404
+    return api_response(selection.body(rows, many=False))
+
+
+def _user_id(username):
+    for pk in User.objects.filter(username=username).values_list(
+        'pk', flat=True
+    ):
+        return pk
+    raise Http404
+
+
+@api_view
+def posts(request):
+    """Посты; фильтры group=<слаг> и author=<имя пользователя>."""
+    queryset = Post.objects.all()
+    if 'group' in request.GET:
+        queryset = queryset.filter(group__slug=request.GET['group'])
+    if 'author' in request.GET:
+        queryset = queryset.filter(author__username=request.GET['author'])
+    return page_response(
+        request, 'posts', queryset, ('-pub_date', '-pk'), sharded=True
+    )
+
+
+@api_view
+def post(request, post_id):
+    return object_response(
+        request, 'posts',
+        Post.objects.using(shards.for_post(post_id)).filter(pk=post_id),
+    )
+
+
+@api_view
+def post_comments(request, post_id):
+    shard = shards.for_post(post_id)
+    if not Post.objects.using(shard).filter(pk=post_id).exists():
+        raise Http404
+    return page_response(
+        request, 'comments',
+        Comment.objects.using(shard).filter(post_id=post_id),
+        ('created', 'pk'),
+    )
+
+
+@api_view
+def groups(request):
+    return page_response(request, 'groups', Group.objects.all(), ('pk',))
+
+
+@api_view
+def group(request, slug):
+    return object_response(request, 'groups', Group.objects.filter(slug=slug))
+
+
+@api_view
+def user(request, username):
+    return object_response(
+        request, 'users', User.objects.filter(username=username)
+    )
+
+
+@api_view
+def followers(request, username):
+    return page_response(
+        request, 'follows',
+        Follow.objects.filter(author_id=_user_id(username)), ('user_id',),
+    )
+
+
+@api_view
+def following(request, username):
+    return page_response(
+        request, 'follows',
+        Follow.objects.filter(user_id=_user_id(username)), ('author_id',),
+    )
@@ -0,0 +1,23 @@
+from django.contrib import admin
+
+from .models import StoredFile, Task
+
+
+class TaskAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk', 'name', 'status', 'attempts', 'run_at', 'finished', 'worker',
+    )
+    list_filter = ('status', 'name')
+    search_fields = ('name', 'key')
+    readonly_fields = ('created', 'started', 'finished', 'worker')
+
+
+admin.site.register(Task, TaskAdmin)
+
+
+class StoredFileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'refs', 'released')
+    search_fields = ('name',)
+
+
+admin.site.register(StoredFile, StoredFileAdmin)
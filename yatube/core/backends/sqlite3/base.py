@@ -0,0 +1,15 @@
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """SQLite, где транзакции сразу берут блокировку на запись.
+
+    Обычный BEGIN откладывает блокировку до первой записи. Если к этому
+    моменту транзакция уже читала, а другой писатель успел закоммитить,
+    SQLite отвечает «database is locked» без ожидания busy_timeout.
+    BEGIN IMMEDIATE ждёт блокировку в начале транзакции. В Django 5.1+
+    то же самое даёт OPTIONS['transaction_mode'] = 'IMMEDIATE'.
+    """
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute('BEGIN IMMEDIATE')
@@ -0,0 +1,75 @@
+"""Настройка соединений SQLite и повтор записи при блокировках.
+
+SQLite допускает одного писателя. В режиме WAL читатели не ждут
+писателя, а писатели ждут друг друга до busy_timeout (транзакции
+начинаются с BEGIN IMMEDIATE, см. core.backends.sqlite3). Если
+блокировку не удалось получить и за это время, view с записью
+повторяет декоратор retry_on_lock.
+"""
+import random
+import time
+from contextlib import ExitStack
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections
+from django.db import transaction
+
+LOCK_ERRORS = ('database is locked', 'database table is locked')
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Обработчик connection_created: выставляет SQLITE_PRAGMAS."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def is_lock_error(error):
+    return any(message in str(error) for message in LOCK_ERRORS)
+
+
+def _write_aliases():
+    # Шарды входят в транзакцию запроса: иначе их записи, сделанные до
+    # блокировки, пережили бы откат default, и повтор продублировал бы
+    # пост или оставил PostKey без поста. Порядок захвата блокировок
+    # у всех запросов один, поэтому они не ждут друг друга по кругу.
+    return [DEFAULT_DB_ALIAS, *settings.DATABASE_SHARDS]
+
+
+def retry_on_lock(view):
+    """Выполняет запрос с записью в транзакции и повторяет её при блокировке.
+
+    Транзакция начинается с BEGIN IMMEDIATE и держит блокировку на
+    запись до конца view, поэтому GET и HEAD выполняются без неё:
+    читателям в режиме WAL блокировка не нужна.
+    Паузы между попытками растут вдвое от SQLITE_RETRY_DELAY со случайным
+    разбросом, чтобы конкурирующие писатели не просыпались одновременно.
+    Внутри внешней транзакции повторять нечего, ошибка пробрасывается,
+    поэтому и точка сохранения не нужна.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD', 'OPTIONS', 'TRACE'):
+            return view(request, *args, **kwargs)
+        attempts = settings.SQLITE_WRITE_ATTEMPTS
+        for attempt in range(attempts):
+            try:
+                with ExitStack() as stack:
+                    for alias in _write_aliases():
+                        stack.enter_context(
+                            transaction.atomic(using=alias, savepoint=False)
+                        )
+                    return view(request, *args, **kwargs)
+            except OperationalError as error:
+                if (
+                    not is_lock_error(error)
+                    or attempt == attempts - 1
+                    or connections[DEFAULT_DB_ALIAS].in_atomic_block
+                ):
+                    raise
+            delay = settings.SQLITE_RETRY_DELAY * 2 ** attempt
+            time.sleep(delay * random.uniform(0.5, 1.5))
+    return wrapper
@@ -0,0 +1,22 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core import metrics
+
+
+class Command(BaseCommand):
+    help = ('Выводит метрики запросов, собранные всеми процессами '
+            'приложения, по их снимкам в БД.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=('prometheus', 'json'), default='prometheus',
+        )
+
+    def handle(self, *args, **options):
+        snapshot = metrics.merge(metrics.collected_snapshots())
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(snapshot, indent=2, sort_keys=True))
+        else:
+            self.stdout.write(metrics.render_prometheus(snapshot), ending='')
@@ -0,0 +1,61 @@
+import multiprocessing
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import tasks
+
+
+class Command(BaseCommand):
+    help = ('Запускает обработчики фоновой очереди задач '
+            'в пуле потоков или процессов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=settings.TASKS_WORKERS,
+            help='Число обработчиков.',
+        )
+        parser.add_argument(
+            '--pool', choices=('thread', 'process'),
+            default=settings.TASKS_POOL,
+            help='Потоки подходят для задач с вводом-выводом, процессы - '
+                 'для тяжёлых вычислений вроде обработки картинок.',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить готовые задачи и выйти.',
+        )
+        parser.add_argument(
+            '--status', action='store_true',
+            help='Показать число задач по статусам и выйти.',
+        )
+
+    def handle(self, *args, **options):
+        if options['status']:
+            for name, count in tasks.status().items():
+                self.stdout.write(f'{name:<10}{count:>8}')
+            return
+        if options['pool'] == 'process':
+            context = multiprocessing.get_context('fork')
+            stop = context.Event()
+            start = context.Process
+            # Потомки не должны делить с родителем открытые соединения.
+            connections.close_all()
+        else:
+            stop = threading.Event()
+            start = threading.Thread
+        pool = [
+            start(target=tasks.work, args=(index, stop, options['once']))
+            for index in range(options['workers'])
+        ]
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stop.set())
+        for worker in pool:
+            worker.start()
+        for worker in pool:
+            worker.join()
+        if not options['once']:
+            self.stdout.write('Обработчики остановлены')
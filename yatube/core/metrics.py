@@ -0,0 +1,245 @@
+"""Метрики производительности запросов по именам URL.
+
+Для каждого view (posts:index, posts:post_detail и т.д.) копятся
+гистограммы времени ответа, числа и времени запросов к БД, времени
+рендера шаблонов и размера ответа. Данные живут в памяти процесса
+и отдаются в текстовом формате Prometheus. Раз в METRICS_FLUSH_SECONDS
+процесс сохраняет снимок своей строкой MetricsSnapshot в БД, откуда
+команда dump_metrics собирает сводку по всем процессам и всем хостам.
+Снимки процессов, которые не обновлялись METRICS_PROCESS_TIMEOUT,
+считаются снимками завершившихся процессов и удаляются.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from .models import MetricsSnapshot
+
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+HISTOGRAMS = {
+    'request_duration_seconds': DURATION_BUCKETS,
+    'db_queries': QUERY_BUCKETS,
+    'db_duration_seconds': DURATION_BUCKETS,
+    'template_render_seconds': DURATION_BUCKETS,
+    'response_size_bytes': SIZE_BUCKETS,
+}
+PREFIX = 'yatube_'
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class RequestStats:
+    """Счётчики одного запроса, доступные обёрткам БД и шаблонов."""
+
+    def __init__(self, capture_sql=False):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.sql = [] if capture_sql else None
+
+    def __call__(self, execute, sql, params, many, context):
+        # Обёртка connection.execute_wrapper: считает каждый запрос.
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_time += elapsed
+            if self.sql is not None:
+                self.sql.append((elapsed, sql))
+
+
+def current():
+    return getattr(_local, 'stats', None)
+
+
+def start(stats):
+    _local.stats = stats
+
+
+def stop():
+    _local.stats = None
+
+
+@contextmanager
+def template_timer():
+    """Засекает время рендера; вложенные рендеры не считаются дважды."""
+    stats = current()
+    depth = getattr(_local, 'depth', 0)
+    if stats is None or depth:
+        yield
+        return
+    _local.depth = 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _local.depth = 0
+        stats.template_time += time.perf_counter() - started
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+        self.last_flush = 0.0
+
+    @staticmethod
+    def _empty():
+        return {
+            'statuses': {},
+            'histograms': {
+                name: {
+                    'buckets': [0] * len(buckets),
+                    'count': 0,
+                    'sum': 0.0,
+                }
+                for name, buckets in HISTOGRAMS.items()
+            },
+        }
+
+    def observe(self, view, status, values):
+        with self.lock:
+            data = self.views.setdefault(view, self._empty())
+            status = str(status)
+            data['statuses'][status] = data['statuses'].get(status, 0) + 1
+            for name, value in values.items():
+                histogram = data['histograms'][name]
+                for i, bound in enumerate(HISTOGRAMS[name]):
+                    if value <= bound:
+                        histogram['buckets'][i] += 1
+                histogram['count'] += 1
+                histogram['sum'] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                view: {
+                    'statuses': dict(data['statuses']),
+                    'histograms': {
+                        name: {
+                            'buckets': list(histogram['buckets']),
+                            'count': histogram['count'],
+                            'sum': histogram['sum'],
+                        }
+                        for name, histogram in data['histograms'].items()
+                    },
+                }
+                for view, data in self.views.items()
+            }
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+    def flush(self, interval):
+        """Сохраняет снимок в БД не чаще, чем раз в interval секунд.
+
+        У каждого процесса своя строка, поэтому процессы не
+        перезаписывают друг друга. Ошибка БД не должна ронять запрос:
+        снимок просто сохранится в следующий раз. interval=None - не
+        сохранять вовсе.
+        """
+        now = time.monotonic()
+        if interval is None or now - self.last_flush < interval:
+            return
+        self.last_flush = now
+        process = f'{socket.gethostname()}:{os.getpid()}'
+        data = json.dumps(self.snapshot())
+        try:
+            saved = MetricsSnapshot.objects.filter(process=process).update(
+                data=data, updated=timezone.now()
+            )
+            if not saved:
+                MetricsSnapshot.objects.bulk_create(
+                    [MetricsSnapshot(process=process, data=data)],
+                    ignore_conflicts=True,
+                )
+        except DatabaseError:
+            logger.warning('Не удалось сохранить метрики процесса %s',
+                           process, exc_info=True)
+
+
+registry = Registry()
+
+
+def merge(snapshots):
+    """Складывает снимки нескольких процессов в один."""
+    result = {}
+    for snapshot in snapshots:
+        for view, data in snapshot.items():
+            target = result.setdefault(view, Registry._empty())
+            for status, count in data['statuses'].items():
+                target['statuses'][status] = (
+                    target['statuses'].get(status, 0) + count
+                )
+            for name, histogram in data['histograms'].items():
+                merged = target['histograms'][name]
+                merged['buckets'] = [
+                    a + b for a, b in zip(merged['buckets'],
+                                          histogram['buckets'])
+                ]
+                merged['count'] += histogram['count']
+                merged['sum'] += histogram['sum']
+    return result
+
+
+def collected_snapshots():
+    """Снимки живых процессов; снимки завершившихся удаляются."""
+    alive_since = timezone.now() - timedelta(
+        seconds=settings.METRICS_PROCESS_TIMEOUT
+    )
+    MetricsSnapshot.objects.filter(updated__lt=alive_since).delete()
+    return [
+        json.loads(data)
+        for data in MetricsSnapshot.objects.values_list('data', flat=True)
+    ]
+
+
+def render_prometheus(snapshot):
+    lines = [
+        f'# TYPE {PREFIX}requests_total counter',
+    ]
+    for view, data in sorted(snapshot.items()):
+        for status, count in sorted(data['statuses'].items()):
+            lines.append(
+                f'{PREFIX}requests_total{{view="{view}",status="{status}"}}'
+                f' {count}'
+            )
+    for name, bounds in HISTOGRAMS.items():
+        lines.append(f'# TYPE {PREFIX}{name} histogram')
+        for view, data in sorted(snapshot.items()):
+            histogram = data['histograms'][name]
+            for bound, count in zip(bounds, histogram['buckets']):
+                lines.append(
+                    f'{PREFIX}{name}_bucket{{view="{view}",'
+                    f'le="{bound}"}} {count}'
+                )
+            lines.append(
+                f'{PREFIX}{name}_bucket{{view="{view}",le="+Inf"}}'
+                f' {histogram["count"]}'
+            )
+            lines.append(
+                f'{PREFIX}{name}_sum{{view="{view}"}} {histogram["sum"]}'
+            )
+            lines.append(
+                f'{PREFIX}{name}_count{{view="{view}"}} {histogram["count"]}'
+            )
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,109 @@
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics, routers
+
+logger = logging.getLogger('core.metrics')
+
+
+class MetricsMiddleware:
+    """Собирает метрики каждого запроса по имени URL.
+
+    Запросы ко всем БД считаются через execute_wrapper, время
+    рендера шаблонов - через бэкенд core.templates.TimedDjangoTemplates.
+    SQL запоминается только у доли запросов METRICS_SLOW_SAMPLE_RATE,
+    и в лог попадают лишь те из них, что медленнее METRICS_SLOW_REQUEST_MS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sampled = random.random() < settings.METRICS_SLOW_SAMPLE_RATE
+        stats = metrics.RequestStats(capture_sql=sampled)
+        metrics.start(stats)
+        started = time.perf_counter()
+        try:
+            # Запросы к репликам и шардам идут через свои соединения.
+            with ExitStack() as stack:
+                for alias in connections:
+                    stack.enter_context(
+                        connections[alias].execute_wrapper(stats)
+                    )
+                response = self.get_response(request)
+        finally:
+            metrics.stop()
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+        size = (
+            len(response.content) if not response.streaming
+            else int(response.get('Content-Length', 0))
+        )
+        metrics.registry.observe(view, response.status_code, {
+            'request_duration_seconds': elapsed,
+            'db_queries': stats.queries,
+            'db_duration_seconds': stats.db_time,
+            'template_render_seconds': stats.template_time,
+            'response_size_bytes': size,
+        })
+        if sampled and elapsed * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+            self.log_slow(request, view, elapsed, stats)
+        metrics.registry.flush(settings.METRICS_FLUSH_SECONDS)
+        return response
+
+    @staticmethod
+    def log_slow(request, view, elapsed, stats):
+        queries = '\n'.join(
+            f'  {duration * 1000:.1f} мс: {sql}' for duration, sql in stats.sql
+        )
+        logger.warning(
+            'Медленный запрос %s %s (%s): %.0f мс, шаблоны %.0f мс, '
+            'запросов к БД %d за %.0f мс\n%s',
+            request.method, request.get_full_path(), view, elapsed * 1000,
+            stats.template_time * 1000, stats.queries, stats.db_time * 1000,
+            queries,
+        )
+
+
+class ReplicaRoutingMiddleware:
+    """Отправляет чтения view из DATABASE_REPLICA_VIEWS на реплики.
+
+    После запроса с записью в БД ставит cookie, по которой следующие
+    запросы клиента читают из основной БД (read-your-writes).
+    """
+
+    cookie = 'db_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        routers.start_request(sticky=self.cookie in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = routers.finish_request()
+        if wrote:
+            response.set_cookie(
+                self.cookie, '1',
+                max_age=settings.DATABASE_REPLICA_STICKY_SECONDS,
+                httponly=True, samesite='Lax',
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            settings.DATABASE_REPLICAS
+            and request.method in ('GET', 'HEAD')
+            and request.resolver_match.view_name
+            in settings.DATABASE_REPLICA_VIEWS
+        ):
+            routers.read_from_replicas()
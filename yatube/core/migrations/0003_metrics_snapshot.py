@@ -0,0 +1,27 @@
+# Generated by Django 2.2.19 on 2026-10-18 18:13
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_storedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetricsSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('process', models.CharField(max_length=100, unique=True, verbose_name='Процесс')),
+                ('data', models.TextField(default='{}', verbose_name='Снимок')),
+                ('updated', models.DateTimeField(db_index=True, default=django.utils.timezone.now, verbose_name='Обновлён')),
+            ],
+            options={
+                'verbose_name': 'Снимок метрик',
+                'verbose_name_plural': 'Снимки метрик',
+            },
+        ),
+    ]
@@ -0,0 +1,109 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """Задача фоновой очереди (core.tasks) и её текущее состояние."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    name = models.CharField(max_length=200, verbose_name='Задача')
+    args = models.TextField(default='[]', verbose_name='Аргументы')
+    kwargs = models.TextField(
+        default='{}', verbose_name='Именованные аргументы'
+    )
+    key = models.CharField(
+        max_length=200,
+        unique=True,
+        null=True,
+        blank=True,
+        verbose_name='Ключ идемпотентности',
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED,
+        verbose_name='Статус',
+    )
+    attempts = models.PositiveIntegerField(
+        default=0, verbose_name='Попыток сделано'
+    )
+    max_attempts = models.PositiveIntegerField(
+        default=5, verbose_name='Попыток всего'
+    )
+    run_at = models.DateTimeField(
+        default=timezone.now, verbose_name='Выполнить не раньше'
+    )
+    created = models.DateTimeField(
+        auto_now_add=True, verbose_name='Поставлена'
+    )
+    started = models.DateTimeField(
+        null=True, blank=True, verbose_name='Начата'
+    )
+    finished = models.DateTimeField(
+        null=True, blank=True, verbose_name='Завершена'
+    )
+    worker = models.CharField(
+        max_length=100, blank=True, verbose_name='Обработчик'
+    )
+    error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            models.Index(
+                fields=['status', 'run_at'], name='task_status_run_at_idx'
+            ),
+        ]
+        verbose_name = 'Задача'
+        verbose_name_plural = 'Задачи'
+
+    def __str__(self):
+        return f'{self.name} ({self.get_status_display()})'
+
+
+class StoredFile(models.Model):
+    """Файл хранилища core.storage и число ссылок на него."""
+
+    name = models.CharField(
+        max_length=255, primary_key=True, verbose_name='Имя файла'
+    )
+    refs = models.PositiveIntegerField(default=0, verbose_name='Ссылок')
+    released = models.DateTimeField(
+        null=True, blank=True, verbose_name='Без ссылок с'
+    )
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+    def __str__(self):
+        return f'{self.name} ({self.refs})'
+
+
+class MetricsSnapshot(models.Model):
+    """Последний снимок метрик одного процесса (core.metrics)."""
+
+    process = models.CharField(
+        max_length=100, unique=True, verbose_name='Процесс'
+    )
+    data = models.TextField(default='{}', verbose_name='Снимок')
+    updated = models.DateTimeField(
+        default=timezone.now, db_index=True, verbose_name='Обновлён'
+    )
+
+    class Meta:
+        verbose_name = 'Снимок метрик'
+        verbose_name_plural = 'Снимки метрик'
+
+    def __str__(self):
+        return self.process
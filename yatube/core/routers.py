@@ -0,0 +1,58 @@
+"""Маршрутизация запросов между основной БД и репликами.
+
+Запись всегда идёт в default. Чтение уходит на реплики только внутри
+view из DATABASE_REPLICA_VIEWS (это включает ReplicaRoutingMiddleware)
+и только пока клиент не «прилип» к основной БД: после записи клиент
+DATABASE_REPLICA_STICKY_SECONDS секунд читает из default, чтобы видеть
+свои изменения раньше, чем они доедут до реплик.
+"""
+import random
+import threading
+
+from django.conf import settings
+
+_local = threading.local()
+
+
+def start_request(sticky=False):
+    _local.replicas = False
+    _local.sticky = sticky
+    _local.wrote = False
+
+
+def read_from_replicas():
+    _local.replicas = True
+
+
+def finish_request():
+    """Сбрасывает состояние; возвращает True, если в запросе была запись."""
+    wrote = getattr(_local, 'wrote', False)
+    start_request()
+    return wrote
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (
+            replicas
+            and getattr(_local, 'replicas', False)
+            and not _local.sticky
+            and not _local.wrote
+        ):
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        _local.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики хранят те же данные, что и основная БД.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Схему реплик создаёт репликация с основной БД.
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
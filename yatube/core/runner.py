@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.test import TransactionTestCase
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class MirrorConnection:
+    """Соединение зеркала, которое отправляет запросы в соединение основной.
+
+    Своё соединение зеркала не видело бы данных, созданных внутри
+    транзакции TestCase. Атрибуты, которые тесты ставят на соединение
+    (запрет обращений к БД вне databases), остаются у обёртки.
+    """
+
+    def __init__(self, primary):
+        self._primary = primary
+
+    def __getattr__(self, name):
+        return getattr(self._primary, name)
+
+
+class TestRunner(DiscoverRunner):
+    """Запуск тестов: задачи без очереди, метрики без снимков в БД.
+
+    Фоновые задачи выполняются сразу, без обработчиков run_workers
+    (тесты самой очереди выключают TASKS_EAGER) и не ждут фиксации:
+    TestCase в Django 2.2 её не делает, и on_commit не вызывается
+    никогда. Снимки метрик не
+    пишутся в БД: лишний запрос сбивал бы проверки числа запросов.
+    Реплики и шарды из настроек доступны всем тестам с БД: с ними
+    любой тест идёт по тем же маршрутам, что и рабочий код. Тесты
+    идут в одном процессе, поэтому локальный кэш с шардами допустим
+    (posts.E001), но после каждого теста он очищается: откат транзакции
+    теста освобождает id, а кэш помнил бы по ним чужие посты и шарды.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.test_settings = override_settings(
+            TASKS_EAGER=True, TASKS_EAGER_ON_COMMIT=False,
+            METRICS_FLUSH_SECONDS=None, SILENCED_SYSTEM_CHECKS=['posts.E001'],
+        )
+        self.test_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.test_settings.disable()
+        super().teardown_test_environment(**kwargs)
+
+    def build_suite(self, *args, **kwargs):
+        suite = super().build_suite(*args, **kwargs)
+        for test in suite:
+            test.addCleanup(cache.clear)
+            cls = type(test)
+            if (len(connections.databases) > 1
+                    and isinstance(test, TransactionTestCase)
+                    and cls.databases == {'default'}):
+                cls.databases = '__all__'
+        return suite
+
+    def setup_databases(self, **kwargs):
+        # Шарды SQLite - во временных файлах: файл, а не память, чтобы
+        # WAL и блокировки работали как у default, и не в каталоге
+        # проекта, чтобы после тестов не оставалось лишних файлов.
+        self.shard_dir = tempfile.mkdtemp(prefix='yatube-shards-')
+        for alias in settings.DATABASE_SHARDS:
+            if connections[alias].vendor == 'sqlite':
+                connections[alias].settings_dict['TEST']['NAME'] = (
+                    os.path.join(self.shard_dir, f'test_{alias}.sqlite3')
+                )
+        old_config = super().setup_databases(**kwargs)
+        self.mirrors = {}
+        for alias in connections:
+            mirror = connections[alias].settings_dict['TEST'].get('MIRROR')
+            if mirror:
+                self.mirrors[alias] = connections[alias]
+                connections[alias] = MirrorConnection(connections[mirror])
+        return old_config
+
+    def teardown_databases(self, old_config, **kwargs):
+        for alias, connection in self.mirrors.items():
+            connections[alias] = connection
+        super().teardown_databases(old_config, **kwargs)
+        shutil.rmtree(self.shard_dir, ignore_errors=True)
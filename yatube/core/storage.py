@@ -0,0 +1,120 @@
+"""Хранилище файлов с адресацией по содержимому и счётчиком ссылок.
+
+Файл получает имя по SHA-256 содержимого и кладётся во вложенные
+каталоги по первым символам хэша: posts/ab/cd/abcd...ef.jpg. Так в
+одном каталоге не больше нескольких сотен файлов даже при миллионах
+картинок, а одинаковые картинки хранятся один раз: повторная загрузка
+получает имя уже лежащего файла и ничего не пишет.
+
+Раз файл может быть общим, удалять его вместе с записью нельзя.
+Ссылки считает таблица StoredFile: acquire при появлении ссылки,
+release при её исчезновении. Файл без ссылок удаляет задача collect
+через MEDIA_COLLECT_DELAY: за это время файл может снова понадобиться
+загрузке, которая уже нашла его на диске и ещё не взяла ссылку.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+from django.utils.dateparse import parse_datetime
+
+from .models import StoredFile
+from .tasks import enqueue, task
+
+HASHED_NAME = re.compile(r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+def file_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def is_hashed(name):
+    return bool(HASHED_NAME.search(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, который называет файлы хэшем содержимого."""
+
+    def hashed_name(self, name, digest):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(
+            directory, digest[:2], digest[2:4], digest + extension
+        )
+
+    def get_available_name(self, name, max_length=None):
+        # Имя выбирает _save по содержимому, совпадение имён не конфликт.
+        return name
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, file_hash(content))
+        if self.exists(name):
+            return name
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        if self.directory_permissions_mode is not None:
+            os.chmod(directory, self.directory_permissions_mode)
+        # Через временный файл и rename: параллельная загрузка того же
+        # содержимого не увидит недописанный файл.
+        descriptor, temporary = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(descriptor, 'wb') as output:
+                for chunk in content.chunks():
+                    output.write(chunk)
+            # mkstemp создаёт файл с правами 0600, а читать его должен
+            # и веб-сервер.
+            os.chmod(temporary, self.file_permissions_mode or 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+        return name
+
+
+content_storage = ContentAddressedStorage()
+
+
+def _rows(name):
+    return StoredFile.objects.filter(name=name)
+
+
+def acquire(name, count=1):
+    """Добавляет count ссылок на файл name."""
+    if not _rows(name).update(refs=F('refs') + count, released=None):
+        StoredFile.objects.bulk_create(
+            [StoredFile(name=name, refs=0)], ignore_conflicts=True
+        )
+        _rows(name).update(refs=F('refs') + count, released=None)
+
+
+def release(name):
+    """Убирает ссылку; файл без ссылок удаляется через MEDIA_COLLECT_DELAY."""
+    _rows(name).filter(refs__gt=0).update(refs=F('refs') - 1)
+    released = timezone.now()
+    if _rows(name).filter(refs=0, released=None).update(released=released):
+        stamp = released.isoformat()
+        enqueue(
+            collect, name, stamp,
+            key=f'collect:{name}:{stamp}', delay=settings.MEDIA_COLLECT_DELAY,
+        )
+
+
+@task
+def collect(name, released):
+    """Удаляет файл, если с момента released на него не появилось ссылок."""
+    deleted, _ = _rows(name).filter(
+        refs=0, released=parse_datetime(released)
+    ).delete()
+    if deleted:
+        content_storage.delete(name)
@@ -0,0 +1,218 @@
+"""Фоновая очередь задач в БД, без внешнего брокера.
+
+Функция становится задачей декоратором task и ставится в очередь
+enqueue. Запись Task создаётся в текущей транзакции, поэтому задача
+видна обработчикам только после её фиксации и не теряется при откате.
+Обработчики запускает команда run_workers: пул потоков или процессов
+забирает задачи условным UPDATE и выполняет их.
+
+Доставка «хотя бы один раз»: упавшая задача повторяется с
+экспоненциальной паузой, зависшая дольше TASKS_TIMEOUT возвращается в
+очередь. Поэтому задачи должны быть идемпотентными, а ключ key
+не даёт поставить одну и ту же задачу дважды, пока она в очереди или
+выполнена (TASKS_KEEP_DONE). Окончательно упавшая задача ключ
+освобождает, и её можно поставить снова.
+
+С TASKS_EAGER задача выполняется в том же процессе после фиксации
+транзакции, как выполнил бы её обработчик: так удобно в разработке и
+тестах, где обработчики не запущены.
+"""
+import json
+import logging
+import os
+import random
+import socket
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import OperationalError, connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .db import is_lock_error
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+REGISTRY = {}
+
+
+def task(func=None, *, max_attempts=None):
+    """Регистрирует функцию как задачу; её аргументы - JSON-значения."""
+    def register(func):
+        func.task_name = f'{func.__module__}.{func.__name__}'
+        func.max_attempts = max_attempts or settings.TASKS_MAX_ATTEMPTS
+        REGISTRY[func.task_name] = func
+        return func
+    return register(func) if func else register
+
+
+def resolve(name):
+    if name not in REGISTRY:
+        # Модуль с задачей мог ещё не импортироваться в этом процессе.
+        import_string(name)
+    return REGISTRY[name]
+
+
+def enqueue(func, *args, key=None, delay=0, **kwargs):
+    """Ставит задачу func(*args, **kwargs) в очередь.
+
+    key - ключ идемпотентности: задача с уже известным ключом не
+    ставится повторно. delay - через сколько секунд её выполнять.
+    """
+    args_json = json.dumps(args)
+    kwargs_json = json.dumps(kwargs)
+    if settings.TASKS_EAGER:
+        # Через JSON, как в очереди: несериализуемый аргумент должен
+        # падать и в разработке.
+        args, kwargs = json.loads(args_json), json.loads(kwargs_json)
+        if settings.TASKS_EAGER_ON_COMMIT:
+            transaction.on_commit(lambda: func(*args, **kwargs))
+        else:
+            func(*args, **kwargs)
+        return
+    Task.objects.bulk_create([Task(
+        name=func.task_name,
+        args=args_json,
+        kwargs=kwargs_json,
+        key=key,
+        max_attempts=func.max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )], ignore_conflicts=key is not None)
+
+
+def backoff(attempts):
+    """Пауза перед следующей попыткой: удваивается, с разбросом."""
+    delay = min(
+        settings.TASKS_RETRY_DELAY * 2 ** (attempts - 1),
+        settings.TASKS_RETRY_MAX_DELAY,
+    )
+    return delay * random.uniform(0.5, 1)
+
+
+def status():
+    """Число задач по каждому статусу."""
+    counts = dict.fromkeys((code for code, _ in Task.STATUSES), 0)
+    counts.update(
+        Task.objects.order_by().values_list('status')
+        .annotate(count=Count('pk'))
+    )
+    return counts
+
+
+class Worker:
+    """Обработчик: забирает готовые задачи по одной и выполняет их."""
+
+    def __init__(self, name=None):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.housekeeping_at = 0
+
+    def claim(self):
+        """Захватывает первую готовую задачу или возвращает None.
+
+        Задачу захватывает тот, чей UPDATE со статусом queued в условии
+        изменил строку; проигравший берёт следующую из выборки.
+        """
+        now = timezone.now()
+        ready = Task.objects.filter(
+            status=Task.QUEUED, run_at__lte=now
+        ).values_list('pk', flat=True)[:10]
+        for pk in ready:
+            claimed = Task.objects.filter(
+                pk=pk, status=Task.QUEUED
+            ).update(
+                status=Task.RUNNING,
+                attempts=F('attempts') + 1,
+                started=now,
+                worker=self.name,
+            )
+            if claimed:
+                return Task.objects.get(pk=pk)
+        return None
+
+    def execute(self, job):
+        try:
+            resolve(job.name)(
+                *json.loads(job.args), **json.loads(job.kwargs)
+            )
+        except Exception:
+            self.failed(job, traceback.format_exc())
+        else:
+            Task.objects.filter(pk=job.pk).update(
+                status=Task.DONE, finished=timezone.now(), error=''
+            )
+
+    def failed(self, job, error):
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            delay = backoff(job.attempts)
+            logger.warning(
+                'Задача %s #%s упала (попытка %d из %d), повтор через '
+                '%.0f с\n%s', job.name, job.pk, job.attempts,
+                job.max_attempts, delay, error,
+            )
+            Task.objects.filter(pk=job.pk).update(
+                status=Task.QUEUED,
+                run_at=now + timedelta(seconds=delay),
+                error=error,
+            )
+        else:
+            logger.error(
+                'Задача %s #%s не выполнена за %d попыток\n%s',
+                job.name, job.pk, job.attempts, error,
+            )
+            Task.objects.filter(pk=job.pk).update(
+                status=Task.FAILED, finished=now, error=error, key=None
+            )
+
+    def housekeeping(self):
+        """Возвращает зависшие задачи в очередь и удаляет старые."""
+        now = timezone.now()
+        stale = Task.objects.filter(
+            status=Task.RUNNING,
+            started__lt=now - timedelta(seconds=settings.TASKS_TIMEOUT),
+        )
+        stale.filter(attempts__lt=F('max_attempts')).update(
+            status=Task.QUEUED, run_at=now, error='Превышено TASKS_TIMEOUT'
+        )
+        stale.update(
+            status=Task.FAILED, finished=now, error='Превышено TASKS_TIMEOUT',
+            key=None,
+        )
+        Task.objects.filter(
+            status=Task.DONE,
+            finished__lt=now - timedelta(seconds=settings.TASKS_KEEP_DONE),
+        ).delete()
+
+    def run(self, stop, once=False):
+        """Цикл обработчика до события stop; once - до пустой очереди."""
+        while not stop.is_set():
+            try:
+                job = self.claim()
+                if job is not None:
+                    self.execute(job)
+                    continue
+                if time.monotonic() >= self.housekeeping_at:
+                    self.housekeeping()
+                    self.housekeeping_at = (
+                        time.monotonic() + settings.TASKS_TIMEOUT / 10
+                    )
+            except OperationalError as error:
+                if not is_lock_error(error):
+                    raise
+                logger.warning('Обработчик %s: БД занята', self.name)
+            if once:
+                return
+            stop.wait(settings.TASKS_POLL_SECONDS)
+
+
+def work(index, stop, once=False):
+    """Точка входа потока или процесса пула run_workers."""
+    worker = Worker(f'{socket.gethostname()}:{os.getpid()}:{index}')
+    try:
+        worker.run(stop, once)
+    finally:
+        connection.close()
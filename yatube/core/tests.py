@@ -0,0 +1,647 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import (
+    OperationalError, connection, connections, transaction,
+)
+from django.db.models import F
+from django.test import (
+    Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from posts import shards
+from posts.models import Comment, FeedEntry, Follow, Group, Post, User
+from yatube import databases
+
+from . import metrics, routers, storage, tasks
+from .db import retry_on_lock
+from .middleware import ReplicaRoutingMiddleware
+from .models import MetricsSnapshot, StoredFile, Task
+
+
+class MetricsMiddlewareTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.post = Post.objects.create(author=cls.user, text='Тестовый пост')
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.reset()
+        self.client = Client()
+
+    def view_metrics(self, view):
+        return metrics.registry.snapshot()[view]
+
+    def test_request_is_recorded_by_url_name(self):
+        self.client.get(reverse('posts:post_detail', args=(self.post.pk,)))
+        data = self.view_metrics('posts:post_detail')
+        self.assertEqual(data['statuses'], {'200': 1})
+        histograms = data['histograms']
+        for name in metrics.HISTOGRAMS:
+            with self.subTest(name=name):
+                self.assertEqual(histograms[name]['count'], 1)
+        self.assertGreater(histograms['db_queries']['sum'], 0)
+        self.assertGreater(histograms['template_render_seconds']['sum'], 0)
+        self.assertGreater(histograms['response_size_bytes']['sum'], 0)
+
+    def test_unresolved_urls_are_grouped(self):
+        self.client.get('/missing/page/')
+        self.assertEqual(
+            self.view_metrics('unresolved')['statuses'], {'404': 1}
+        )
+
+    def test_prometheus_endpoint(self):
+        self.client.get(reverse('posts:index'))
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'].split(';')[0],
+                         'text/plain')
+        self.assertContains(
+            response,
+            'yatube_requests_total{view="posts:index",status="200"} 1',
+        )
+        self.assertContains(
+            response, 'yatube_db_queries_count{view="posts:index"} 1'
+        )
+
+    @override_settings(METRICS_ENDPOINT_ENABLED=False)
+    def test_endpoint_can_be_disabled(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 404)
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0, METRICS_SLOW_SAMPLE_RATE=1)
+    def test_slow_request_is_logged_with_sql(self):
+        with self.assertLogs('core.metrics', 'WARNING') as logs:
+            self.client.get(reverse('posts:index'))
+        self.assertIn('posts:index', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0, METRICS_SLOW_SAMPLE_RATE=0)
+    def test_unsampled_request_is_not_logged(self):
+        with self.assertNoLogs('core.metrics', 'WARNING'):
+            self.client.get(reverse('posts:index'))
+
+    @override_settings(METRICS_ALLOWED_IPS=['10.0.0.1'])
+    def test_endpoint_answers_allowed_addresses(self):
+        address = reverse('metrics')
+        self.assertEqual(self.client.get(address).status_code, 404)
+        response = self.client.get(address, REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_FLUSH_SECONDS=0)
+    def test_dump_metrics_merges_processes(self):
+        """Сводка складывает живые процессы и забывает завершившиеся."""
+        other = metrics.Registry()
+        other.observe('posts:index', 200, {'db_queries': 1})
+        MetricsSnapshot.objects.create(
+            process='other-host:1', data=json.dumps(other.snapshot())
+        )
+        MetricsSnapshot.objects.create(
+            process='other-host:2', data=json.dumps(other.snapshot()),
+            updated=timezone.now() - timedelta(
+                seconds=settings.METRICS_PROCESS_TIMEOUT + 1
+            ),
+        )
+        self.client.get(reverse('posts:index'))
+        out = StringIO()
+        call_command('dump_metrics', stdout=out)
+        self.assertIn(
+            'yatube_requests_total{view="posts:index",status="200"} 2',
+            out.getvalue(),
+        )
+        self.assertFalse(
+            MetricsSnapshot.objects.filter(process='other-host:2').exists()
+        )
+
+    def test_merge_adds_histograms(self):
+        registry = metrics.Registry()
+        registry.observe('view', 200, {'db_queries': 2})
+        snapshot = registry.snapshot()
+        merged = metrics.merge([snapshot, snapshot])
+        histogram = merged['view']['histograms']['db_queries']
+        self.assertEqual(histogram['count'], 2)
+        self.assertEqual(histogram['sum'], 4)
+        self.assertEqual(merged['view']['statuses'], {'200': 2})
+
+
+class DatabaseSettingsTest(SimpleTestCase):
+    def test_sqlite_replicas(self):
+        config, replicas = databases.from_env(
+            {'DB_REPLICAS': 'replica.sqlite3'}, '/srv'
+        )
+        self.assertEqual(replicas, ['replica_1'])
+        self.assertEqual(config['default']['NAME'], '/srv/db.sqlite3')
+        self.assertEqual(
+            config['replica_1']['NAME'], '/srv/replica.sqlite3'
+        )
+        self.assertEqual(config['replica_1']['TEST'], {'MIRROR': 'default'})
+        self.assertEqual(config['default']['CONN_MAX_AGE'], 60)
+
+    def test_pooled_postgresql(self):
+        config, replicas = databases.from_env({
+            'DB_ENGINE': 'postgresql',
+            'DB_POOL': 'pgbouncer',
+            'DB_PORT': '6432',
+            'DB_REPLICAS': 'db-replica-1, db-replica-2:6433',
+        }, '/srv')
+        self.assertTrue(config['default']['DISABLE_SERVER_SIDE_CURSORS'])
+        self.assertEqual(replicas, ['replica_1', 'replica_2'])
+        self.assertEqual(
+            (config['replica_1']['HOST'], config['replica_1']['PORT']),
+            ('db-replica-1', '6432'),
+        )
+        self.assertEqual(config['replica_2']['PORT'], '6433')
+        self.assertEqual(config['replica_2']['TEST'], {'MIRROR': 'default'})
+
+    def test_sqlite_shards(self):
+        config, _ = databases.from_env({}, '/srv')
+        shards = databases.add_shards(
+            config, {'DB_SHARDS': 'shard1.sqlite3, /data/shard2.sqlite3'},
+            '/srv',
+        )
+        self.assertEqual(shards, ['shard_1', 'shard_2'])
+        self.assertEqual(config['shard_1']['NAME'], '/srv/shard1.sqlite3')
+        self.assertEqual(config['shard_2']['NAME'], '/data/shard2.sqlite3')
+        self.assertEqual(config['shard_1']['TEST'], {})
+
+    def test_search_backend_follows_engine(self):
+        self.assertEqual(
+            databases.search_backend({}), 'posts.search.SqliteFTS5Backend'
+        )
+        self.assertEqual(
+            databases.search_backend({'DB_ENGINE': 'postgresql'}),
+            'posts.search.SimpleSearchBackend',
+        )
+        self.assertEqual(
+            databases.search_backend({
+                'DB_ENGINE': 'postgresql', 'SEARCH_BACKEND': 'app.Search',
+            }),
+            'app.Search',
+        )
+
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            databases.from_env({'DB_ENGINE': 'oracle'}, '/srv')
+
+
+@override_settings(DATABASE_REPLICAS=['replica_1'])
+class PrimaryReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.router = routers.PrimaryReplicaRouter()
+        routers.start_request()
+
+    def tearDown(self):
+        routers.finish_request()
+
+    def test_reads_outside_replica_views_use_primary(self):
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+    def test_replica_view_reads_use_replica(self):
+        routers.read_from_replicas()
+        self.assertEqual(self.router.db_for_read(Post), 'replica_1')
+        self.assertEqual(self.router.db_for_write(Post), 'default')
+
+    def test_reads_after_write_use_primary(self):
+        routers.read_from_replicas()
+        self.router.db_for_write(Post)
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+        self.assertTrue(routers.finish_request())
+
+    def test_sticky_client_reads_primary(self):
+        routers.start_request(sticky=True)
+        routers.read_from_replicas()
+        self.assertEqual(self.router.db_for_read(Post), 'default')
+
+
+@skipUnless(
+    settings.DATABASE_REPLICAS,
+    'нужна реплика: DB_REPLICAS=replica.sqlite3'
+    ' python manage.py test core.tests.ReplicaRoutingTest',
+)
+class ReplicaRoutingTest(TestCase):
+    """Реплика в тестах - зеркало default: проверяем маршруты запросов."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='writer')
+        cls.post = Post.objects.create(author=cls.user, text='Тестовый пост')
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.aliases = []
+        for method in ('db_for_read', 'db_for_write'):
+            patcher = mock.patch.object(
+                routers.PrimaryReplicaRouter, method,
+                self.spy(getattr(routers.PrimaryReplicaRouter, method)),
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def spy(self, method):
+        def routed(router, model, **hints):
+            alias = method(router, model, **hints)
+            self.aliases.append((method.__name__, alias))
+            return alias
+        return routed
+
+    def routes(self, method):
+        routes = {alias for name, alias in self.aliases if name == method}
+        self.aliases.clear()
+        return routes
+
+    def test_feed_views_read_from_replica(self):
+        response = self.client.get(
+            reverse('posts:post_detail', args=(self.post.pk,))
+        )
+        self.assertContains(response, 'Тестовый пост')
+        self.assertEqual(
+            self.routes('db_for_read'), set(settings.DATABASE_REPLICAS)
+        )
+        self.assertNotIn(ReplicaRoutingMiddleware.cookie, response.cookies)
+
+    def test_writes_go_to_primary_and_stick_client(self):
+        self.client.force_login(self.user)
+        self.aliases.clear()
+        response = self.client.post(
+            reverse('posts:add_comment', args=(self.post.pk,)),
+            {'text': 'Комментарий'},
+        )
+        self.assertEqual(self.routes('db_for_write'), {'default'})
+        self.assertIn(ReplicaRoutingMiddleware.cookie, response.cookies)
+        response = self.client.get(
+            reverse('posts:post_detail', args=(self.post.pk,))
+        )
+        self.assertContains(response, 'Комментарий')
+        self.assertEqual(self.routes('db_for_read'), {'default'})
+
+    def test_replicas_are_not_migrated(self):
+        router = routers.PrimaryReplicaRouter()
+        for alias in settings.DATABASE_REPLICAS:
+            self.assertIs(router.allow_migrate(alias, 'posts'), False)
+        self.assertIsNone(router.allow_migrate('default', 'posts'))
+
+
+@override_settings(SQLITE_RETRY_DELAY=0)
+class RetryOnLockTest(TransactionTestCase):
+    def failing(self, error, times):
+        calls = []
+
+        @retry_on_lock
+        def view(request):
+            calls.append([
+                connections[alias].in_atomic_block
+                for alias in ('default', *settings.DATABASE_SHARDS)
+            ])
+            if len(calls) <= times:
+                raise OperationalError(error)
+            return 'ok'
+        return view, calls
+
+    def setUp(self):
+        self.request = RequestFactory().post('/')
+
+    def test_locked_write_is_retried(self):
+        view, calls = self.failing('database is locked', 2)
+        self.assertEqual(view(self.request), 'ok')
+        self.assertEqual(len(calls), 3)
+
+    def test_write_runs_in_transaction_on_every_database(self):
+        view, calls = self.failing('database is locked', 0)
+        view(self.request)
+        self.assertTrue(all(calls[0]))
+
+    def test_read_runs_without_transaction(self):
+        view, calls = self.failing('database is locked', 0)
+        view(RequestFactory().get('/'))
+        self.assertFalse(any(calls[0]))
+
+    def test_gives_up_after_attempts(self):
+        view, calls = self.failing('database is locked', 100)
+        with self.assertRaises(OperationalError):
+            view(self.request)
+        self.assertEqual(len(calls), settings.SQLITE_WRITE_ATTEMPTS)
+
+    def test_other_errors_are_not_retried(self):
+        view, calls = self.failing('no such table: posts_post', 1)
+        with self.assertRaises(OperationalError):
+            view(self.request)
+        self.assertEqual(len(calls), 1)
+
+
+class SqliteConcurrencyTest(TransactionTestCase):
+    """Читатели и писатели в потоках не получают «database is locked»."""
+
+    writers = 4
+    readers = 4
+    rounds = 10
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        self.post = Post.objects.create(
+            author=self.author, group=self.group, text='Пост'
+        )
+        self.users = [
+            User.objects.create_user(username=f'user_{i}')
+            for i in range(self.writers + self.readers)
+        ]
+
+    def run_threads(self, targets):
+        errors = []
+
+        def run(target, user):
+            try:
+                client = Client()
+                client.force_login(user)
+                target(client)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connections.close_all()
+
+        threads = [
+            threading.Thread(target=run, args=(target, user))
+            for target, user in zip(targets, self.users)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def write(self, client):
+        for i in range(self.rounds):
+            response = client.post(
+                reverse('posts:add_comment', args=(self.post.pk,)),
+                {'text': f'Комментарий {i}'},
+            )
+            self.assertEqual(response.status_code, 302)
+            response = client.post(
+                reverse('posts:post_create'),
+                {'text': f'Пост {i}', 'group': self.group.pk},
+            )
+            self.assertEqual(response.status_code, 302)
+
+    def read(self, client):
+        addresses = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.author.username,)),
+            reverse('posts:post_detail', args=(self.post.pk,)),
+            reverse('posts:follow_index'),
+        )
+        for _ in range(self.rounds):
+            for address in addresses:
+                self.assertEqual(client.get(address).status_code, 200)
+
+    def test_wal_is_enabled(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+    def test_concurrent_reads_and_writes(self):
+        errors = self.run_threads(
+            [self.write] * self.writers + [self.read] * self.readers
+        )
+        self.assertEqual(errors, [])
+        expected = self.writers * self.rounds
+        alias = self.post._state.db
+        self.assertEqual(Comment.objects.using(alias).count(), expected)
+        self.assertEqual(
+            Post.objects.using(alias).get(pk=self.post.pk).comment_count,
+            expected,
+        )
+        self.assertEqual(sum(
+            posts.count() for posts in
+            shards.querysets(Post.objects.filter(group=self.group))
+        ), expected + 1)
+
+
+CALLS = []
+
+
+@tasks.task
+def record(value):
+    CALLS.append(value)
+
+
+@tasks.task(max_attempts=2)
+def explode():
+    raise ValueError('сбой')
+
+
+@override_settings(TASKS_EAGER=False, TASKS_RETRY_DELAY=0)
+class TaskQueueTest(TestCase):
+    def setUp(self):
+        CALLS.clear()
+        self.worker = tasks.Worker('test')
+
+    def run_queue(self):
+        self.worker.run(threading.Event(), once=True)
+
+    def test_task_runs_in_worker(self):
+        tasks.enqueue(record, 'первая')
+        self.assertEqual(CALLS, [])
+        self.run_queue()
+        self.assertEqual(CALLS, ['первая'])
+        task = Task.objects.get()
+        self.assertEqual(
+            (task.status, task.attempts, task.worker), (Task.DONE, 1, 'test')
+        )
+
+    @override_settings(TASKS_EAGER=True, TASKS_EAGER_ON_COMMIT=False)
+    def test_eager_mode_runs_immediately(self):
+        tasks.enqueue(record, 'сразу')
+        self.assertEqual(CALLS, ['сразу'])
+        self.assertFalse(Task.objects.exists())
+
+    def test_idempotency_key(self):
+        tasks.enqueue(record, 1, key='record:1')
+        tasks.enqueue(record, 1, key='record:1')
+        self.run_queue()
+        tasks.enqueue(record, 1, key='record:1')
+        self.run_queue()
+        self.assertEqual(CALLS, [1])
+
+    def test_delayed_task_waits(self):
+        tasks.enqueue(record, 'потом', delay=60)
+        self.run_queue()
+        self.assertEqual(CALLS, [])
+
+    def test_rolled_back_task_is_not_queued(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            tasks.enqueue(record, 'откат')
+            raise ValueError
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASKS_RETRY_DELAY=60)
+    def test_failed_task_is_retried_then_failed(self):
+        tasks.enqueue(explode)
+        with self.assertLogs('core.tasks', 'WARNING'):
+            self.run_queue()
+        task = Task.objects.get()
+        self.assertEqual((task.status, task.attempts), (Task.QUEUED, 1))
+        self.assertGreater(task.run_at, timezone.now())
+        self.assertIn('ValueError: сбой', task.error)
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs('core.tasks', 'ERROR'):
+            self.run_queue()
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 2))
+
+    def test_failed_task_frees_key(self):
+        tasks.enqueue(explode, key='explode')
+        Task.objects.update(attempts=F('max_attempts') - 1)
+        with self.assertLogs('core.tasks', 'ERROR'):
+            self.run_queue()
+        tasks.enqueue(explode, key='explode')
+        self.assertEqual(
+            list(Task.objects.order_by('pk').values_list('status', 'key')),
+            [(Task.FAILED, None), (Task.QUEUED, 'explode')],
+        )
+
+    def test_backoff_grows(self):
+        with override_settings(TASKS_RETRY_DELAY=10,
+                               TASKS_RETRY_MAX_DELAY=60):
+            delays = [tasks.backoff(attempt) for attempt in (1, 2, 3, 10)]
+        self.assertTrue(5 <= delays[0] <= 10)
+        self.assertTrue(10 <= delays[1] <= 20)
+        self.assertTrue(20 <= delays[2] <= 40)
+        self.assertTrue(30 <= delays[3] <= 60)
+
+    def test_stale_task_is_requeued(self):
+        Task.objects.create(
+            name=record.task_name, args='["снова"]', status=Task.RUNNING,
+            attempts=1, started=timezone.now() - timezone.timedelta(days=1),
+        )
+        self.run_queue()
+        self.run_queue()
+        self.assertEqual(CALLS, ['снова'])
+        self.assertEqual(Task.objects.get().attempts, 2)
+
+    def test_new_post_is_fanned_out_by_worker(self):
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=author)
+        post = Post.objects.create(author=author, text='Пост')
+        self.assertFalse(FeedEntry.objects.filter(post=post).exists())
+        self.run_queue()
+        self.assertTrue(
+            FeedEntry.objects.filter(post=post, user=reader).exists()
+        )
+
+    def test_status(self):
+        tasks.enqueue(record, 1)
+        tasks.enqueue(record, 2)
+        out = StringIO()
+        call_command('run_workers', '--status', stdout=out)
+        counts = dict(line.split() for line in out.getvalue().splitlines())
+        self.assertEqual(counts, {
+            'queued': '2', 'running': '0', 'done': '0', 'failed': '0',
+        })
+
+
+@override_settings(TASKS_EAGER=True, TASKS_EAGER_ON_COMMIT=True)
+class EagerTaskTest(TransactionTestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_eager_task_runs_after_commit(self):
+        with transaction.atomic():
+            tasks.enqueue(record, 'после фиксации')
+            self.assertEqual(CALLS, [])
+        self.assertEqual(CALLS, ['после фиксации'])
+
+    def test_rolled_back_eager_task_does_not_run(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            tasks.enqueue(record, 'откат')
+            raise ValueError
+        self.assertEqual(CALLS, [])
+
+
+@override_settings(TASKS_EAGER=False)
+class RunWorkersTest(TransactionTestCase):
+    def setUp(self):
+        CALLS.clear()
+
+    def test_thread_pool_drains_queue(self):
+        for value in range(20):
+            tasks.enqueue(record, value)
+        call_command('run_workers', '--once', '--workers', '3')
+        self.assertEqual(sorted(CALLS), list(range(20)))
+        self.assertEqual(tasks.status()[Task.DONE], 20)
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, TASKS_EAGER=False)
+class ContentAddressedStorageTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def save(self, name, data):
+        return storage.content_storage.save(name, ContentFile(data))
+
+    def test_name_is_sharded_content_hash(self):
+        name = self.save('posts/Кот.JPG', b'cat')
+        digest = storage.file_hash(ContentFile(b'cat'))
+        self.assertEqual(
+            name, f'posts/{digest[:2]}/{digest[2:4]}/{digest}.jpg'
+        )
+        self.assertTrue(storage.is_hashed(name))
+        self.assertFalse(storage.is_hashed('posts/cat.jpg'))
+        with storage.content_storage.open(name) as stored:
+            self.assertEqual(stored.read(), b'cat')
+
+    def test_same_content_is_stored_once(self):
+        first = self.save('posts/a.gif', b'same')
+        second = self.save('posts/b.gif', b'same')
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, self.save('posts/a.gif', b'other'))
+        directory = os.path.dirname(storage.content_storage.path(first))
+        self.assertEqual(len(os.listdir(directory)), 1)
+
+    def test_file_is_collected_after_last_release(self):
+        name = self.save('posts/a.gif', b'shared')
+        storage.acquire(name)
+        storage.acquire(name)
+        storage.release(name)
+        self.assertFalse(Task.objects.exists())
+        storage.release(name)
+        task = Task.objects.get()
+        self.assertGreater(task.run_at, timezone.now())
+        Task.objects.update(run_at=timezone.now())
+        tasks.Worker('test').run(threading.Event(), once=True)
+        self.assertFalse(StoredFile.objects.exists())
+        self.assertFalse(storage.content_storage.exists(name))
+
+    def test_reacquired_file_is_not_collected(self):
+        name = self.save('posts/a.gif', b'again')
+        storage.acquire(name)
+        storage.release(name)
+        storage.acquire(name)
+        Task.objects.update(run_at=timezone.now())
+        tasks.Worker('test').run(threading.Event(), once=True)
+        self.assertEqual(StoredFile.objects.get().refs, 1)
+        self.assertTrue(storage.content_storage.exists(name))
@@ -1,8 +1,12 @@
 
 from http import HTTPStatus
 
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.shortcuts import render
 
+from . import metrics
+
 
 def page_not_found(request, exception):
     return render(
@@ -27,3 +31,15 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html', status=HTTPStatus.FORBIDDEN)
+
+
+def metrics_view(request):
+    allowed = settings.METRICS_ALLOWED_IPS
+    if not settings.METRICS_ENDPOINT_ENABLED or (
+        allowed and request.META.get('REMOTE_ADDR') not in allowed
+    ):
+        raise Http404
+    return HttpResponse(
+        metrics.render_prometheus(metrics.registry.snapshot()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
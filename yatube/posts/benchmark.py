@@ -0,0 +1,369 @@
+"""Нагрузочные замеры view приложения posts.
+
+generate_dataset наполняет БД пользователями, группами, постами,
+комментариями и подписками через bulk_create, после чего пересобирает
+денормализованные данные (ленты, счётчики, поисковый индекс), которые
+обычно поддерживают сигналы. run_benchmark прогоняет запросы к лентам
+через тестовый клиент и считает перцентили задержки, число запросов
+к БД, время рендера шаблонов и пропускную способность.
+
+generate_images и page_weight замеряют вес страниц с картинками:
+сколько байт HTML и картинок получит устройство с данной шириной
+экрана, плотностью пикселей и поддержкой форматов, если выберет из
+<picture> вариант так же, как браузер.
+"""
+import random
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+from html.parser import HTMLParser
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from PIL import Image
+
+from core import metrics
+
+from . import counters, feed, search, shards
+from .models import Comment, Follow, Group, Post, User
+from .utils import CursorPaginator, set_excerpt
+
+BATCH_SIZE = 5000
+VIEWS = (
+    'posts:index',
+    'posts:group_list',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:follow_index',
+)
+
+
+def _bulk(model, objects):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == BATCH_SIZE:
+            model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        model.objects.bulk_create(batch)
+
+
+def _ids(model):
+    return list(model.objects.order_by('pk').values_list('pk', flat=True))
+
+
+def _post_ids():
+    # Посты лежат на шардах, пользователи и группы - в default.
+    return sorted(
+        pk for posts in shards.querysets(Post.objects.all())
+        for pk in posts.values_list('pk', flat=True)
+    )
+
+
+def generate_dataset(posts, users=None, groups=10, comments_per_post=2,
+                     follows_per_user=20, seed=0):
+    """Создаёт набор данных заданного размера; возвращает его описание."""
+    rng = random.Random(seed)
+    users = users or max(posts // 20, 2)
+    _bulk(User, (
+        User(username=f'bench_user_{i}', password='!') for i in range(users)
+    ))
+    _bulk(Group, (
+        Group(title=f'Группа {i}', slug=f'bench-{i}', description='-')
+        for i in range(groups)
+    ))
+    shards.sync_reference_tables()
+    user_ids, group_ids = _ids(User), _ids(Group)
+    words = ('пост', 'книга', 'кот', 'программирование', 'погода', 'город',
+             'музыка', 'фильм', 'утро', 'дорога')
+
+    def post():
+        post = Post(
+            author_id=rng.choice(user_ids),
+            group_id=rng.choice(group_ids + [None]),
+            text=' '.join(rng.choices(words, k=rng.randint(5, 60))),
+        )
+        set_excerpt(post)
+        return post
+
+    _bulk(Post, (post() for _ in range(posts)))
+    post_ids = _post_ids()
+    _bulk(Comment, (
+        Comment(
+            post_id=rng.choice(post_ids),
+            author_id=rng.choice(user_ids),
+            text='Комментарий',
+        )
+        for _ in range(posts * comments_per_post)
+    ))
+    pairs = set()
+    for user_id in user_ids:
+        for author_id in rng.sample(
+            user_ids, min(follows_per_user, len(user_ids))
+        ):
+            if author_id != user_id:
+                pairs.add((user_id, author_id))
+    _bulk(Follow, (
+        Follow(user_id=user_id, author_id=author_id)
+        for user_id, author_id in sorted(pairs)
+    ))
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        batch = user_ids[start:start + BATCH_SIZE]
+        counters.reconcile_authors(batch)
+        feed.update_feed_mode(batch)
+    for start in range(0, len(post_ids), BATCH_SIZE):
+        counters.reconcile_posts(post_ids[start:start + BATCH_SIZE])
+    for user_id in user_ids:
+        feed.rebuild_feed(user_id)
+    search.get_backend().rebuild(
+        row for posts in shards.querysets(Post.objects.all())
+        for row in posts.values_list('pk', 'text').iterator()
+    )
+    return {
+        'users': len(user_ids),
+        'groups': len(group_ids),
+        'posts': len(post_ids),
+        'comments': posts * comments_per_post,
+        'follows': len(pairs),
+    }
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    index = min(int(round(share * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class Targets:
+    """Случайные адреса для каждого view, включая глубокие страницы."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.posts = [
+            post for posts in shards.querysets(
+                Post.objects.select_related('author', 'group')
+            )
+            for post in posts.order_by('?')[:200]
+        ]
+        self.paginator = CursorPaginator(None, 1)
+        self.reader = User.objects.order_by('pk').first()
+
+    def deep(self, post):
+        # Курсор «после случайного поста» ведёт на страницу в глубине ленты.
+        if self.rng.random() < 0.5:
+            return {}
+        return {'cursor': self.paginator.encode_cursor(post)}
+
+    def __call__(self, view_name):
+        post = self.rng.choice(self.posts)
+        if view_name == 'posts:group_list':
+            while post.group is None:
+                post = self.rng.choice(self.posts)
+            return (reverse(view_name, args=(post.group.slug,)),
+                    self.deep(post))
+        if view_name == 'posts:profile':
+            return (reverse(view_name, args=(post.author.username,)),
+                    self.deep(post))
+        if view_name == 'posts:post_detail':
+            return reverse(view_name, args=(post.pk,)), {}
+        return reverse(view_name), self.deep(post)
+
+
+def run_benchmark(requests=200, views=VIEWS, anonymous=False, seed=0):
+    """Прогоняет views и возвращает метрики по каждому из них."""
+    rng = random.Random(seed)
+    targets = Targets(rng)
+    client = Client()
+    if not anonymous:
+        client.force_login(targets.reader)
+    results = {}
+    for view_name in views:
+        if anonymous and view_name == 'posts:follow_index':
+            continue
+        latencies, queries = [], []
+        statuses = defaultdict(int)
+        metrics.registry.reset()
+        started = time.perf_counter()
+        for _ in range(requests):
+            path, params = targets(view_name)
+            with ExitStack() as stack:
+                contexts = [
+                    stack.enter_context(
+                        CaptureQueriesContext(connections[alias])
+                    )
+                    for alias in (DEFAULT_DB_ALIAS, *settings.DATABASE_SHARDS)
+                ]
+                begin = time.perf_counter()
+                response = client.get(path, params)
+                latencies.append(time.perf_counter() - begin)
+            queries.append(
+                sum(len(context.captured_queries) for context in contexts)
+            )
+            statuses[response.status_code] += 1
+        elapsed = time.perf_counter() - started
+        render = metrics.registry.snapshot()[view_name]['histograms'][
+            'template_render_seconds'
+        ]
+        results[view_name] = {
+            'requests': requests,
+            'statuses': dict(statuses),
+            'p50_ms': percentile(latencies, 0.50) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+            'mean_queries': sum(queries) / len(queries),
+            'max_queries': max(queries),
+            'mean_render_ms': render['sum'] / render['count'] * 1000,
+            'throughput_rps': requests / elapsed,
+        }
+    return results
+
+
+def photo(rng, width, height):
+    """JPEG, похожий на фотографию: плавные пятна, а не белый шум."""
+    small = (max(width // 16, 1), max(height // 16, 1))
+    image = Image.frombytes(
+        'RGB', small, bytes(rng.getrandbits(8) for _ in range(
+            small[0] * small[1] * 3
+        ))
+    ).resize((width, height), Image.BICUBIC)
+    output = BytesIO()
+    image.save(output, 'JPEG', quality=90)
+    return output.getvalue()
+
+
+def generate_images(posts, width=2400, height=1600, seed=0):
+    """Создаёт авторов и posts постов с картинками width x height."""
+    rng = random.Random(seed)
+    authors = [
+        User.objects.create_user(username=f'bench_photographer_{i}')
+        for i in range(max(posts // 10, 1))
+    ]
+    for i in range(posts):
+        Post.objects.create(
+            author=rng.choice(authors),
+            text=f'Фото {i}',
+            image=ContentFile(photo(rng, width, height), f'photo_{i}.jpg'),
+        )
+    return {'posts': posts, 'image': f'{width}x{height}'}
+
+
+class Device:
+    """Клиент: ширина окна, плотность пикселей и понятные ему форматы.
+
+    types=None - старая разметка: берётся только <img src>.
+    """
+
+    def __init__(self, name, viewport, density, types=()):
+        self.name = name
+        self.viewport = viewport
+        self.density = density
+        self.types = None if types is None else set(types)
+
+    def slot(self, sizes):
+        """Ширина картинки в CSS-пикселях по атрибуту sizes."""
+        for condition in sizes.split(','):
+            condition = condition.strip()
+            if not condition.startswith('(max-width:'):
+                return self.size(condition)
+            limit, size = condition[len('(max-width:'):].split(')')
+            if self.viewport <= int(limit.strip().rstrip('px')):
+                return self.size(size.strip())
+        return self.viewport
+
+    def size(self, value):
+        if value.endswith('vw'):
+            return self.viewport * int(value[:-2]) / 100
+        return int(value.rstrip('px'))
+
+    def choose(self, picture):
+        """URL, который браузер загрузит из <picture>."""
+        if self.types is None:
+            return picture['img']['src']
+        sources = picture['sources'] + [picture['img']]
+        element = next(
+            source for source in sources
+            if source.get('type') is None or source['type'] in self.types
+        )
+        if not element.get('srcset'):
+            return element['src']
+        target = self.slot(element.get('sizes', '')) * self.density
+        candidates = sorted(
+            (int(width.rstrip('w')), url)
+            for url, width in (
+                candidate.split() for candidate in element['srcset'].split(',')
+            )
+        )
+        for width, url in candidates:
+            if width >= target:
+                return url
+        return candidates[-1][1]
+
+
+DEVICES = (
+    # Как до <picture>: всем один JPEG базового размера.
+    Device('до: один JPEG всем', 1280, 1, types=None),
+    Device('телефон 360px 2x, WebP', 360, 2, {'image/webp'}),
+    Device('телефон 390px 3x, AVIF', 390, 3, {'image/avif', 'image/webp'}),
+    Device('ноутбук 1280px 1x, WebP', 1280, 1, {'image/webp'}),
+    Device('ноутбук 1440px 2x, WebP', 1440, 2, {'image/webp'}),
+    Device('старый браузер 1280px, JPEG', 1280, 1),
+)
+
+
+class PictureParser(HTMLParser):
+    """Собирает из HTML элементы <picture> с их <source> и <img>."""
+
+    def __init__(self):
+        super().__init__()
+        self.pictures = []
+        self.current = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'picture':
+            self.current = {'sources': [], 'img': None}
+        elif self.current is not None and tag == 'source':
+            self.current['sources'].append(attrs)
+        elif self.current is not None and tag == 'img':
+            self.current['img'] = attrs
+
+    def handle_endtag(self, tag):
+        if tag == 'picture' and self.current is not None:
+            self.pictures.append(self.current)
+            self.current = None
+
+
+def media_size(url):
+    return default_storage.size(url[len(settings.MEDIA_URL):])
+
+
+def page_weight(paths, devices=DEVICES):
+    """Средний вес страниц paths для каждого устройства, в байтах."""
+    client = Client()
+    pages = []
+    for path in paths:
+        html = client.get(path).content
+        parser = PictureParser()
+        parser.feed(html.decode())
+        pages.append((len(html), parser.pictures))
+    results = {}
+    for device in devices:
+        images = sum(
+            media_size(device.choose(picture))
+            for _, pictures in pages for picture in pictures
+        )
+        html = sum(size for size, _ in pages)
+        results[device.name] = {
+            'html_bytes': html / len(pages),
+            'image_bytes': images / len(pages),
+            'images': sum(len(pictures) for _, pictures in pages) / len(pages),
+        }
+    return results
@@ -0,0 +1,208 @@
+"""Кэш отрендеренных страниц лент для анонимных посетителей.
+
+Ключ страницы содержит версию области (вся лента, группа или автор).
+Сигналы Post, Comment и Follow увеличивают версию затронутых областей,
+и старые страницы просто перестают запрашиваться, а затем вытесняются
+по таймауту. Версии хранятся в том же кэше, что и страницы, поэтому
+схема работает с любым бэкендом: locmem, файловым или БД.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+
+from .models import Post, PostKey
+from .utils import CursorPaginator
+
+VERSION_KEY = 'feed-version'
+PAGE_KEY = 'feed-page'
+POST_AUTHOR_KEY = 'post-author'
+
+
+def index_scope():
+    return 'index'
+
+
+def group_scope(slug):
+    return f'group:{slug}'
+
+
+def author_scope(username):
+    return f'author:{username}'
+
+
+def post_scope(post_id):
+    return f'post:{post_id}'
+
+
+def post_author_scope(post_id):
+    """Область автора поста; None, если поста нет.
+
+    Автор поста не меняется, поэтому имя кэшируется и проверка ETag
+    страницы поста обычно обходится без запроса к БД.
+    """
+    key = make_key(POST_AUTHOR_KEY, post_id)
+    username = cache.get(key)
+    if username is None:
+        # При шардировании автора поста называет PostKey в default.
+        posts = PostKey.objects if settings.DATABASE_SHARDS else Post.objects
+        username = posts.filter(pk=post_id).values_list(
+            'author__username', flat=True
+        ).first()
+        if username is None:
+            return None
+        cache.set(key, username, settings.PAGE_CACHE_TIMEOUT)
+    return author_scope(username)
+
+
+def make_key(prefix, *parts):
+    """Ключ кэша: prefix и хэш частей.
+
+    Области содержат слаги и имена пользователей, в том числе
+    кириллические, а memcached принимает только короткие ASCII-ключи.
+    """
+    digest = hashlib.md5(
+        '\0'.join(str(part) for part in parts).encode()
+    ).hexdigest()
+    return f'{prefix}:{digest}'
+
+
+def _initial_version():
+    # Версия от времени, а не от единицы: если ключ версии вытеснен,
+    # новая версия не совпадёт с версией закэшированных страниц.
+    return int(time.time() * 1000)
+
+
+def get_version(scope):
+    key = make_key(VERSION_KEY, scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), None)
+        version = cache.get(key, 0)
+    return version
+
+
+def bump(*scopes):
+    for scope in scopes:
+        key = make_key(VERSION_KEY, scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), None)
+
+
+def bump_posts(rows):
+    """Сбрасывает страницы с постами rows: (id, имя автора, slug группы)."""
+    scopes = {index_scope()}
+    for pk, username, slug in rows:
+        scopes.add(post_scope(pk))
+        scopes.add(author_scope(username))
+        if slug:
+            scopes.add(group_scope(slug))
+    bump(*scopes)
+
+
+def _page_query(request):
+    """page или курсор запроса в канонической записи.
+
+    None - параметры негодные: view покажет первую страницу, но
+    кэшировать её под таким ключом нельзя, иначе произвольные строки
+    запроса заполнят и вытеснят кэш.
+    """
+    page = request.GET.get('page')
+    if page is not None:
+        if not page.isdigit() or int(page) < 1:
+            return None
+        return f'page={int(page)}'
+    cursor = request.GET.get('cursor')
+    if not cursor:
+        return ''
+    cursor = CursorPaginator(Post.objects.none(), 1).clean_cursor(cursor)
+    return None if cursor is None else f'cursor={cursor}'
+
+
+def cache_feed_page(scope):
+    """Кэширует страницу ленты для анонимных GET-запросов.
+
+    scope получает те же именованные аргументы, что и view, и возвращает
+    область, по версии которой инвалидируется страница. Кэшируется сам
+    ответ, с заголовками, как в CacheMiddleware.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method != 'GET' or request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            query = _page_query(request)
+            if query is None:
+                return view(request, *args, **kwargs)
+            area = scope(**kwargs)
+            key = make_key(
+                PAGE_KEY, view.__name__, area, get_version(area), query
+            )
+            response = cache.get(key)
+            if response is not None:
+                return response
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.cookies:
+                cache.set(key, response, settings.PAGE_CACHE_TIMEOUT)
+            return response
+        return wrapper
+    return decorator
+
+
+def page_etag(*scopes, forms=False):
+    """etag_func для condition: версии областей страницы и посетитель.
+
+    Страница авторизованного пользователя отличается шапкой и кнопками,
+    поэтому в ETag входит его id. На странице с формами (forms=True)
+    в ETag входит и CSRF-cookie: после её смены (например, при входе)
+    токен в сохранённой браузером странице уже не подходит.
+    """
+    def etag(request, *args, **kwargs):
+        areas = [scope(**kwargs) for scope in scopes]
+        if None in areas:
+            return None
+        versions = ';'.join(f'{area}={get_version(area)}' for area in areas)
+        viewer = ''
+        if request.user.is_authenticated:
+            viewer = request.user.pk
+            if forms:
+                # get_token каждый раз маскирует секрет заново, а
+                # значение cookie постоянно, пока не сменится секрет.
+                get_token(request)
+                viewer = f'{viewer};{request.META["CSRF_COOKIE"]}'
+        return hashlib.md5(f'{versions};{viewer}'.encode()).hexdigest()
+    return etag
+
+
+def conditional_page(*scopes, forms=False):
+    """Отвечает 304, пока не изменились версии областей страницы.
+
+    ETag строится по версиям из кэша, поэтому 304 отдаётся до выборки
+    постов и рендера шаблона. no-cache разрешает браузеру и CDN хранить
+    страницу, но требует перепроверять её по ETag при каждом запросе.
+    """
+    def decorator(view):
+        conditional = condition(
+            etag_func=page_etag(*scopes, forms=forms)
+        )(view)
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            response = conditional(request, *args, **kwargs)
+            if response.has_header('ETag'):
+                visibility = (
+                    'private' if request.user.is_authenticated else 'public'
+                )
+                patch_cache_control(
+                    response, no_cache=True, **{visibility: True}
+                )
+            return response
+        return wrapper
+    return decorator
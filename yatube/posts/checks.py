@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+# Кэши, которые у каждого процесса свои
+LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',)
+
+
+@register()
+def check_shard_cache(app_configs, **kwargs):
+    """Шарды авторов кэшируются: кэш должен быть общим (posts.shards)."""
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DATABASE_SHARDS and backend in LOCAL_CACHES:
+        return [Error(
+            'С DB_SHARDS нужен общий для процессов кэш: после '
+            'rebalance_shards процессы с локальным кэшем читают и пишут '
+            'посты перенесённого автора на старом шарде.',
+            hint='Задайте CACHE_BACKEND, например FileBasedCache или '
+                 'memcached.',
+            id='posts.E001',
+        )]
+    return []
@@ -0,0 +1,155 @@
+"""Денормализованные счётчики постов, подписчиков и комментариев.
+
+Счётчики меняются сигналами одним UPDATE с F-выражением, поэтому
+параллельные записи не теряют инкременты. Массовые операции в обход
+сигналов (bulk_create, raw SQL) приводят к расхождению, которое
+исправляет команда reconcile_counters.
+"""
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import shards
+from .models import AuthorCounters, Comment, Follow, Post
+
+
+def _change(queryset, field, delta):
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def for_author_id(author_id):
+    """Счётчики автора; при первом обращении считаются по таблицам."""
+    try:
+        return AuthorCounters.objects.get(author_id=author_id)
+    except AuthorCounters.DoesNotExist:
+        pass
+    followers = Follow.objects.filter(author_id=author_id).count()
+    counters, _ = AuthorCounters.objects.get_or_create(
+        author_id=author_id,
+        defaults={
+            'post_count': Post.objects.using(
+                shards.for_author(author_id)
+            ).filter(author_id=author_id).count(),
+            'follower_count': followers,
+            'feed_mode': (
+                AuthorCounters.MERGE
+                if followers > settings.FEED_FANOUT_LIMIT
+                else AuthorCounters.FAN_OUT
+            ),
+        },
+    )
+    return counters
+
+
+def for_author(author):
+    try:
+        return author.counters
+    except AuthorCounters.DoesNotExist:
+        author.counters = for_author_id(author.pk)
+        return author.counters
+
+
+def change_author(author_id, field, delta):
+    queryset = AuthorCounters.objects.filter(author_id=author_id)
+    if not _change(queryset, field, delta) and delta > 0:
+        # Строки ещё нет: создаём её подсчётом по таблицам, которые
+        # уже включают новую запись.
+        for_author_id(author_id)
+
+
+def change_comments(post_id, delta, using=None):
+    using = using or shards.for_post(post_id)
+    _change(
+        Post.objects.using(using).filter(pk=post_id), 'comment_count', delta
+    )
+
+
+def _fix(model, rows, actual, fields, using=None):
+    """Сравнивает rows с actual и сохраняет расхождения одной пачкой."""
+    drifted = []
+    for obj in rows:
+        expected = actual.get(obj.pk, {})
+        changed = False
+        for field in fields:
+            value = expected.get(field, 0)
+            if getattr(obj, field) != value:
+                setattr(obj, field, value)
+                changed = True
+        if changed:
+            drifted.append(obj)
+    if drifted:
+        model.objects.using(using).bulk_update(drifted, fields)
+    return len(drifted)
+
+
+def reconcile_authors(author_ids):
+    """Пересчитывает счётчики пачки авторов, возвращает число исправлений."""
+    actual = {author_id: {} for author_id in author_ids}
+    for alias, ids in shards.by_alias(shards.for_authors(author_ids)).items():
+        posts = (
+            Post.objects.using(alias).filter(author_id__in=ids)
+            .order_by().values('author').annotate(total=Count('id'))
+        )
+        for row in posts:
+            actual[row['author']]['post_count'] = row['total']
+    followers = (
+        Follow.objects.filter(author_id__in=author_ids)
+        .order_by().values('author').annotate(total=Count('id'))
+    )
+    for row in followers:
+        actual[row['author']]['follower_count'] = row['total']
+    existing = set(
+        AuthorCounters.objects.filter(author_id__in=author_ids)
+        .values_list('pk', flat=True)
+    )
+    missing = [
+        AuthorCounters(author_id=author_id, **actual[author_id])
+        for author_id in author_ids if author_id not in existing
+    ]
+    AuthorCounters.objects.bulk_create(missing, ignore_conflicts=True)
+    fixed = len(missing)
+    fixed += _fix(
+        AuthorCounters,
+        AuthorCounters.objects.filter(author_id__in=existing),
+        actual,
+        ('post_count', 'follower_count'),
+    )
+    return fixed
+
+
+def reconcile_posts(post_ids):
+    fixed = 0
+    for alias, ids in shards.by_alias(shards.for_posts(post_ids)).items():
+        actual = {post_id: {} for post_id in ids}
+        comments = (
+            Comment.objects.using(alias).filter(post_id__in=ids)
+            .order_by().values('post').annotate(total=Count('id'))
+        )
+        for row in comments:
+            actual[row['post']]['comment_count'] = row['total']
+        fixed += _fix(
+            Post,
+            Post.objects.using(alias).filter(pk__in=ids)
+            .only('comment_count'),
+            actual,
+            ('comment_count',),
+            using=alias,
+        )
+    return fixed
+
+
+def recount_comments(post_ids):
+    """Пересчитывает comment_count пачки постов UPDATE на шард."""
+    comments = (
+        Comment.objects.filter(post=OuterRef('pk'))
+        .order_by().values('post').annotate(total=Count('id'))
+        .values('total')
+    )
+    return sum(
+        Post.objects.using(alias).filter(pk__in=ids).update(
+            comment_count=Coalesce(Subquery(comments), 0)
+        )
+        for alias, ids in shards.by_alias(shards.for_posts(post_ids)).items()
+    )
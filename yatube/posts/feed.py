@@ -0,0 +1,320 @@
+"""Лента подписок с раскладкой постов по подписчикам при записи.
+
+Новый пост сразу копируется в ленты (FeedEntry) всех подписчиков
+автора, поэтому follow_index читает ленту одним диапазоном по индексу
+(user, pub_date). Для популярных авторов, у которых подписчиков больше
+FEED_FANOUT_LIMIT, раскладка не делается: их посты подмешиваются
+в ленту при чтении.
+
+Режим автора хранится в AuthorCounters.feed_mode и меняет его только
+update_feed_mode, а не сравнение с текущим follower_count: посты,
+написанные без раскладки, не должны пропасть из лент, когда
+подписчиков снова станет меньше порога. Назад к раскладке автор идёт
+через BACKFILL: новые посты уже раскладываются, а ленты читают его
+слиянием, пока задача backfill_author не разложит прежние посты.
+"""
+from django.conf import settings
+from django.db import connection
+from django.utils.dateparse import parse_datetime
+
+from core.tasks import enqueue, task
+
+from . import counters, shards
+from .models import AuthorCounters, FeedEntry, Follow, Post
+from .utils import CursorPaginator, MergedCursorPaginator
+
+BATCH_SIZE = 500
+
+
+def is_popular(author_id):
+    """Посты автора не раскладываются по лентам подписчиков."""
+    mode = counters.for_author_id(author_id).feed_mode
+    return mode == AuthorCounters.MERGE
+
+
+def _followed(user, modes):
+    return list(
+        AuthorCounters.objects.filter(
+            author__in=Follow.objects.filter(user=user).values('author'),
+            feed_mode__in=modes,
+        ).values_list('author', flat=True)
+    )
+
+
+def popular_authors(user):
+    """Авторы из подписок user, посты которых читаются без раскладки."""
+    return _followed(user, (AuthorCounters.MERGE, AuthorCounters.BACKFILL))
+
+
+def _resume_limit():
+    limit = settings.FEED_FANOUT_LIMIT
+    return int(limit * (1 - settings.FEED_FANOUT_HYSTERESIS))
+
+
+def stop_fan_out(author_ids):
+    """Переводит авторов с подписчиками больше порога в слияние."""
+    AuthorCounters.objects.filter(
+        author_id__in=author_ids,
+        follower_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).exclude(
+        feed_mode=AuthorCounters.MERGE
+    ).update(feed_mode=AuthorCounters.MERGE)
+
+
+def resume_fan_out(author_id):
+    """Возвращает автору раскладку, если подписчиков стало мало.
+
+    Только когда их на долю FEED_FANOUT_HYSTERESIS меньше порога, чтобы
+    автор у порога не переключался туда и обратно. Условный UPDATE не
+    даёт двум процессам поставить backfill_author дважды.
+    """
+    switched = AuthorCounters.objects.filter(
+        author_id=author_id,
+        feed_mode=AuthorCounters.MERGE,
+        follower_count__lte=_resume_limit(),
+    ).update(feed_mode=AuthorCounters.BACKFILL)
+    if switched:
+        enqueue(backfill_author, author_id)
+
+
+def update_feed_mode(author_ids):
+    """Переключает режим авторов после массового изменения подписок."""
+    stop_fan_out(author_ids)
+    candidates = AuthorCounters.objects.filter(
+        author_id__in=author_ids,
+        feed_mode=AuthorCounters.MERGE,
+        follower_count__lte=_resume_limit(),
+    ).values_list('author_id', flat=True)
+    for author_id in list(candidates):
+        resume_fan_out(author_id)
+
+
+@task
+def backfill_author(author_id):
+    """Раскладывает прежние посты автора и включает ему раскладку."""
+    backfilling = AuthorCounters.objects.filter(
+        author_id=author_id, feed_mode=AuthorCounters.BACKFILL
+    )
+    if not backfilling.exists():
+        return
+    followers = Follow.objects.filter(author_id=author_id).values_list(
+        'user_id', flat=True
+    )
+    for user_id in followers.iterator(chunk_size=BATCH_SIZE):
+        _insert_stream(user_id, _author_posts([author_id]))
+    # Автор мог снова стать популярным, пока шло заполнение.
+    backfilling.update(feed_mode=AuthorCounters.FAN_OUT)
+
+
+def _entries(user_ids, posts):
+    return [
+        FeedEntry(
+            user_id=user_id,
+            author_id=author_id,
+            post_id=post_id,
+            pub_date=pub_date,
+        )
+        for post_id, author_id, pub_date in posts
+        for user_id in user_ids
+    ]
+
+
+def _insert(user_ids, posts):
+    FeedEntry.objects.bulk_create(
+        _entries(user_ids, posts),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def fan_out_post(post):
+    """Ставит раскладку нового поста по лентам подписчиков в очередь."""
+    enqueue(
+        fan_out, post.pk, post.author_id, post.pub_date.isoformat(),
+        key=f'fan-out:{post.pk}',
+    )
+
+
+@task
+def fan_out(post_id, author_id, pub_date):
+    """Раскладывает пост по лентам подписчиков автора."""
+    if is_popular(author_id):
+        return
+    followers = Follow.objects.filter(author_id=author_id)
+    # Удалённый до запуска задачи пост не раскладываем.
+    if shards.enabled():
+        posts = Post.objects.using(shards.for_author(author_id))
+        if not posts.filter(pk=post_id).exists():
+            return
+    else:
+        followers = followers.filter(author__posts=post_id)
+    _insert(
+        list(followers.values_list('user_id', flat=True)),
+        [(post_id, author_id, parse_datetime(pub_date))],
+    )
+
+
+def _author_posts(author_ids):
+    for alias, ids in shards.by_alias(shards.for_authors(author_ids)).items():
+        yield from (
+            Post.objects.using(alias).filter(author_id__in=ids)
+            .values_list('pk', 'author_id', 'pub_date')
+            .iterator(chunk_size=BATCH_SIZE)
+        )
+
+
+def _insert_stream(user_id, posts):
+    batch = []
+    for row in posts:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            _insert([user_id], batch)
+            batch = []
+    if batch:
+        _insert([user_id], batch)
+
+
+def follow_author(user_id, author_id):
+    """Добавляет в ленту подписчика посты нового автора."""
+    if is_popular(author_id):
+        return
+    _insert_stream(user_id, _author_posts([author_id]))
+
+
+def follow_authors(user_id, author_ids):
+    """follow_author сразу для многих авторов."""
+    popular = set(
+        AuthorCounters.objects.filter(
+            author_id__in=author_ids, feed_mode=AuthorCounters.MERGE
+        ).values_list('author_id', flat=True)
+    )
+    _insert_stream(user_id, _author_posts(
+        [author_id for author_id in author_ids if author_id not in popular]
+    ))
+
+
+def unfollow_author(user_id, author_id):
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def rebuild_feed(user_id):
+    """Пересобирает ленту пользователя с нуля."""
+    FeedEntry.objects.filter(user_id=user_id).delete()
+    authors = Follow.objects.filter(user_id=user_id).values_list(
+        'author_id', flat=True
+    )
+    # Авторов в BACKFILL раскладываем сразу: задача могла уже пройти.
+    popular = set(_followed(user_id, (AuthorCounters.MERGE,)))
+    authors = [author for author in authors if author not in popular]
+    _insert_stream(user_id, _author_posts(authors))
+
+
+def fan_out_bulk(first_post_id=None, first_follow_id=None):
+    """Раскладывает по лентам посты и подписки, созданные bulk_create.
+
+    Работает одним INSERT ... SELECT на стороне БД: посты с id не меньше
+    first_post_id попадают ко всем подписчикам автора, подписки с id
+    не меньше first_follow_id получают все посты автора. Популярные
+    авторы пропускаются, как и в fan_out_post.
+    """
+    if shards.enabled():
+        _fan_out_bulk_sharded(first_post_id, first_follow_id)
+        return
+    ops = connection.ops
+    sql = (
+        f'{ops.insert_statement(ignore_conflicts=True)}'
+        f' {FeedEntry._meta.db_table} (user_id, author_id, post_id, pub_date)'
+        f' SELECT f.user_id, p.author_id, p.id, p.pub_date'
+        f' FROM {Follow._meta.db_table} f'
+        f' INNER JOIN {Post._meta.db_table} p ON p.author_id = f.author_id'
+        f' WHERE {{}} >= %s AND f.author_id NOT IN ('
+        f'SELECT author_id FROM {AuthorCounters._meta.db_table}'
+        f' WHERE feed_mode = %s)'
+        f' {ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}'
+    )
+    with connection.cursor() as cursor:
+        for column, first_id in (('p.id', first_post_id),
+                                 ('f.id', first_follow_id)):
+            if first_id is not None:
+                cursor.execute(
+                    sql.format(column),
+                    [first_id, AuthorCounters.MERGE],
+                )
+
+
+def _fan_out_bulk_sharded(first_post_id, first_follow_id):
+    # Посты и подписки в разных БД, соединить их одним INSERT ... SELECT
+    # нельзя: раскладка идёт по подписке и по автору.
+    popular = set(
+        AuthorCounters.objects.filter(
+            feed_mode=AuthorCounters.MERGE
+        ).values_list('author_id', flat=True)
+    )
+    if first_follow_id is not None:
+        follows = list(
+            Follow.objects.filter(pk__gte=first_follow_id)
+            .values_list('user_id', 'author_id')
+        )
+        for user_id, author_id in follows:
+            if author_id not in popular:
+                _insert_stream(user_id, _author_posts([author_id]))
+    if first_post_id is not None:
+        posts = {}
+        for alias in shards.aliases():
+            for row in Post.objects.using(alias).filter(
+                pk__gte=first_post_id
+            ).values_list('pk', 'author_id', 'pub_date'):
+                posts.setdefault(row[1], []).append(row)
+        for author_id, rows in posts.items():
+            if author_id not in popular:
+                _insert(
+                    Follow.objects.filter(author_id=author_id)
+                    .values_list('user_id', flat=True),
+                    rows,
+                )
+
+
+class InboxPaginator(CursorPaginator):
+    """Источник постов из материализованной ленты пользователя."""
+
+    def __init__(self, user, per_page, exclude_authors=()):
+        entries = FeedEntry.objects.filter(user=user)
+        if not shards.enabled():
+            entries = entries.select_related(
+                'post__author', 'post__group'
+            ).defer('post__text')
+        if exclude_authors:
+            entries = entries.exclude(author_id__in=exclude_authors)
+        super().__init__(entries, per_page, ordering=('-pub_date', '-post_id'))
+
+    def fetch(self, position, backwards, limit):
+        entries = super().fetch(position, backwards, limit)
+        if not shards.enabled():
+            return [entry.post for entry in entries]
+        # Посты на шардах: по запросу на шард, в порядке ленты.
+        posts = shards.in_bulk(
+            [entry.post_id for entry in entries],
+            Post.objects.select_related('author', 'group').defer('text'),
+        )
+        return [
+            posts[entry.post_id] for entry in entries
+            if entry.post_id in posts
+        ]
+
+
+def follow_paginator(user, per_page=None):
+    per_page = per_page or settings.POST_PAGES
+    popular = popular_authors(user)
+    sources = [InboxPaginator(user, per_page, exclude_authors=popular)]
+    # По источнику на автора: каждый читается своим диапазоном индекса
+    # (author, pub_date) без сортировки, а порядок даёт слияние.
+    sources.extend(
+        CursorPaginator(
+            Post.objects.using(shards.for_author(author_id))
+            .filter(author_id=author_id)
+            .select_related('author', 'group').defer('text'),
+            per_page,
+        )
+        for author_id in popular
+    )
+    return MergedCursorPaginator(sources, per_page)
@@ -0,0 +1,148 @@
+"""Граф подписок: подписка, отписка, массовая подписка и списки.
+
+Уникальность пары (user, author) держит ограничение БД, поэтому
+подписка - один INSERT ... ON CONFLICT DO NOTHING, а отписка - один
+DELETE ... RETURNING (где его нет - SELECT id и DELETE по id), без
+предварительной проверки exists(). Две параллельные
+подписки не создадут дубль: вторая просто ничего не вставит. Сигналы
+post_save и post_delete, на которых держатся счётчики, ленты и кэш
+страниц, отправляются здесь же и только если строка действительно
+появилась или исчезла.
+
+Списки подписчиков и подписок читаются по индексам (author, user) и
+(user, author) курсором по id второй стороны.
+"""
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import cache, counters, feed
+from .models import Follow, User
+from .utils import CursorPaginator
+
+
+def _insert(connection, user_id, author_id):
+    """Вставляет подписку; id новой строки или None, если она уже была."""
+    ops = connection.ops
+    returning = connection.features.can_return_id_from_insert
+    sql = (
+        f'{ops.insert_statement(ignore_conflicts=True)}'
+        f' {Follow._meta.db_table} (user_id, author_id) VALUES (%s, %s)'
+        f' {ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}'
+        f'{" RETURNING id" if returning else ""}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user_id, author_id])
+        if returning:
+            row = cursor.fetchone()
+            return row[0] if row else None
+        return cursor.lastrowid if cursor.rowcount == 1 else None
+
+
+def _can_return_from_delete(connection):
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 35)
+    return False
+
+
+def _delete(connection, user_id, author_id):
+    """Удаляет подписку; id удалённой строки или None, если её не было."""
+    table = Follow._meta.db_table
+    where = 'WHERE user_id = %s AND author_id = %s'
+    with connection.cursor() as cursor:
+        if _can_return_from_delete(connection):
+            cursor.execute(
+                f'DELETE FROM {table} {where} RETURNING id',
+                [user_id, author_id],
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+        cursor.execute(f'SELECT id FROM {table} {where}', [user_id, author_id])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        # Параллельная отписка могла удалить строку между запросами.
+        cursor.execute(f'DELETE FROM {table} WHERE id = %s', [row[0]])
+        return row[0] if cursor.rowcount == 1 else None
+
+
+def follow(user, author):
+    """Подписывает user на author; True, если подписки ещё не было."""
+    if user.pk == author.pk:
+        return False
+    using = router.db_for_write(Follow)
+    pk = _insert(connections[using], user.pk, author.pk)
+    if pk is None:
+        return False
+    post_save.send(
+        sender=Follow, instance=Follow(pk=pk, user=user, author=author),
+        created=True, update_fields=None, raw=False, using=using,
+    )
+    return True
+
+
+def unfollow(user, author):
+    """Отписывает user от author; True, если подписка была."""
+    using = router.db_for_write(Follow)
+    pk = _delete(connections[using], user.pk, author.pk)
+    if pk is None:
+        return False
+    post_delete.send(
+        sender=Follow, instance=Follow(pk=pk, user=user, author=author),
+        using=using,
+    )
+    return True
+
+
+def follow_many(user, author_ids):
+    """Подписывает user сразу на многих авторов, например при регистрации.
+
+    Подписки вставляются одной пачкой, а вместо посылки сигналов на
+    каждую строку счётчики, ленты и кэш обновляются пачками. Возвращает
+    число новых подписок.
+    """
+    author_ids = set(author_ids) - {user.pk}
+    if not author_ids:
+        return 0
+    with transaction.atomic():
+        # Новые подписки - только этого user и только на тех, на кого он
+        # ещё не подписан: чужие параллельные подписки сюда не попадут.
+        author_ids -= set(
+            Follow.objects.filter(user=user, author_id__in=author_ids)
+            .values_list('author_id', flat=True)
+        )
+        if not author_ids:
+            return 0
+        author_ids = sorted(author_ids)
+        Follow.objects.bulk_create(
+            [Follow(user=user, author_id=author_id)
+             for author_id in author_ids],
+            ignore_conflicts=True,
+        )
+        counters.reconcile_authors(author_ids)
+        feed.update_feed_mode(author_ids)
+        feed.follow_authors(user.pk, author_ids)
+    cache.bump(*(
+        cache.author_scope(username)
+        for username in User.objects.filter(pk__in=author_ids)
+        .values_list('username', flat=True)
+    ))
+    return len(author_ids)
+
+
+def followers_paginator(author):
+    return CursorPaginator(
+        Follow.objects.filter(author=author).select_related('user'),
+        settings.FOLLOW_PAGES,
+        ordering=('user_id',),
+    )
+
+
+def following_paginator(user):
+    return CursorPaginator(
+        Follow.objects.filter(user=user).select_related('author'),
+        settings.FOLLOW_PAGES,
+        ordering=('author_id',),
+    )
@@ -1,6 +1,7 @@
 from django.forms import ModelForm
 
 from .models import Comment, Post
+from .thumbnails import image_metadata
 
 
 class PostForm(ModelForm):
@@ -16,6 +17,22 @@ class PostForm(ModelForm):
             'group': 'Введите название группы.',
         }
 
+    def save(self, commit=True):
+        if 'image' in self.changed_data:
+            # forms.ImageField уже открыл картинку при проверке: берём
+            # размеры и формат у него, не читая файл ещё раз.
+            image = self.cleaned_data['image']
+            if image and hasattr(image, 'image'):
+                metadata = image_metadata(image.image, image.size)
+            else:
+                metadata = dict.fromkeys(
+                    ('image_width', 'image_height', 'image_size')
+                )
+                metadata['image_format'] = ''
+            for field, value in metadata.items():
+                setattr(self.instance, field, value)
+        return super().save(commit)
+
 
 class CommentForm(ModelForm):
     class Meta:
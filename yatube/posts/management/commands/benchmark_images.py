@@ -0,0 +1,97 @@
+import json
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.test.utils import setup_databases, teardown_databases
+from django.urls import reverse
+
+from posts import benchmark
+from posts.models import Post
+
+from .benchmark_posts import current_commit
+
+
+class Command(BaseCommand):
+    help = ('Замеряет вес страниц с картинками для разных устройств: '
+            'сколько байт HTML и картинок они получают с <picture> и '
+            'сколько получали с одним JPEG. Данные и картинки создаются '
+            'во временной БД и временном MEDIA_ROOT.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--posts', type=int, default=30,
+            help='Число постов с картинками.',
+        )
+        parser.add_argument(
+            '--image-size', default='2400x1600',
+            help='Размер исходных картинок, ШИРИНАxВЫСОТА.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Процессов для построения вариантов; по умолчанию - '
+                 'по ядру.',
+        )
+        parser.add_argument(
+            '--output', help='Сохранить результаты в JSON-файл.',
+        )
+
+    def handle(self, *args, **options):
+        if settings.DATABASE_SHARDS:
+            raise CommandError(
+                'Набор данных замера пишется bulk_create в одну БД: '
+                'с DATABASE_SHARDS не поддерживается.'
+            )
+        width, height = (int(v) for v in options['image_size'].split('x'))
+        media_root = tempfile.mkdtemp()
+        old_config = setup_databases(verbosity=0, interactive=False)
+        cache.clear()
+        try:
+            with override_settings(MEDIA_ROOT=media_root, TASKS_EAGER=True):
+                dataset = benchmark.generate_images(
+                    options['posts'], width, height
+                )
+                workers = ['--workers', str(options['workers'])] \
+                    if options['workers'] is not None else []
+                call_command('generate_thumbnails', *workers,
+                             stdout=self.stdout)
+                cache.clear()
+                paths = [reverse('posts:index')] + [
+                    reverse('posts:post_detail', args=(pk,))
+                    for pk in Post.objects.values_list('pk', flat=True)[:10]
+                ]
+                results = benchmark.page_weight(paths)
+        finally:
+            teardown_databases(old_config, verbosity=0)
+            shutil.rmtree(media_root, ignore_errors=True)
+        self.print_results(dataset, results)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'commit': current_commit(),
+                    'dataset': dataset,
+                    'results': results,
+                }, output, indent=2, ensure_ascii=False)
+
+    def print_results(self, dataset, results):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{dataset["posts"]} постов, картинки {dataset["image"]}; '
+            f'средний вес страницы'
+        ))
+        self.stdout.write(
+            f'{"устройство":<32}{"HTML КБ":>9}{"картинки КБ":>13}'
+            f'{"всего КБ":>10}{"к старому":>11}'
+        )
+        before = None
+        for name, row in results.items():
+            total = row['html_bytes'] + row['image_bytes']
+            before = before or total
+            self.stdout.write(
+                f'{name:<32}{row["html_bytes"] / 1024:>9.1f}'
+                f'{row["image_bytes"] / 1024:>13.1f}{total / 1024:>10.1f}'
+                f'{total / before:>10.2f}x'
+            )
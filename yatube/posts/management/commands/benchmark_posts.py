@@ -0,0 +1,112 @@
+import json
+import subprocess
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+
+from posts import benchmark
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, число запросов и пропускную способность '
+            'лент на наборах данных разного размера во временной БД.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', default='1000,10000',
+            help='Размеры набора данных в постах, через запятую.',
+        )
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Число запросов к каждому view.',
+        )
+        parser.add_argument(
+            '--anonymous', action='store_true',
+            help='Ходить анонимно (с кэшем страниц), а не залогиненным.',
+        )
+        parser.add_argument(
+            '--output', help='Сохранить результаты в JSON-файл.',
+        )
+        parser.add_argument(
+            '--compare', help='JSON прошлого прогона для сравнения.',
+        )
+
+    def handle(self, *args, **options):
+        if settings.DATABASE_SHARDS:
+            raise CommandError(
+                'Набор данных замера пишется bulk_create в одну БД: '
+                'с DATABASE_SHARDS не поддерживается.'
+            )
+        report = {
+            'commit': current_commit(),
+            'created': timezone.now().isoformat(),
+            'anonymous': options['anonymous'],
+            'results': {},
+        }
+        for size in options['sizes'].split(','):
+            size = int(size)
+            old_config = setup_databases(verbosity=0, interactive=False)
+            cache.clear()
+            try:
+                dataset = benchmark.generate_dataset(size)
+                views = benchmark.run_benchmark(
+                    options['requests'], anonymous=options['anonymous']
+                )
+            finally:
+                teardown_databases(old_config, verbosity=0)
+            report['results'][str(size)] = {
+                'dataset': dataset, 'views': views,
+            }
+            self.print_size(size, dataset, views)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2, ensure_ascii=False)
+        if options['compare']:
+            with open(options['compare']) as previous:
+                self.print_comparison(json.load(previous), report)
+
+    def print_size(self, size, dataset, views):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{size} постов: {dataset}'
+        ))
+        self.stdout.write(
+            f'{"view":<20}{"p50 мс":>9}{"p95 мс":>9}{"p99 мс":>9}'
+            f'{"запросов":>10}{"рендер мс":>11}{"rps":>9}'
+        )
+        for name, row in views.items():
+            self.stdout.write(
+                f'{name:<20}{row["p50_ms"]:>9.2f}{row["p95_ms"]:>9.2f}'
+                f'{row["p99_ms"]:>9.2f}{row["mean_queries"]:>10.1f}'
+                f'{row["mean_render_ms"]:>11.2f}{row["throughput_rps"]:>9.1f}'
+            )
+
+    def print_comparison(self, previous, current):
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'Сравнение с {previous.get("commit")}: было → стало'
+        ))
+        for size, result in current['results'].items():
+            before = previous['results'].get(size, {}).get('views', {})
+            for name, row in result['views'].items():
+                if name not in before:
+                    continue
+                for metric in ('p95_ms', 'mean_render_ms'):
+                    if metric not in before[name]:
+                        continue
+                    old, new = before[name][metric], row[metric]
+                    self.stdout.write(
+                        f'{size:>7} {name:<20}{metric:<15}{old:>9.2f} →'
+                        f' {new:>9.2f} ({new / old:.2f}x)'
+                    )
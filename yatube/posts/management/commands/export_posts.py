@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = ('Выгружает группы, посты, комментарии и подписки в JSONL '
+            'или CSV, не загружая таблицы в память.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл дампа или - для stdout.')
+        parser.add_argument('--format', choices=('jsonl', 'csv'))
+        parser.add_argument(
+            '--chunk-size', type=int, default=transfer.CHUNK_SIZE,
+            help='Сколько строк читать из БД за раз.',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = transfer.detect_format(path, options['format'])
+        if path == '-':
+            self.export(self.stdout, fmt, options['chunk_size'])
+            return
+        with open(path, 'w', encoding='utf-8', newline='') as stream:
+            total = self.export(stream, fmt, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Выгружено записей: {total}'))
+
+    def export(self, stream, fmt, chunk_size):
+        writer = transfer.RecordWriter(stream, fmt)
+        total = 0
+        for record in transfer.export_records(chunk_size):
+            writer.write(record)
+            total += 1
+        return total
@@ -0,0 +1,71 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+
+from posts import shards, thumbnails
+from posts.models import Post
+
+
+def generate(name):
+    try:
+        thumbnails.generate(name)
+        return None
+    except Exception as error:
+        return f'{name}: {error}'
+
+
+def generate_in_pool(name):
+    try:
+        return generate(name)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = ('Строит недостающие варианты миниатюр для всех картинок постов '
+            'и заполняет у постов размеры и формат картинок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=os.cpu_count() or 1,
+            help='Число процессов или потоков, по умолчанию - по ядру; '
+                 '0 - строить в текущем потоке.',
+        )
+        parser.add_argument(
+            '--pool', choices=('thread', 'process'), default='process',
+            help='Сжатие в WebP и AVIF нагружает процессор, поэтому по '
+                 'умолчанию картинки строятся в пуле процессов.',
+        )
+
+    def handle(self, *args, **options):
+        names = sorted({
+            name
+            for posts in shards.querysets(Post.objects.exclude(image=''))
+            for name in posts.values_list('image', flat=True).distinct()
+        })
+        done = 0
+        for error in self.map(names, options['workers'], options['pool']):
+            done += 1
+            if error:
+                self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {done}'
+        ))
+
+    def map(self, names, workers, pool):
+        if not workers:
+            yield from map(generate, names)
+            return
+        if pool == 'process':
+            # Потомки не должны делить с родителем открытые соединения.
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                workers, multiprocessing.get_context('fork')
+            )
+        else:
+            executor = ThreadPoolExecutor(workers)
+        with executor:
+            yield from executor.map(generate_in_pool, names, chunksize=8)
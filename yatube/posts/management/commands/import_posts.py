@@ -0,0 +1,60 @@
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import transfer
+
+
+class Command(BaseCommand):
+    help = ('Загружает группы, посты, комментарии и подписки из дампа '
+            'JSONL или CSV пачками bulk_create. Память не зависит от '
+            'размера дампа: id постов сопоставляются во временной таблице. '
+            'Миниатюры картинок потом можно построить командой '
+            'generate_thumbnails.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл дампа или - для stdin.')
+        parser.add_argument('--format', choices=('jsonl', 'csv'))
+        parser.add_argument(
+            '--chunk-size', type=int, default=transfer.CHUNK_SIZE,
+            help='Сколько записей одного типа писать за одну транзакцию.',
+        )
+        parser.add_argument(
+            '--images',
+            help='Каталог с картинками дампа; без него имена картинок '
+                 'считаются уже лежащими в MEDIA_ROOT. Картинки вне '
+                 'каталога (абсолютные пути, ../) пропускаются.',
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Число потоков, копирующих картинки.',
+        )
+
+    def handle(self, *args, **options):
+        if settings.DATABASE_SHARDS:
+            raise CommandError(
+                'Загрузка пишет посты пачками bulk_create в одну БД: '
+                'с DATABASE_SHARDS не поддерживается.'
+            )
+        path = options['path']
+        fmt = transfer.detect_format(path, options['format'])
+        importer = transfer.Importer(
+            options['chunk_size'], options['images'], options['workers']
+        )
+        started = time.perf_counter()
+        if path == '-':
+            stats = importer.run(transfer.read_records(sys.stdin, fmt))
+        else:
+            with open(path, encoding='utf-8', newline='') as stream:
+                stats = importer.run(transfer.read_records(stream, fmt))
+        elapsed = time.perf_counter() - started
+        for error in importer.errors:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Группы: {stats["group"]}, посты: {stats["post"]}, '
+            f'комментарии: {stats["comment"]}, подписки: {stats["follow"]}, '
+            f'пропущено: {stats["skipped"]} за {elapsed:.1f} с '
+            f'({stats["post"] / elapsed * 60:.0f} постов в минуту)'
+        ))
@@ -0,0 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core import storage
+from posts import cache, shards, thumbnails
+from posts.models import Post
+
+
+def copy(name):
+    """Кладёт картинку в хранилище по хэшу; (старое, новое имя, ошибка)."""
+    try:
+        with default_storage.open(name) as source:
+            return name, storage.content_storage.save(name, source), None
+    except OSError as error:
+        return name, None, f'{name}: {error}'
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = ('Переносит картинки постов, сохранённые до адресации по '
+            'содержимому, в хранилище core.storage: одинаковые файлы '
+            'сливаются в один, посты получают новые имена.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Число потоков, копирующих файлы.',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Сколько файлов переносить за одну транзакцию.',
+        )
+        parser.add_argument(
+            '--keep-old', action='store_true',
+            help='Не удалять старые файлы после переноса.',
+        )
+
+    def batches(self, size):
+        """Имена ещё не перенесённых картинок пачками по алфавиту.
+
+        Курсором по имени, а не одним итератором: пока пачка
+        переносится, имена в таблице меняются.
+        """
+        last = ''
+        while True:
+            names = sorted({
+                name
+                for posts in shards.querysets(
+                    Post.objects.filter(image__gt=last)
+                )
+                for name in posts.order_by('image')
+                .values_list('image', flat=True).distinct()[:size]
+            })[:size]
+            if not names:
+                return
+            last = names[-1]
+            yield [name for name in names if not storage.is_hashed(name)]
+
+    def handle(self, *args, **options):
+        moved = posts = errors = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            for chunk in self.batches(options['chunk_size']):
+                renames = {}
+                for old, new, error in pool.map(copy, chunk):
+                    if error:
+                        errors += 1
+                        self.stderr.write(error)
+                    else:
+                        renames[old] = new
+                posts += self.rename(renames)
+                moved += len(renames)
+                for old, new in renames.items():
+                    if not options['keep_old'] and old != new:
+                        default_storage.delete(old)
+                    thumbnails.pregenerate(new)
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено файлов: {moved}, постов: {posts}, ошибок: {errors}'
+        ))
+
+    def rename(self, renames):
+        """Переименовывает картинки постов и берёт ссылки на новые файлы."""
+        if not renames:
+            return 0
+        touched = []
+        updated = 0
+        for posts in shards.querysets(Post.objects.all()):
+            with transaction.atomic(using=posts.db):
+                touched.extend(
+                    posts.filter(image__in=renames)
+                    .values_list('pk', 'author__username', 'group__slug')
+                )
+                for old, new in renames.items():
+                    count = posts.filter(image=old).update(image=new)
+                    if count:
+                        storage.acquire(new, count)
+                    updated += count
+        cache.bump_posts(touched)
+        return updated
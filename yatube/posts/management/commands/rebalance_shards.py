@@ -0,0 +1,120 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count
+
+from posts import shards
+from posts.models import Post
+
+
+def author_loads(alias):
+    """Число постов каждого автора в БД alias: {id автора: постов}."""
+    return dict(
+        Post.objects.using(alias).order_by().values('author')
+        .annotate(total=Count('id')).values_list('author', 'total')
+    )
+
+
+def plan(loads, tolerance, drain=(), limit=None):
+    """Переносы (автор, откуда, куда), выравнивающие шарды по постам.
+
+    loads - {шард: {автор: постов}}, меняется по ходу плана. Авторы
+    шардов из drain переезжают все. Затем с самого загруженного шарда
+    на самый свободный переносится автор, после которого разрыв между
+    ними меньше всего, пока разрыв больше tolerance от средней загрузки.
+    """
+    totals = {alias: sum(authors.values()) for alias, authors in loads.items()}
+    targets = [alias for alias in loads if alias not in drain]
+    moves = []
+
+    def move(author, source, target):
+        count = loads[source].pop(author)
+        loads[target][author] = count
+        totals[source] -= count
+        totals[target] += count
+        moves.append((author, source, target))
+
+    for source in drain:
+        authors = sorted(loads[source], key=loads[source].get, reverse=True)
+        for author in authors:
+            move(author, source, min(targets, key=totals.get))
+    mean = sum(totals[alias] for alias in targets) / len(targets)
+    while limit is None or len(moves) < limit:
+        heavy = max(targets, key=totals.get)
+        light = min(targets, key=totals.get)
+        gap = totals[heavy] - totals[light]
+        if gap <= tolerance * mean:
+            break
+        # Перенос автора с count постами меняет разрыв на |gap - 2 count|:
+        # выгоден любой автор меньше разрыва, лучше всех - ближе к половине.
+        candidates = [
+            author for author, count in loads[heavy].items() if count < gap
+        ]
+        if not candidates:
+            break
+        author = min(
+            candidates, key=lambda author: abs(gap - 2 * loads[heavy][author])
+        )
+        move(author, heavy, light)
+    return moves
+
+
+class Command(BaseCommand):
+    help = ('Копирует пользователей и группы на шарды, переносит на шарды '
+            'посты, написанные до шардирования, и выравнивает шарды по '
+            'числу постов, перенося авторов целиком.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--tolerance', type=float, default=0.1,
+            help='Допустимый разрыв между шардами в долях средней '
+                 'загрузки шарда.',
+        )
+        parser.add_argument(
+            '--max-moves', type=int,
+            help='Не переносить за запуск больше стольких авторов.',
+        )
+        parser.add_argument(
+            '--drain', action='append', default=[], metavar='SHARD',
+            help='Перенести всех авторов с шарда, например перед его '
+                 'выводом из DB_SHARDS. Можно повторять.',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать план переносов.',
+        )
+
+    def handle(self, *args, **options):
+        aliases = settings.DATABASE_SHARDS
+        if not aliases:
+            raise CommandError('Шарды не настроены: задайте DB_SHARDS.')
+        unknown = set(options['drain']) - set(aliases)
+        if unknown:
+            raise CommandError(f'Нет шардов: {", ".join(sorted(unknown))}')
+        if not set(aliases) - set(options['drain']):
+            raise CommandError('Нельзя вывести все шарды.')
+        dry_run = options['dry_run']
+        if not dry_run:
+            shards.sync_reference_tables()
+        legacy = author_loads(DEFAULT_DB_ALIAS)
+        moves = [
+            (author, DEFAULT_DB_ALIAS, shards.for_author(author))
+            for author in legacy
+        ]
+        loads = {alias: author_loads(alias) for alias in aliases}
+        for author, _, target in moves:
+            loads[target][author] = legacy[author]
+        moves += plan(
+            loads, options['tolerance'], options['drain'],
+            options['max_moves'],
+        )
+        posts = 0
+        for author, source, target in moves:
+            self.stdout.write(f'Автор {author}: {source} -> {target}')
+            if not dry_run:
+                posts += shards.move_author(author, target, source)
+        if dry_run:
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f'Перенесено авторов: {len(moves)}, постов: {posts}'
+        ))
@@ -0,0 +1,19 @@
+from itertools import chain
+
+from django.core.management.base import BaseCommand
+
+from posts import shards
+from posts.models import Post
+from posts.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс постов с нуля.'
+
+    def handle(self, *args, **options):
+        posts = chain.from_iterable(
+            shard.values_list('pk', 'text').iterator()
+            for shard in shards.querysets(Post.objects.all())
+        )
+        get_backend().rebuild(posts)
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен'))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters, feed, shards
+from posts.models import Post, User
+
+
+def batches(queryset, size):
+    """Пачки первичных ключей по возрастанию, без OFFSET."""
+    last = 0
+    while True:
+        batch = list(
+            queryset.filter(pk__gt=last).order_by('pk')
+            .values_list('pk', flat=True)[:size]
+        )
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+
+class Command(BaseCommand):
+    help = 'Сверяет денормализованные счётчики с таблицами.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько авторов или постов сверять за один проход.',
+        )
+
+    def handle(self, *args, **options):
+        size = options['batch_size']
+        authors = 0
+        for batch in batches(User.objects.all(), size):
+            authors += counters.reconcile_authors(batch)
+            # Исправленное число подписчиков может перевести автора
+            # через порог раскладки.
+            feed.update_feed_mode(batch)
+        posts = sum(
+            counters.reconcile_posts(batch)
+            for alias in shards.aliases()
+            for batch in batches(Post.objects.using(alias), size)
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Исправлено счётчиков авторов: {authors}, постов: {posts}'
+        ))
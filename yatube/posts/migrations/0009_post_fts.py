@@ -0,0 +1,38 @@
+from django.db import migrations
+
+
+def create_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE IF NOT EXISTS posts_post_fts USING fts5('
+        "body, tokenize = 'unicode61 remove_diacritics 2')"
+    )
+    # Наполняем индекс существующими постами тем же стеммером, что и
+    # при поиске: импорт модуля здесь допустим, ему нужен только текст.
+    from posts.search import tokenize
+    Post = apps.get_model('posts', 'Post')
+    rows = (
+        (pk, ' '.join(tokenize(text)))
+        for pk, text in Post.objects.values_list('pk', 'text').iterator()
+    )
+    with schema_editor.connection.cursor() as cursor:
+        cursor.executemany(
+            'INSERT INTO posts_post_fts (rowid, body) VALUES (%s, %s)', rows
+        )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS posts_post_fts')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_fts_table, drop_fts_table),
+    ]
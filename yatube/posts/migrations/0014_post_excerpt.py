@@ -0,0 +1,54 @@
+# Generated by Django 2.2.19 on 2026-10-18 17:42
+
+from django.db import migrations, models
+
+from posts.utils import make_excerpt
+
+CHUNK = 1000
+
+
+def fill_excerpts(apps, schema_editor):
+    # Пачками по id: в памяти не больше CHUNK текстов сразу.
+    Post = apps.get_model('posts', 'Post')
+    last = 0
+    while True:
+        posts = list(
+            Post.objects.filter(pk__gt=last).order_by('pk')
+            .only('pk', 'text')[:CHUNK]
+        )
+        if not posts:
+            return
+        for post in posts:
+            post.excerpt, post.word_count, post.has_more = make_excerpt(
+                post.text
+            )
+        Post.objects.bulk_update(
+            posts, ['excerpt', 'word_count', 'has_more']
+        )
+        last = posts[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_post_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='excerpt',
+            field=models.TextField(blank=True, editable=False, verbose_name='Превью'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='has_more',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Текст длиннее превью'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='word_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Число слов'),
+        ),
+        migrations.RunPython(fill_excerpts, migrations.RunPython.noop),
+    ]
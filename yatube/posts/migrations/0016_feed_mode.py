@@ -0,0 +1,29 @@
+# Generated by Django 2.2.19 on 2026-10-18 18:07
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_popular_authors(apps, schema_editor):
+    # Раньше популярность решалась по follower_count на лету: посты
+    # таких авторов уже не разложены и читаются слиянием.
+    AuthorCounters = apps.get_model('posts', 'AuthorCounters')
+    AuthorCounters.objects.filter(
+        follower_count__gt=settings.FEED_FANOUT_LIMIT
+    ).update(feed_mode='merge')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_shards'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='authorcounters',
+            name='feed_mode',
+            field=models.CharField(choices=[('fan-out', 'Раскладка по лентам'), ('merge', 'Слияние при чтении'), ('backfill', 'Заполнение лент')], default='fan-out', max_length=10, verbose_name='Посты в лентах подписчиков'),
+        ),
+        migrations.RunPython(mark_popular_authors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 2.2.19 on 2026-10-18 18:26
+
+from django.core.management.color import no_style
+from django.db import DEFAULT_DB_ALIAS, connections, migrations, models
+
+
+def seed_comment_keys(apps, schema_editor):
+    # До CommentKey комментарии получали id автоинкрементом своей БД:
+    # сквозные id должны начинаться выше уже выданных. Каждая БД
+    # (default и шарды) сообщает свой наибольший id, когда мигрирует
+    # сама; default мигрирует первой, таблица ключей в ней.
+    Comment = apps.get_model('posts', 'Comment')
+    CommentKey = apps.get_model('posts', 'CommentKey')
+    alias = schema_editor.connection.alias
+    last = Comment.objects.using(alias).aggregate(
+        last=models.Max('pk')
+    )['last']
+    keys = CommentKey.objects.using(DEFAULT_DB_ALIAS)
+    if not last or keys.filter(pk__gte=last).exists():
+        return
+    keys.create(pk=last)
+    connection = connections[DEFAULT_DB_ALIAS]
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(
+            no_style(), [CommentKey]
+        ):
+            cursor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0016_feed_mode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommentKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'Ключ комментария',
+                'verbose_name_plural': 'Ключи комментариев',
+            },
+        ),
+        migrations.RunPython(seed_comment_keys, migrations.RunPython.noop),
+    ]
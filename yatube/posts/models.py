@@ -1,7 +1,13 @@
-from django.db import models
+from collections import defaultdict
+
+from django.db import models, router
 from django.contrib.auth import get_user_model
 from django.conf import settings
 
+from core.storage import content_storage
+
+from .utils import set_excerpt
+
 User = get_user_model()
 
 
@@ -18,6 +24,31 @@ class Group(models.Model):
         return self.title
 
 
+class ShardedQuerySet(models.QuerySet):
+    """bulk_create без using раскладывает строки по шардам, как save()."""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if not settings.DATABASE_SHARDS or self._db is not None:
+            return super().bulk_create(objs, *args, **kwargs)
+        objs = list(objs)
+        grouped = defaultdict(list)
+        for obj in objs:
+            if obj.pk is None:
+                obj.pk = obj.new_shard_pk()
+            alias = router.db_for_write(self.model, instance=obj)
+            grouped[alias].append(obj)
+        for alias, rows in grouped.items():
+            self.using(alias).bulk_create(rows, *args, **kwargs)
+            if self.model is Post:
+                # Как pin_author_shard для save(): сигналов здесь нет.
+                AuthorShard.objects.bulk_create(
+                    [AuthorShard(author_id=author_id, shard=alias)
+                     for author_id in {row.author_id for row in rows}],
+                    ignore_conflicts=True,
+                )
+        return objs
+
+
 class Post(models.Model):
     text = models.TextField(
         verbose_name='Текст Поста',
@@ -25,6 +56,9 @@ class Post(models.Model):
     pub_date = models.DateTimeField(
         verbose_name='Дата публикации',
         auto_now_add=True)
+    updated = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True)
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -43,16 +77,124 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=content_storage,
         blank=True
     )
+    # Сведения о картинке запоминаются при загрузке, чтобы ни рендер,
+    # ни API не открывали файл.
+    image_width = models.PositiveIntegerField(
+        verbose_name='Ширина картинки',
+        null=True,
+        editable=False,
+    )
+    image_height = models.PositiveIntegerField(
+        verbose_name='Высота картинки',
+        null=True,
+        editable=False,
+    )
+    image_format = models.CharField(
+        verbose_name='Формат картинки',
+        max_length=10,
+        blank=True,
+        editable=False,
+    )
+    image_size = models.PositiveIntegerField(
+        verbose_name='Размер картинки, байт',
+        null=True,
+        editable=False,
+    )
+    comment_count = models.PositiveIntegerField(
+        verbose_name='Число комментариев',
+        default=0,
+        editable=False,
+    )
+    # Превью для лент, которые не загружают text (defer): посты бывают
+    # длиной в десятки килобайт. Заполняется при сохранении.
+    excerpt = models.TextField(
+        verbose_name='Превью',
+        blank=True,
+        editable=False,
+    )
+    word_count = models.PositiveIntegerField(
+        verbose_name='Число слов',
+        default=0,
+        editable=False,
+    )
+    has_more = models.BooleanField(
+        verbose_name='Текст длиннее превью',
+        default=False,
+        editable=False,
+    )
 
     class Meta:
         ordering = ['-pub_date']
         default_related_name = 'posts'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='post_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx',
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx',
+            ),
+        ]
+
+    objects = ShardedQuerySet.as_manager()
 
     def __str__(self):
         return self.text[:settings.TEXT_COUNT]
 
+    def new_shard_pk(self):
+        # Автоинкремент шарда не уникален между шардами: id
+        # выдаёт таблица PostKey в default.
+        return PostKey.objects.create(author_id=self.author_id).pk
+
+    # Меняются только UPDATE с F-выражением (posts.counters): обычное
+    # сохранение записало бы значение, прочитанное в начале запроса, и
+    # потеряло бы параллельные инкременты.
+    COUNTER_FIELDS = {'comment_count'}
+
+    def save(self, *args, **kwargs):
+        if (kwargs.get('update_fields') is None
+                and not self._state.adding
+                and not kwargs.get('force_insert')):
+            kwargs['update_fields'] = {
+                field.attname for field in self._meta.concrete_fields
+                if not field.primary_key
+            } - self.get_deferred_fields() - self.COUNTER_FIELDS
+        # Сохранение без text (update_fields, экземпляр из ленты с defer)
+        # превью не трогает и текст не догружает.
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None:
+            changed = 'text' not in self.get_deferred_fields()
+        else:
+            changed = 'text' in update_fields
+        if changed:
+            set_excerpt(self)
+            if update_fields is not None:
+                kwargs['update_fields'] = {
+                    *update_fields, 'excerpt', 'word_count', 'has_more'
+                }
+        if settings.DATABASE_SHARDS:
+            if self.pk is None:
+                self.pk = self.new_shard_pk()
+                kwargs['force_insert'] = True
+            _route_to_shard(self, kwargs)
+        super().save(*args, **kwargs)
+
+
+def _route_to_shard(instance, kwargs):
+    # QuerySet.create() передаёт using своей выборки, то есть default:
+    # шард записи выбирает posts.shards.ShardRouter.
+    if kwargs.get('using') not in settings.DATABASE_SHARDS:
+        kwargs['using'] = router.db_for_write(
+            type(instance), instance=instance
+        )
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -71,26 +213,189 @@ class Comment(models.Model):
     )
     created = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        ordering = ['created', 'id']
+        indexes = [
+            models.Index(
+                fields=['post', 'created', 'id'],
+                name='comment_post_created_idx',
+            ),
+        ]
+
+    objects = ShardedQuerySet.as_manager()
+
+    def new_shard_pk(self):
+        # Как у постов: id сквозные, чтобы при переносе автора
+        # комментарии переезжали со своими id.
+        return CommentKey.objects.create().pk
+
+    def save(self, *args, **kwargs):
+        if settings.DATABASE_SHARDS:
+            if self.pk is None:
+                self.pk = self.new_shard_pk()
+                kwargs['force_insert'] = True
+            _route_to_shard(self, kwargs)
+        super().save(*args, **kwargs)
+
 
 class Follow(models.Model):
+    # Отдельные индексы внешних ключей не нужны: user - первая колонка
+    # уникального индекса (user, author), author - индекса (author, user).
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         verbose_name='Подписчик',
-        related_name='follower'
+        related_name='follower',
+        db_index=False,
     )
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         verbose_name='Подписка на автора',
-        related_name='following'
+        related_name='following',
+        db_index=False,
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['author', 'user'], name='follow_author_user_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'author'], name='unique_author_user_following'
+            )
+        ]
+
     def __str__(self):
         return f'{self.user.username} follow {self.author.username}'
 
-    constraints = [
-        models.UniqueConstraint(
-            fields=['user', 'author'], name='unique_author_user_following'
-        )
-    ]
+
+class AuthorCounters(models.Model):
+    """Денормализованные счётчики автора, обновляемые сигналами."""
+
+    FAN_OUT = 'fan-out'
+    MERGE = 'merge'
+    BACKFILL = 'backfill'
+    FEED_MODES = (
+        (FAN_OUT, 'Раскладка по лентам'),
+        (MERGE, 'Слияние при чтении'),
+        (BACKFILL, 'Заполнение лент'),
+    )
+
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Автор',
+        related_name='counters',
+    )
+    post_count = models.PositiveIntegerField(
+        verbose_name='Число постов', default=0
+    )
+    follower_count = models.PositiveIntegerField(
+        verbose_name='Число подписчиков', default=0
+    )
+    feed_mode = models.CharField(
+        max_length=10,
+        choices=FEED_MODES,
+        default=FAN_OUT,
+        verbose_name='Посты в лентах подписчиков',
+    )
+
+    class Meta:
+        verbose_name = 'Счётчики автора'
+        verbose_name_plural = 'Счётчики авторов'
+
+    def __str__(self):
+        return f'{self.author_id}: {self.post_count}/{self.follower_count}'
+
+
+class FeedEntry(models.Model):
+    """Запись в ленте подписок: пост автора, разложенный подписчику."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Читатель',
+        related_name='feed_entries'
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор поста',
+        related_name='+'
+    )
+    # Без ограничения в БД: при шардировании пост лежит не в default.
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        verbose_name='Пост',
+        related_name='feed_entries',
+        db_constraint=False,
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации')
+
+    class Meta:
+        ordering = ['-pub_date', '-post_id']
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='feed_user_pub_date_idx',
+            ),
+            models.Index(
+                fields=['user', 'author'], name='feed_user_author_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'], name='unique_feed_entry'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} <- {self.post_id}'
+
+
+class AuthorShard(models.Model):
+    """Шард, за которым закреплены посты автора (posts.shards)."""
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        verbose_name='Автор',
+        related_name='+',
+    )
+    shard = models.CharField(verbose_name='Шард', max_length=100)
+
+    class Meta:
+        verbose_name = 'Шард автора'
+        verbose_name_plural = 'Шарды авторов'
+
+    def __str__(self):
+        return f'{self.author_id}: {self.shard}'
+
+
+class PostKey(models.Model):
+    """Сквозной id поста и его автор: по автору находится шард поста."""
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        verbose_name='Автор',
+        related_name='+',
+    )
+
+    class Meta:
+        verbose_name = 'Ключ поста'
+        verbose_name_plural = 'Ключи постов'
+
+    def __str__(self):
+        return f'{self.pk}: {self.author_id}'
+
+
+class CommentKey(models.Model):
+    """Сквозной id комментария; строки только раздают id и не удаляются."""
+
+    class Meta:
+        verbose_name = 'Ключ комментария'
+        verbose_name_plural = 'Ключи комментариев'
@@ -0,0 +1,289 @@
+"""Полнотекстовый поиск по постам.
+
+Поиск работает через сменный бэкенд (настройка SEARCH_BACKEND).
+Основной бэкенд хранит обратный индекс в виртуальной таблице SQLite
+FTS5 и ранжирует результаты по bm25. Текст перед индексацией
+и запрос перед поиском проходят через один и тот же русский стеммер,
+поэтому «посты», «постом» и «пост» находят друг друга. Каждое слово
+запроса ищется как префикс.
+"""
+import heapq
+import re
+from functools import lru_cache
+from itertools import islice
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+from . import shards
+from .models import Post
+from .utils import CursorPaginator
+
+VOWELS = 'аеиоуыэюя'
+WORD_RE = re.compile(r'\w+')
+
+
+def _by_length(suffixes):
+    """Окончания от длинных к коротким: так ищется самое длинное."""
+    return tuple(sorted(suffixes, key=len, reverse=True))
+
+
+def _groups(preceded, plain):
+    return preceded, plain, _by_length(preceded + plain)
+
+
+PERFECTIVE_GERUND = _groups(
+    ('вшись', 'вши', 'в'),
+    ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв'),
+)
+REFLEXIVE = _by_length(('ся', 'сь'))
+ADJECTIVE = _by_length((
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей',
+    'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая',
+    'яя', 'ою', 'ею',
+))
+PARTICIPLE = _groups(
+    ('ем', 'нн', 'вш', 'ющ', 'щ'),
+    ('ивш', 'ывш', 'ующ'),
+)
+VERB = _groups(
+    ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет',
+     'ют', 'ны', 'ть', 'й', 'л', 'н'),
+    ('ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло',
+     'ено', 'ует', 'уют', 'ены', 'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл',
+     'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю'),
+)
+NOUN = _by_length((
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье',
+    'еи', 'ии', 'ей', 'ой', 'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию',
+    'ью', 'ия', 'ья', 'а', 'е', 'и', 'й', 'о', 'у', 'ы', 'ь', 'ю', 'я',
+))
+DERIVATIONAL = _by_length(('ость', 'ост'))
+SUPERLATIVE = _by_length(('ейше', 'ейш'))
+
+
+def _longest(word, suffixes):
+    for suffix in suffixes:
+        if word.endswith(suffix):
+            return suffix
+    return None
+
+
+def _strip(word, groups):
+    """Снимает окончание; у первой группы перед ним должна быть «а» или «я»."""
+    preceded, plain, ordered = groups
+    found = None
+    for suffix in ordered:
+        if not word.endswith(suffix):
+            continue
+        if suffix in preceded and suffix not in plain:
+            if not word[:-len(suffix)].endswith(('а', 'я')):
+                continue
+        found = suffix
+        break
+    if found is None:
+        return word, False
+    return word[:-len(found)], True
+
+
+def _region(word):
+    """Индекс начала области после первого сочетания гласная-согласная."""
+    for i in range(1, len(word)):
+        if word[i - 1] in VOWELS and word[i] not in VOWELS:
+            return i + 1
+    return len(word)
+
+
+@lru_cache(maxsize=100000)
+def stem(word):
+    """Упрощённый стеммер Snowball для русского языка.
+
+    Результат кэшируется: словарь живого текста невелик, а одни и те же
+    слова повторяются из поста в пост.
+    """
+    word = word.lower().replace('ё', 'е')
+    start = next(
+        (i + 1 for i, char in enumerate(word) if char in VOWELS), len(word)
+    )
+    prefix, rv = word[:start], word[start:]
+    if not rv:
+        return word
+    rv, done = _strip(rv, PERFECTIVE_GERUND)
+    if not done:
+        suffix = _longest(rv, REFLEXIVE)
+        if suffix:
+            rv = rv[:-len(suffix)]
+        suffix = _longest(rv, ADJECTIVE)
+        if suffix:
+            rv = rv[:-len(suffix)]
+            rv, _ = _strip(rv, PARTICIPLE)
+        else:
+            rv, done = _strip(rv, VERB)
+            if not done:
+                suffix = _longest(rv, NOUN)
+                if suffix:
+                    rv = rv[:-len(suffix)]
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    word = prefix + rv
+    r2 = _region(word[_region(word):]) + _region(word)
+    suffix = _longest(word[r2:], DERIVATIONAL)
+    if suffix:
+        word = word[:-len(suffix)]
+    suffix = _longest(word[start:], SUPERLATIVE)
+    if suffix:
+        word = word[:-len(suffix)]
+    if word.endswith('нн'):
+        word = word[:-1]
+    elif word[start:].endswith('ь'):
+        word = word[:-1]
+    return word
+
+
+def tokenize(text):
+    return [stem(word) for word in WORD_RE.findall(str(text).lower())]
+
+
+class BaseSearchBackend:
+    """Интерфейс бэкенда поиска.
+
+    search возвращает список пар (post_id, rank) после позиции position
+    в порядке возрастания rank (чем меньше, тем релевантнее).
+    """
+
+    def index(self, post):
+        raise NotImplementedError
+
+    def remove(self, post_id):
+        raise NotImplementedError
+
+    def add(self, posts):
+        """Добавляет новые посты, заданные парами (pk, text)."""
+        raise NotImplementedError
+
+    def rebuild(self, posts):
+        raise NotImplementedError
+
+    def search(self, query, position=None, backwards=False, limit=10):
+        raise NotImplementedError
+
+
+class SqliteFTS5Backend(BaseSearchBackend):
+    table = 'posts_post_fts'
+
+    def index(self, post):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE rowid = %s', [post.pk]
+            )
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, body) VALUES (%s, %s)',
+                [post.pk, ' '.join(tokenize(post.text))],
+            )
+
+    def remove(self, post_id):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {self.table} WHERE rowid = %s', [post_id]
+            )
+
+    def add(self, posts):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, body) VALUES (%s, %s)',
+                ((pk, ' '.join(tokenize(text))) for pk, text in posts),
+            )
+
+    def rebuild(self, posts):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+        self.add(posts)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {self.table} ({self.table}) VALUES ('optimize')"
+            )
+
+    @staticmethod
+    def match(query):
+        return ' '.join(f'"{token}"*' for token in tokenize(query))
+
+    def search(self, query, position=None, backwards=False, limit=10):
+        match = self.match(query)
+        if not match:
+            return []
+        sql = (f'SELECT rowid, rank FROM {self.table}'
+               f' WHERE {self.table} MATCH %s')
+        params = [match]
+        compare, order = ('<', 'DESC') if backwards else ('>', 'ASC')
+        if position is not None:
+            rank, pk = float(position[0]), int(position[1])
+            sql += (f' AND (rank {compare} %s'
+                    f' OR (rank = %s AND rowid {compare} %s))')
+            params += [rank, rank, pk]
+        sql += f' ORDER BY rank {order}, rowid {order} LIMIT %s'
+        params.append(limit)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+
+class SimpleSearchBackend(BaseSearchBackend):
+    """Поиск без индекса через LIKE для БД без FTS5. Свежие посты выше."""
+
+    def index(self, post):
+        pass
+
+    def remove(self, post_id):
+        pass
+
+    def add(self, posts):
+        pass
+
+    def rebuild(self, posts):
+        pass
+
+    def search(self, query, position=None, backwards=False, limit=10):
+        words = WORD_RE.findall(query)
+        if not words:
+            return []
+        posts = Post.objects.all()
+        for word in words:
+            posts = posts.filter(text__icontains=word)
+        if position is not None:
+            pk = int(position[1])
+            posts = posts.filter(**{'pk__gt' if backwards else 'pk__lt': pk})
+        posts = posts.order_by('pk' if backwards else '-pk')
+        # id постов сквозные: потоки шардов сливаются по id.
+        streams = [
+            shard.values_list('pk', flat=True)[:limit]
+            for shard in shards.querysets(posts)
+        ]
+        pks = heapq.merge(*streams, reverse=not backwards)
+        return [(pk, -pk) for pk in islice(pks, limit)]
+
+
+def get_backend():
+    return import_string(settings.SEARCH_BACKEND)()
+
+
+class SearchPaginator(CursorPaginator):
+    """Курсорная пагинация по (rank, id) результатов поиска."""
+
+    def __init__(self, query, per_page, backend=None):
+        super().__init__(None, per_page, ordering=('search_rank', 'pk'))
+        self.query = query
+        self.backend = backend or get_backend()
+
+    def fetch(self, position, backwards, limit):
+        found = self.backend.search(self.query, position, backwards, limit)
+        posts = shards.in_bulk(
+            [pk for pk, _ in found],
+            Post.objects.select_related('author', 'group').defer('text'),
+        )
+        result = []
+        for pk, rank in found:
+            if pk in posts:
+                posts[pk].search_rank = rank
+                result.append(posts[pk])
+        return result
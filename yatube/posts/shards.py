@@ -0,0 +1,390 @@
+"""Горизонтальное шардирование постов и комментариев.
+
+Посты автора лежат на одном шарде из DATABASE_SHARDS, комментарии -
+на шарде своего поста. Поэтому профиль, страница поста и её
+комментарии читаются с одного шарда, а ленты всех постов и групп
+собираются слиянием потоков шардов, упорядоченных по (pub_date, id).
+Лента подписок остаётся в default: FeedEntry хранит id поста, а посты
+страницы дочитываются с их шардов.
+
+Шард автора при первом посте выбирается остатком от деления id на
+число шардов и закрепляется в AuthorShard, так что новый шард не
+сдвигает старых авторов: их переносит команда rebalance_shards.
+Сквозные id постов выдаёт таблица PostKey в default, она же по id
+поста называет автора; сквозные id комментариев - таблица CommentKey.
+Поэтому при переносе автора строки переезжают со своими id.
+Соответствия автор - шард и пост - автор кэшируются на
+SHARD_CACHE_TIMEOUT. Кэш должен быть общим для всех процессов
+(проверка posts.E001): rebalance_shards меняет шард автора и в кэше,
+и процесс со своим кэшем писал бы на старый шард.
+
+Пользователи и группы копируются на каждый шард (replicate), чтобы
+внешние ключи и select_related постов работали внутри шарда.
+
+Без DATABASE_SHARDS всё лежит в default, и модуль ничего не меняет:
+вместо псевдонима шарда функции возвращают None, а using(None)
+оставляет выбор БД роутерам, так что ленты по-прежнему читаются
+с реплик.
+"""
+import heapq
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.color import no_style
+from django.core.paginator import Paginator
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from . import utils
+from .models import (
+    AuthorShard, Comment, CommentKey, Group, Post, PostKey, User,
+)
+
+AUTHOR_KEY = 'shard-author:{}'
+POST_KEY = 'shard-post:{}'
+CHUNK_SIZE = 500
+
+
+def enabled():
+    return bool(settings.DATABASE_SHARDS)
+
+
+def aliases():
+    """Базы, в которых лежат посты: шарды или [None]."""
+    return settings.DATABASE_SHARDS or [None]
+
+
+def _hashed(author_id):
+    shards = settings.DATABASE_SHARDS
+    return shards[author_id % len(shards)]
+
+
+def for_authors(author_ids):
+    """Шарды авторов: {id автора: псевдоним БД}."""
+    if not enabled():
+        return dict.fromkeys(author_ids)
+    keys = {AUTHOR_KEY.format(pk): pk for pk in author_ids}
+    found = {
+        keys[key]: alias for key, alias in cache.get_many(keys).items()
+        if alias in settings.DATABASE_SHARDS
+    }
+    missing = set(keys.values()) - set(found)
+    if missing:
+        pinned = dict(
+            AuthorShard.objects.filter(author_id__in=missing)
+            .values_list('author_id', 'shard')
+        )
+        for pk in missing:
+            alias = pinned.get(pk)
+            if alias not in settings.DATABASE_SHARDS:
+                alias = _hashed(pk)
+            found[pk] = alias
+        cache.set_many(
+            {AUTHOR_KEY.format(pk): found[pk] for pk in missing},
+            settings.SHARD_CACHE_TIMEOUT,
+        )
+    return found
+
+
+def for_author(author_id):
+    return for_authors([author_id])[author_id]
+
+
+def pin(author_id, alias):
+    """Закрепляет автора за шардом, если он ещё не закреплён."""
+    AuthorShard.objects.bulk_create(
+        [AuthorShard(author_id=author_id, shard=alias)],
+        ignore_conflicts=True,
+    )
+
+
+def authors_of(post_ids):
+    """Авторы постов: {id поста: id автора}; неизвестных постов в нём нет."""
+    keys = {POST_KEY.format(pk): pk for pk in post_ids}
+    found = {keys[key]: pk for key, pk in cache.get_many(keys).items()}
+    missing = set(keys.values()) - set(found)
+    if missing:
+        rows = dict(
+            PostKey.objects.filter(pk__in=missing)
+            .values_list('pk', 'author_id')
+        )
+        cache.set_many(
+            {POST_KEY.format(pk): author for pk, author in rows.items()},
+            settings.SHARD_CACHE_TIMEOUT,
+        )
+        found.update(rows)
+    return found
+
+
+def for_posts(post_ids):
+    """Шарды постов: {id поста: псевдоним}; неизвестных постов в нём нет."""
+    if not enabled():
+        return dict.fromkeys(post_ids)
+    authors = authors_of(post_ids)
+    shards = for_authors(set(authors.values()))
+    return {pk: shards[author] for pk, author in authors.items()}
+
+
+def for_post(post_id):
+    """Шард поста; для неизвестного поста - default, где постов нет."""
+    if not enabled():
+        return None
+    return for_posts([post_id]).get(post_id, DEFAULT_DB_ALIAS)
+
+
+def by_alias(mapping):
+    """Переворачивает {ключ: псевдоним} в {псевдоним: [ключи]}."""
+    grouped = defaultdict(list)
+    for key, alias in mapping.items():
+        grouped[alias].append(key)
+    return grouped
+
+
+def in_bulk(post_ids, queryset=None):
+    """Посты по id со всех шардов: {id: пост}, запрос на шард."""
+    if queryset is None:
+        queryset = Post.objects.all()
+    posts = {}
+    for alias, ids in by_alias(for_posts(post_ids)).items():
+        posts.update(queryset.using(alias).in_bulk(ids))
+    return posts
+
+
+def querysets(queryset):
+    """Копии queryset на каждом шарде."""
+    return [queryset.using(alias) for alias in aliases()]
+
+
+def _position(post):
+    return post.pub_date, post.pk
+
+
+def merge(streams):
+    """Сливает потоки постов, упорядоченные по убыванию (pub_date, id)."""
+    return heapq.merge(*streams, key=_position, reverse=True)
+
+
+class MergedPostList:
+    """Посты всех шардов для Paginator со старыми ссылками ?page=N.
+
+    Срез [a:b] берёт первые b постов каждого шарда и сливает их: как
+    и OFFSET на одной БД, глубокие страницы обходятся дорого.
+    """
+
+    def __init__(self, queryset):
+        self.querysets = [
+            shard.order_by('-pub_date', '-pk')
+            for shard in querysets(queryset)
+        ]
+
+    def count(self):
+        return sum(shard.count() for shard in self.querysets)
+
+    def __getitem__(self, index):
+        streams = [shard[:index.stop] for shard in self.querysets]
+        return list(islice(merge(streams), index.start, index.stop))
+
+
+def paginator(queryset, per_page, ordering=('-pub_date', '-pk')):
+    """Курсорная пагинация queryset по всем шардам."""
+    sources = [
+        utils.CursorPaginator(shard, per_page, ordering)
+        for shard in querysets(queryset)
+    ]
+    if len(sources) == 1:
+        return sources[0]
+    return utils.MergedCursorPaginator(sources, per_page, ordering)
+
+
+def get_page_context(post_list, request):
+    """utils.get_page_context для постов со всех шардов."""
+    if not enabled():
+        return utils.get_page_context(post_list, request)
+    page_number = request.GET.get('page')
+    if page_number is not None:
+        pages = Paginator(MergedPostList(post_list), settings.POST_PAGES)
+        return pages.get_page(page_number)
+    return paginator(post_list, settings.POST_PAGES).get_page(
+        request.GET.get('cursor')
+    )
+
+
+def _own_shard(instance):
+    alias = instance._state.db
+    return alias if alias in settings.DATABASE_SHARDS else None
+
+
+class ShardRouter:
+    """Посты - на шард автора, комментарии - на шард поста.
+
+    Шард определяется по подсказке instance: сам пост или комментарий,
+    автор (author.posts) или пост (post.comments). Запросы без
+    подсказки остаются следующему роутеру, то есть уходят в default:
+    чтение со всех шардов строится явно через querysets().
+    """
+
+    def _route(self, model, hints):
+        instance = hints.get('instance')
+        if not enabled() or instance is None:
+            return None
+        if model is Post:
+            if isinstance(instance, Post):
+                return _own_shard(instance) or for_author(instance.author_id)
+            if isinstance(instance, User):
+                return for_author(instance.pk)
+        elif model is Comment:
+            if isinstance(instance, Comment):
+                return _own_shard(instance) or for_post(instance.post_id)
+            if isinstance(instance, Post):
+                return _own_shard(instance) or for_author(instance.author_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self._route(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._route(model, hints)
+
+
+def replicate(model, objs):
+    """Копирует строки справочной таблицы (пользователей, групп) на шарды."""
+    if not enabled() or not objs:
+        return
+    fields = model._meta.concrete_fields
+    rows = [
+        model(**{field.attname: getattr(obj, field.attname)
+                 for field in fields})
+        for obj in objs
+    ]
+    for alias in settings.DATABASE_SHARDS:
+        manager = model._base_manager.db_manager(alias)
+        existing = set(
+            manager.filter(pk__in=[row.pk for row in rows])
+            .values_list('pk', flat=True)
+        )
+        manager.bulk_create([row for row in rows if row.pk not in existing])
+        manager.bulk_update(
+            [row for row in rows if row.pk in existing],
+            [field.name for field in fields if not field.primary_key],
+        )
+
+
+def unreplicate(model, pk):
+    """Удаляет копии строки справочной таблицы вместе с зависимыми."""
+    for alias in settings.DATABASE_SHARDS:
+        model._base_manager.db_manager(alias).filter(pk=pk).delete()
+
+
+def _chunks(queryset, size=CHUNK_SIZE):
+    """Строки queryset пачками по возрастанию pk, без OFFSET."""
+    last = 0
+    while True:
+        rows = list(queryset.filter(pk__gt=last).order_by('pk')[:size])
+        if not rows:
+            return
+        last = rows[-1].pk
+        yield rows
+
+
+def sync_reference_tables():
+    """Копирует на шарды всех пользователей и все группы."""
+    for model in (User, Group):
+        for rows in _chunks(model._base_manager.all()):
+            replicate(model, rows)
+
+
+def _delete_author_posts(alias, author_id):
+    # Сырым SQL: удаление через QuerySet послало бы post_delete, а пост
+    # не исчезает, а переезжает - счётчики, ленты и картинки остаются.
+    posts, comments = Post._meta.db_table, Comment._meta.db_table
+    with connections[alias].cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {comments} WHERE post_id IN'
+            f' (SELECT id FROM {posts} WHERE author_id = %s)',
+            [author_id],
+        )
+        cursor.execute(
+            f'DELETE FROM {posts} WHERE author_id = %s', [author_id]
+        )
+
+
+def _copy(author_id, source, target, last_post=0, last_comment=0):
+    """Копирует посты автора и комментарии к ним новее last_*.
+
+    Возвращает последние скопированные id поста и комментария источника.
+    """
+    posts = Post.objects.using(source).filter(
+        author_id=author_id, pk__gt=last_post
+    )
+    with transaction.atomic(using=target):
+        for rows in _chunks(posts):
+            Post.objects.using(target).bulk_create(
+                rows, ignore_conflicts=True
+            )
+            if source == DEFAULT_DB_ALIAS:
+                # Посты, написанные до шардирования: ключей у них нет.
+                PostKey.objects.bulk_create(
+                    [PostKey(pk=post.pk, author_id=author_id)
+                     for post in rows],
+                    ignore_conflicts=True,
+                )
+            last_post = rows[-1].pk
+        comments = Comment.objects.using(source).filter(
+            post__author_id=author_id, pk__gt=last_comment
+        )
+        for rows in _chunks(comments):
+            Comment.objects.using(target).bulk_create(
+                rows, ignore_conflicts=True
+            )
+            if source == DEFAULT_DB_ALIAS:
+                CommentKey.objects.bulk_create(
+                    [CommentKey(pk=comment.pk) for comment in rows],
+                    ignore_conflicts=True,
+                )
+            last_comment = rows[-1].pk
+    return last_post, last_comment
+
+
+def _reset_keys():
+    connection = connections[DEFAULT_DB_ALIAS]
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(
+            no_style(), [PostKey, CommentKey]
+        ):
+            cursor.execute(sql)
+
+
+def move_author(author_id, target, source=None):
+    """Переносит посты автора и комментарии к ним на шард target.
+
+    Сначала пишется копия, затем автор закрепляется за target, затем
+    докопируется всё, что появилось на source за время копирования, и
+    только после этого старые строки удаляются. Правки старых постов,
+    сделанные во время переноса, теряются, поэтому переносить лучше
+    в тихие часы. source - default для постов, написанных до
+    шардирования: их надо перенести до того, как сайт начнёт писать
+    на шарды, иначе новые сквозные id совпадут со старыми. Возвращает
+    число перенесённых постов.
+    """
+    current = for_author(author_id)
+    source = source or current
+    if source == target:
+        return 0
+    if target != current:
+        # Остатки прерванного переноса на target никто не читает.
+        _delete_author_posts(target, author_id)
+    last = _copy(author_id, source, target)
+    AuthorShard.objects.update_or_create(
+        author_id=author_id, defaults={'shard': target}
+    )
+    cache.set(
+        AUTHOR_KEY.format(author_id), target, settings.SHARD_CACHE_TIMEOUT
+    )
+    _copy(author_id, source, target, *last)
+    if source == DEFAULT_DB_ALIAS:
+        _reset_keys()
+    moved = Post.objects.using(source).filter(author_id=author_id).count()
+    with transaction.atomic(using=source):
+        _delete_author_posts(source, author_id)
+    return moved
@@ -0,0 +1,188 @@
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_delete,
+)
+from django.dispatch import receiver
+
+from core import storage
+
+from . import cache, counters, feed, search, shards
+from .models import Comment, FeedEntry, Follow, Group, Post, PostKey, User
+
+
+# Счётчики подключаются первыми: раскладка по лентам читает
+# follower_count и при необходимости создаёт строку счётчиков.
+@receiver(post_save, sender=Post)
+def count_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_author(instance.author_id, 'post_count', 1)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.change_author(instance.author_id, 'post_count', -1)
+
+
+@receiver(post_save, sender=Comment)
+def count_new_comment(sender, instance, created, using, raw=False,
+                      **kwargs):
+    if created and not raw:
+        counters.change_comments(instance.post_id, 1, using)
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, using, **kwargs):
+    counters.change_comments(instance.post_id, -1, using)
+
+
+@receiver(post_save, sender=Follow)
+def count_new_follower(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        counters.change_author(instance.author_id, 'follower_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_lost_follower(sender, instance, **kwargs):
+    counters.change_author(instance.author_id, 'follower_count', -1)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feed.fan_out_post(instance)
+
+
+@receiver(post_save, sender=Follow)
+def fill_feed_on_follow(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        feed.stop_fan_out([instance.author_id])
+        feed.follow_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def clear_feed_on_unfollow(sender, instance, **kwargs):
+    feed.resume_fan_out(instance.author_id)
+    feed.unfollow_author(instance.user_id, instance.author_id)
+
+
+@receiver(post_init, sender=Post)
+def remember_group(sender, instance, **kwargs):
+    # Пост может переехать в другую группу: старую ленту тоже сбрасываем.
+    # __dict__, чтобы не догружать поле у выборок с only()/defer().
+    instance._loaded_group_id = instance.__dict__.get('group_id')
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def invalidate_post_pages(sender, instance, **kwargs):
+    group_ids = {instance.group_id, instance._loaded_group_id} - {None}
+    slugs = Group.objects.filter(pk__in=group_ids).values_list(
+        'slug', flat=True
+    ) if group_ids else []
+    cache.bump(
+        cache.index_scope(),
+        cache.author_scope(instance.author.username),
+        cache.post_scope(instance.pk),
+        *(cache.group_scope(slug) for slug in slugs),
+    )
+    instance._loaded_group_id = instance.group_id
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_pages(sender, instance, **kwargs):
+    cache.bump(cache.group_scope(instance.slug))
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_comment_pages(sender, instance, **kwargs):
+    cache.bump(cache.post_scope(instance.post_id))
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def invalidate_follow_pages(sender, instance, **kwargs):
+    cache.bump(cache.author_scope(instance.author.username))
+
+
+@receiver(post_save, sender=Post)
+def index_post_text(sender, instance, raw=False, update_fields=None,
+                    **kwargs):
+    if not raw and (update_fields is None or 'text' in update_fields):
+        search.get_backend().index(instance)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post_text(sender, instance, **kwargs):
+    search.get_backend().remove(instance.pk)
+
+
+def _image_name(value):
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=Post)
+def remember_image(sender, instance, **kwargs):
+    # None - картинка не загружена (defer()) и её прежнее имя неизвестно.
+    value = instance.__dict__.get('image')
+    instance._loaded_image = (
+        None if 'image' not in instance.__dict__ else _image_name(value)
+    )
+
+
+@receiver(post_save, sender=Post)
+def count_image_refs(sender, instance, created, raw=False, **kwargs):
+    # Одну картинку могут делить несколько постов: файл удаляет не
+    # удаление поста, а storage.collect, когда ссылок не осталось.
+    # У нового поста ссылки ещё нет, даже если картинку передали
+    # в конструктор и post_init её запомнил.
+    old = '' if created else instance._loaded_image
+    if raw or old is None:
+        return
+    new = _image_name(instance.image)
+    if new != old:
+        if storage.is_hashed(new):
+            storage.acquire(new)
+        if old and storage.is_hashed(old):
+            storage.release(old)
+    instance._loaded_image = new
+
+
+@receiver(post_delete, sender=Post)
+def release_image(sender, instance, **kwargs):
+    name = _image_name(instance.__dict__.get('image'))
+    if storage.is_hashed(name):
+        storage.release(name)
+
+
+# Шардирование (posts.shards): копии пользователей и групп на шардах
+# и записи в default, которые каскад удаления на шарде не достаёт.
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Group)
+def replicate_reference_row(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        shards.replicate(sender, [instance])
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=Group)
+def unreplicate_reference_row(sender, instance, using, **kwargs):
+    # До удаления в default: сигналы удаляемых на шарде постов ещё
+    # читают их автора.
+    if using == DEFAULT_DB_ALIAS and shards.enabled():
+        shards.unreplicate(sender, instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def pin_author_shard(sender, instance, created, using, raw=False, **kwargs):
+    if created and using in settings.DATABASE_SHARDS:
+        shards.pin(instance.author_id, using)
+
+
+@receiver(post_delete, sender=Post)
+def forget_sharded_post(sender, instance, using, **kwargs):
+    if using in settings.DATABASE_SHARDS:
+        FeedEntry.objects.filter(post_id=instance.pk).delete()
+        PostKey.objects.filter(pk=instance.pk).delete()
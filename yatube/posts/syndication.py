@@ -0,0 +1,245 @@
+"""Ленты RSS, Atom и JSON Feed для всех постов, групп и авторов.
+
+Документ отдаётся StreamingHttpResponse: шапка, затем посты из
+итератора выборки, затем окончание, так что в памяти не держится ни
+выборка целиком, ни весь документ. Last-Modified - дата последнего
+изменения поста области, ETag - эта дата и версия области из
+posts.cache, которую сигналы меняют при каждой записи и удалении поста.
+Дата кэшируется под той же версией, поэтому повторный опрос без
+изменений получает 304, не обращаясь к таблице постов.
+"""
+import hashlib
+import json
+from io import StringIO
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.db.models import Max
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from django.utils import feedgenerator, timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.xmlutils import SimplerXMLGenerator
+
+from . import cache, shards
+from .models import Post
+
+NEWEST_KEY = 'feed-newest'
+# Сколько байт документа копится перед отправкой клиенту
+STREAM_CHUNK = 16 * 1024
+# По сколько строк итератор выборки забирает из курсора БД
+ITERATOR_CHUNK = 100
+
+
+def _scope(slug=None, username=None):
+    if slug is not None:
+        return cache.group_scope(slug)
+    if username is not None:
+        return cache.author_scope(username)
+    return cache.index_scope()
+
+
+def feed_posts(slug=None, username=None):
+    posts = Post.objects.select_related('author', 'group')
+    if slug is not None:
+        posts = posts.filter(group__slug=slug)
+    if username is not None:
+        posts = posts.filter(author__username=username)
+    return posts.order_by('-pub_date', '-id')
+
+
+def newest(slug=None, username=None):
+    """Дата последнего изменения поста области; None, если постов нет."""
+    scope = _scope(slug, username)
+    key = cache.make_key(NEWEST_KEY, scope, cache.get_version(scope))
+    value = django_cache.get(key)
+    if value is None:
+        dates = [
+            shard.aggregate(newest=Max('updated'))['newest']
+            for shard in shards.querysets(feed_posts(slug, username))
+        ]
+        date = max(filter(None, dates), default=None)
+        # Пустая строка, а не None: иначе пустая лента не кэшируется.
+        value = date.isoformat() if date else ''
+        django_cache.set(key, value, settings.PAGE_CACHE_TIMEOUT)
+    return parse_datetime(value) if value else None
+
+
+def last_modified(request, fmt, slug=None, username=None):
+    return newest(slug, username)
+
+
+def etag(request, fmt, slug=None, username=None):
+    # Удаление поста не меняет дат оставшихся, но меняет версию области.
+    scope = _scope(slug, username)
+    date = newest(slug, username)
+    stamp = date.isoformat() if date else ''
+    source = f'{fmt}:{scope}:{cache.get_version(scope)}:{stamp}'
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+def _drain(buffer):
+    chunk = buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    return chunk
+
+
+class StreamingXmlFeed:
+    """Пишет документ feedgenerator по частям, а не целиком в write().
+
+    Наследник задаёт item_element и методы start(handler) и end(handler),
+    которые пишут начало и конец документа.
+    """
+
+    item_element = None
+
+    def __init__(self, *args, newest=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.newest = newest
+
+    def latest_post_date(self):
+        # Родитель ищет дату по self.items, а здесь они не накапливаются.
+        return self.newest or timezone.now()
+
+    def item(self, **kwargs):
+        self.add_item(**kwargs)
+        return self.items.pop()
+
+    def stream(self, items):
+        buffer = StringIO()
+        handler = SimplerXMLGenerator(buffer, 'utf-8')
+        handler.startDocument()
+        self.start(handler)
+        yield _drain(buffer)
+        for item in items:
+            handler.startElement(
+                self.item_element, self.item_attributes(item)
+            )
+            self.add_item_elements(handler, item)
+            handler.endElement(self.item_element)
+            if buffer.tell() >= STREAM_CHUNK:
+                yield _drain(buffer)
+        self.end(handler)
+        yield _drain(buffer)
+
+
+class RssFeed(StreamingXmlFeed, feedgenerator.Rss201rev2Feed):
+    item_element = 'item'
+
+    def start(self, handler):
+        handler.startElement('rss', self.rss_attributes())
+        handler.startElement('channel', self.root_attributes())
+        self.add_root_elements(handler)
+
+    def end(self, handler):
+        self.endChannelElement(handler)
+        handler.endElement('rss')
+
+
+class AtomFeed(StreamingXmlFeed, feedgenerator.Atom1Feed):
+    item_element = 'entry'
+
+    def start(self, handler):
+        handler.startElement('feed', self.root_attributes())
+        self.add_root_elements(handler)
+
+    def end(self, handler):
+        handler.endElement('feed')
+
+
+class JsonFeed:
+    """JSON Feed 1.1 (https://jsonfeed.org/version/1.1)."""
+
+    content_type = 'application/feed+json; charset=utf-8'
+
+    def __init__(self, title, link, description, feed_url, newest=None):
+        self.feed = {
+            'version': 'https://jsonfeed.org/version/1.1',
+            'title': title,
+            'home_page_url': link,
+            'feed_url': feed_url,
+            'description': description,
+            'language': settings.LANGUAGE_CODE,
+        }
+
+    def item(self, title, link, description, pubdate, updateddate,
+             author_name, author_link, categories, **kwargs):
+        return {
+            'id': link,
+            'url': link,
+            'title': title,
+            'content_text': description,
+            'date_published': pubdate.isoformat(),
+            'date_modified': updateddate.isoformat(),
+            'authors': [{'name': author_name, 'url': author_link}],
+            'tags': categories,
+        }
+
+    def stream(self, items):
+        head = json.dumps(self.feed, ensure_ascii=False)
+        yield head[:-1] + ', "items": ['
+        separator = ''
+        for item in items:
+            yield separator + json.dumps(item, ensure_ascii=False)
+            separator = ', '
+        yield ']}'
+
+
+FORMATS = {
+    'rss': RssFeed,
+    'atom': AtomFeed,
+    'json': JsonFeed,
+}
+
+
+def feed_response(request, fmt, title, link, description, posts, newest):
+    """Потоковый ответ с документом ленты из выборки постов."""
+    feed = FORMATS[fmt](
+        title=title,
+        link=request.build_absolute_uri(link),
+        description=description,
+        feed_url=request.build_absolute_uri(),
+        newest=newest,
+    )
+    items = (
+        feed.item(**_post_item(request, post)) for post in _stream(posts)
+    )
+    return StreamingHttpResponse(
+        feed.stream(items), content_type=feed.content_type
+    )
+
+
+def _stream(posts):
+    """Первые SYNDICATION_ITEMS постов выборки, слитые со всех шардов."""
+    # Выборка читается уже после выхода из middleware, когда
+    # маршрутизатор реплик сброшен, поэтому БД выбирается сейчас.
+    streams = [
+        shard.using(shard.db)[:settings.SYNDICATION_ITEMS]
+        .iterator(chunk_size=ITERATOR_CHUNK)
+        for shard in shards.querysets(posts)
+    ]
+    if len(streams) == 1:
+        return streams[0]
+    return islice(shards.merge(streams), settings.SYNDICATION_ITEMS)
+
+
+def _post_item(request, post):
+    link = request.build_absolute_uri(
+        reverse('posts:post_detail', args=(post.pk,))
+    )
+    return {
+        'title': post.text[:settings.TEXT_TITLE],
+        'link': link,
+        'description': post.text,
+        'unique_id': link,
+        'unique_id_is_permalink': True,
+        'pubdate': post.pub_date,
+        'updateddate': post.updated,
+        'author_name': post.author.username,
+        'author_link': request.build_absolute_uri(
+            reverse('posts:profile', args=(post.author.username,))
+        ),
+        'categories': [post.group.title] if post.group else [],
+    }
@@ -0,0 +1,35 @@
+from django import template
+from django.conf import settings
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+def _srcset(variants):
+    return ', '.join(
+        f'{thumbnail.url} {width}w' for width, thumbnail in variants
+    )
+
+
+@register.inclusion_tag('includes/picture.html')
+def picture(post, size='detail', css='card-img my-2', lazy=False):
+    """<picture> со всеми готовыми вариантами картинки поста."""
+    context = {'css': css, 'lazy': lazy, 'img': None, 'pending': False}
+    if not post.image:
+        return context
+    found = thumbnails.variants(post.image, size, post.image_width)
+    fallback = found.get(None, [])
+    width = int(settings.THUMBNAIL_SIZES[size][0].split('x')[0])
+    context['img'] = next(
+        (thumbnail for scaled, thumbnail in fallback if scaled == width),
+        None,
+    )
+    context['pending'] = context['img'] is None
+    context['srcset'] = _srcset(fallback)
+    context['sizes'] = f'(max-width: {width}px) 100vw, {width}px'
+    context['sources'] = [
+        (f'image/{fmt.lower()}', _srcset(found[fmt]))
+        for fmt in thumbnails.formats() if found.get(fmt)
+    ]
+    return context
@@ -0,0 +1,25 @@
+from django.core.cache import cache
+from django.test import TestCase
+
+from .. import benchmark, shards
+from ..models import FeedEntry, Post
+
+
+class BenchmarkSmokeTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_dataset_and_run(self):
+        """Генератор наполняет БД, прогон отдаёт метрики по всем view."""
+        dataset = benchmark.generate_dataset(60, follows_per_user=2)
+        self.assertEqual(dataset['posts'], sum(
+            posts.count() for posts in shards.querysets(Post.objects.all())
+        ))
+        self.assertTrue(FeedEntry.objects.exists())
+        results = benchmark.run_benchmark(requests=3)
+        self.assertEqual(set(results), set(benchmark.VIEWS))
+        for name, row in results.items():
+            with self.subTest(view=name):
+                self.assertEqual(row['statuses'], {200: 3})
+                self.assertLessEqual(row['p50_ms'], row['p99_ms'])
+                self.assertGreater(row['mean_render_ms'], 0)
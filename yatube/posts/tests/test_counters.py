@@ -0,0 +1,82 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from ..counters import for_author
+from ..models import AuthorCounters, Comment, Follow, Post
+
+User = get_user_model()
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def counters(self):
+        return AuthorCounters.objects.get(author=self.author)
+
+    def test_post_count_follows_posts(self):
+        """Счётчик постов растёт при создании и падает при удалении."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Post.objects.create(author=self.author, text='Ещё пост')
+        self.assertEqual(self.counters().post_count, 2)
+        post.delete()
+        self.assertEqual(self.counters().post_count, 1)
+
+    def test_follower_count_follows_subscriptions(self):
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.counters().follower_count, 1)
+        follow.delete()
+        self.assertEqual(self.counters().follower_count, 0)
+
+    def test_comment_count_follows_comments(self):
+        post = Post.objects.create(author=self.author, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий'
+        )
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+
+    def test_post_save_keeps_concurrent_comment_count(self):
+        """Правка поста не затирает комментарий, добавленный после чтения."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        edited = Post.objects.using(post._state.db).get(pk=post.pk)
+        Comment.objects.create(post=post, author=self.reader, text='Отзыв')
+        edited.text = 'Исправленный пост'
+        edited.save()
+        post.refresh_from_db()
+        self.assertEqual(post.text, 'Исправленный пост')
+        self.assertEqual(post.comment_count, 1)
+
+    def test_missing_row_is_counted_on_first_read(self):
+        Post.objects.bulk_create(
+            Post(author=self.author, text=str(i)) for i in range(3)
+        )
+        self.assertEqual(for_author(self.author).post_count, 3)
+
+    def test_reconcile_counters_fixes_drift(self):
+        """Команда исправляет счётчики после массовой вставки."""
+        post = Post.objects.create(author=self.author, text='Пост')
+        Post.objects.bulk_create(
+            Post(author=self.author, text=str(i)) for i in range(4)
+        )
+        Comment.objects.bulk_create([
+            Comment(post=post, author=self.reader, text='Комментарий'),
+        ])
+        Follow.objects.bulk_create([
+            Follow(user=self.reader, author=self.author),
+        ])
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        counters = self.counters()
+        post.refresh_from_db()
+        self.assertEqual(counters.post_count, 5)
+        self.assertEqual(counters.follower_count, 1)
+        self.assertEqual(post.comment_count, 1)
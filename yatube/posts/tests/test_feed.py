@@ -0,0 +1,107 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from ..models import AuthorCounters, FeedEntry, Follow, Post
+
+User = get_user_model()
+
+
+class FollowFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.star = User.objects.create_user(username='star')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def setUp(self):
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def feed(self, **params):
+        response = self.reader_client.get(
+            reverse('posts:follow_index'), params
+        )
+        return response.context['page_obj']
+
+    def test_new_post_is_fanned_out_to_followers(self):
+        """Новый пост попадает в ленту подписчика при записи."""
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.reader, post=post).exists()
+        )
+        self.assertEqual(list(self.feed()), [post])
+
+    def test_follow_backfills_and_unfollow_clears_feed(self):
+        """Подписка подтягивает старые посты, отписка их убирает."""
+        post = Post.objects.create(author=self.author, text='Старый пост')
+        self.reader_client.post(
+            reverse('posts:profile_follow', args=(self.author.username,))
+        )
+        self.assertEqual(list(self.feed()), [post])
+        self.reader_client.post(
+            reverse('posts:profile_unfollow', args=(self.author.username,))
+        )
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader).exists())
+        self.assertEqual(list(self.feed()), [])
+
+    @override_settings(FEED_FANOUT_LIMIT=0, POST_PAGES=3)
+    def test_popular_author_is_merged_on_read(self):
+        """Посты популярного автора читаются без раскладки и сливаются."""
+        Follow.objects.create(user=self.reader, author=self.star)
+        with override_settings(FEED_FANOUT_LIMIT=1000):
+            Follow.objects.create(user=self.reader, author=self.author)
+        posts = []
+        for i in range(4):
+            posts.append(Post.objects.create(author=self.author, text=i))
+            posts.append(Post.objects.create(author=self.star, text=i))
+        self.assertFalse(
+            FeedEntry.objects.filter(author=self.star).exists()
+        )
+        expected = sorted(
+            posts, key=lambda post: (post.pub_date, post.pk), reverse=True
+        )
+        seen = []
+        page = self.feed()
+        seen.extend(page)
+        while page.has_next():
+            page = self.feed(cursor=page.next_cursor)
+            seen.extend(page)
+        self.assertEqual(seen, expected)
+
+    @override_settings(FEED_FANOUT_LIMIT=2, FEED_FANOUT_HYSTERESIS=0.5)
+    def test_author_back_under_limit_keeps_posts(self):
+        """Посты, написанные без раскладки, не пропадают из лент."""
+        for user in (self.reader, self.author, self.star):
+            Follow.objects.create(user=user, author=self.star)
+        post = Post.objects.create(author=self.star, text='Без раскладки')
+        self.assertFalse(FeedEntry.objects.filter(post=post).exists())
+
+        def mode():
+            return AuthorCounters.objects.get(author=self.star).feed_mode
+
+        # Два подписчика - уже не больше порога, но ещё выше гистерезиса.
+        Follow.objects.filter(user=self.star).delete()
+        self.assertEqual(mode(), AuthorCounters.MERGE)
+        self.assertEqual(list(self.feed()), [post])
+        Follow.objects.filter(user=self.author).delete()
+        self.assertEqual(mode(), AuthorCounters.FAN_OUT)
+        self.assertTrue(
+            FeedEntry.objects.filter(user=self.reader, post=post).exists()
+        )
+        self.assertEqual(list(self.feed()), [post])
+
+    def test_rebuild_feeds_command(self):
+        Follow.objects.create(user=self.reader, author=self.author)
+        post = Post.objects.create(author=self.author, text='Пост')
+        FeedEntry.objects.all().delete()
+        call_command('rebuild_feeds', stdout=StringIO())
+        self.assertEqual(
+            list(FeedEntry.objects.values_list('user', 'post')),
+            [(self.reader.pk, post.pk)],
+        )
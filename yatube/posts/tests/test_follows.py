@@ -0,0 +1,176 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models.signals import post_delete
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from .. import follows
+from ..counters import for_author_id
+from ..models import FeedEntry, Follow, Post
+
+User = get_user_model()
+
+
+class FollowGraphTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='reader')
+        cls.authors = [
+            User.objects.create_user(username=f'author{i}') for i in range(4)
+        ]
+        for author in cls.authors:
+            Post.objects.create(author=author, text=f'Пост {author}')
+
+    def setUp(self):
+        cache.clear()
+
+    def follower_count(self, author):
+        return for_author_id(author.pk).follower_count
+
+    def test_follow_is_single_insert(self):
+        author = self.authors[0]
+        self.assertTrue(follows.follow(self.reader, author))
+        self.assertFalse(follows.follow(self.reader, author))
+        self.assertEqual(
+            Follow.objects.filter(user=self.reader, author=author).count(), 1
+        )
+        self.assertEqual(self.follower_count(author), 1)
+        self.assertEqual(
+            FeedEntry.objects.filter(user=self.reader, author=author).count(),
+            1,
+        )
+
+    def test_self_follow_is_ignored(self):
+        self.assertFalse(follows.follow(self.reader, self.reader))
+        self.assertFalse(Follow.objects.exists())
+
+    def test_unfollow(self):
+        author = self.authors[0]
+        follows.follow(self.reader, author)
+        self.assertTrue(follows.unfollow(self.reader, author))
+        self.assertFalse(follows.unfollow(self.reader, author))
+        self.assertEqual(self.follower_count(author), 0)
+        self.assertFalse(FeedEntry.objects.filter(user=self.reader).exists())
+
+    def test_unfollow_signal_gets_deleted_pk(self):
+        author = self.authors[0]
+        deleted = []
+
+        def receiver(instance, **kwargs):
+            deleted.append(instance.pk)
+        post_delete.connect(receiver, sender=Follow)
+        self.addCleanup(post_delete.disconnect, receiver, sender=Follow)
+        for returning in (True, False):
+            deleted.clear()
+            follows.follow(self.reader, author)
+            pk = Follow.objects.get(user=self.reader, author=author).pk
+            with self.subTest(returning=returning), mock.patch(
+                'posts.follows._can_return_from_delete',
+                return_value=returning,
+            ):
+                self.assertTrue(follows.unfollow(self.reader, author))
+                self.assertFalse(follows.unfollow(self.reader, author))
+                self.assertEqual(deleted, [pk])
+
+    def test_unique_pair_is_enforced_by_database(self):
+        Follow.objects.create(user=self.reader, author=self.authors[0])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Follow.objects.create(user=self.reader, author=self.authors[0])
+
+    def test_follow_many(self):
+        follows.follow(self.reader, self.authors[0])
+        ids = [author.pk for author in self.authors] + [self.reader.pk]
+        self.assertEqual(follows.follow_many(self.reader, ids), 3)
+        self.assertEqual(follows.follow_many(self.reader, ids), 0)
+        self.assertEqual(Follow.objects.filter(user=self.reader).count(), 4)
+        for author in self.authors:
+            with self.subTest(author=author.username):
+                self.assertEqual(self.follower_count(author), 1)
+        self.assertEqual(FeedEntry.objects.filter(user=self.reader).count(), 4)
+
+    def test_follow_many_leaves_other_users_feeds(self):
+        other = User.objects.create_user(username='other')
+        Follow.objects.bulk_create(
+            [Follow(user=other, author=self.authors[0])]
+        )
+        follows.follow_many(self.reader, [self.authors[1].pk])
+        self.assertFalse(FeedEntry.objects.filter(user=other).exists())
+
+
+@override_settings(FOLLOW_PAGES=2)
+class FollowListViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.readers = [
+            User.objects.create_user(username=f'reader{i}') for i in range(5)
+        ]
+        for reader in cls.readers:
+            Follow.objects.create(user=reader, author=cls.author)
+            Follow.objects.create(user=cls.author, author=reader)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def walk(self, name):
+        seen = []
+        cursor = ''
+        while cursor is not None:
+            # Пользователь страницы и одна страница списка.
+            with self.assertNumQueries(2):
+                response = self.client.get(
+                    reverse(name, args=(self.author.username,)),
+                    {'cursor': cursor},
+                )
+            seen += [user.username for user in response.context['users']]
+            cursor = response.context['page_obj'].next_cursor
+        return seen
+
+    def test_followers_pages(self):
+        self.assertEqual(
+            self.walk('posts:followers'),
+            [reader.username for reader in self.readers],
+        )
+
+    def test_following_pages(self):
+        self.assertEqual(
+            self.walk('posts:following'),
+            [reader.username for reader in self.readers],
+        )
+
+    def test_unknown_user(self):
+        response = self.client.get(
+            reverse('posts:followers', args=('missing',))
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_unfollow_without_follow_is_not_found(self):
+        self.client.force_login(self.readers[0])
+        Follow.objects.filter(user=self.readers[0]).delete()
+        response = self.client.post(
+            reverse('posts:profile_unfollow', args=(self.author.username,))
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_follow_views_accept_only_post(self):
+        """Подписка меняет данные: GET по ссылке её не оформляет."""
+        reader = self.readers[0]
+        Follow.objects.filter(user=reader).delete()
+        self.client.force_login(reader)
+        for name in ('posts:profile_follow', 'posts:profile_unfollow'):
+            with self.subTest(view=name):
+                response = self.client.get(
+                    reverse(name, args=(self.author.username,))
+                )
+                self.assertEqual(response.status_code, 405)
+        self.assertFalse(Follow.objects.filter(user=reader).exists())
+        response = self.client.get(
+            reverse('posts:profile', args=(self.author.username,))
+        )
+        self.assertContains(response, 'method="post"')
@@ -3,6 +3,7 @@ from django.test import Client, TestCase
 from django.urls import reverse
 from http import HTTPStatus
 
+from .. import shards
 from ..models import Post, Group
 
 User = get_user_model()
@@ -35,8 +36,9 @@ class PostPagesTests(TestCase):
             data=form_data,
             follow=True
         )
-        post = Post.objects.last()
-        self.assertEqual(Post.objects.count(), 1)
+        posts = Post.objects.using(shards.for_author(self.user.pk))
+        post = posts.last()
+        self.assertEqual(posts.count(), 1)
         self.assertEqual(post.text, form_data['text'])
         self.assertEqual(post.group, self.group)
         self.assertEqual(post.author, self.user)
@@ -60,8 +62,9 @@ class PostPagesTests(TestCase):
             data=form_data,
             follow=True
         )
-        post = Post.objects.first()
-        self.assertEqual(Post.objects.count(), 1)
+        posts = Post.objects.using(shards.for_author(self.user.pk))
+        post = posts.first()
+        self.assertEqual(posts.count(), 1)
         self.assertEqual(post.text, form_data['text'])
         self.assertEqual(post.group, group)
         self.assertEqual(post.author, self.user)
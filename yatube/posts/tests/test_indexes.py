@@ -0,0 +1,90 @@
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+BAD_PLAN_STEPS = ('USE TEMP B-TREE',)
+
+
+def query_plan(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def bad_steps(plan):
+    """Шаги плана с полным сканированием таблицы или сортировкой."""
+    return [
+        step for step in plan
+        if step.startswith(BAD_PLAN_STEPS)
+        or (step.startswith('SCAN') and 'INDEX' not in step)
+    ]
+
+
+class FeedQueryPlanTest(TestCase):
+    """EXPLAIN QUERY PLAN для запросов лент, которые реально делают view."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='plan-slug', description='Описание'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for i in range(15):
+            post = Post.objects.create(
+                author=cls.author, group=cls.group, text=f'Пост {i}'
+            )
+        cls.post = post
+        Comment.objects.create(post=post, author=cls.reader, text='Коммент')
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def assert_indexed(self, address):
+        first = self.client.get(address).context['page_obj']
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(address, {'cursor': first.next_cursor})
+            self.client.get(address)
+        for query in context.captured_queries:
+            sql = query['sql']
+            if 'posts_' not in sql or not sql.startswith('SELECT'):
+                continue
+            with self.subTest(sql=sql):
+                plan = query_plan(sql)
+                self.assertEqual(bad_steps(plan), [], plan)
+
+    def test_feed_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN есть только в SQLite')
+        addresses = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(self.group.slug,)),
+            reverse('posts:profile', args=(self.author.username,)),
+            reverse('posts:follow_index'),
+        )
+        for address in addresses:
+            with self.subTest(address=address):
+                self.assert_indexed(address)
+
+    def test_post_detail_queries_use_indexes(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN есть только в SQLite')
+        address = reverse('posts:post_detail', args=(self.post.pk,))
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(address)
+        for query in context.captured_queries:
+            sql = query['sql']
+            if 'posts_' not in sql:
+                continue
+            with self.subTest(sql=sql):
+                plan = query_plan(sql)
+                self.assertEqual(bad_steps(plan), [], plan)
@@ -0,0 +1,124 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from core import storage
+from core.models import StoredFile
+
+from .. import shards
+from ..models import Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+OTHER_GIF = SMALL_GIF[:-1] + b'\x00\x3B'
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class PostImageStorageTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='photographer')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, name='small.gif', content=SMALL_GIF):
+        return Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(name, content, content_type='image/gif'),
+        )
+
+    def refs(self, name):
+        return StoredFile.objects.get(name=name).refs
+
+    def test_same_image_is_shared(self):
+        """Одинаковые картинки разных постов - один файл с двумя ссылками."""
+        first = self.create_post('cat.gif')
+        second = self.create_post('dog.gif')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(storage.is_hashed(first.image.name))
+        self.assertEqual(self.refs(first.image.name), 2)
+
+    def test_file_is_deleted_with_last_post(self):
+        """Файл живёт, пока на него ссылается хоть один пост."""
+        first = self.create_post()
+        second = self.create_post()
+        name = first.image.name
+        first.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(self.refs(name), 1)
+        Post.objects.using(second._state.db).get(pk=second.pk).delete()
+        self.assertFalse(default_storage.exists(name))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+
+    def test_post_created_from_stored_name_takes_a_ref(self):
+        """Пост с уже сохранённой картинкой по имени тоже берёт ссылку."""
+        first = self.create_post()
+        name = first.image.name
+        second = Post.objects.create(
+            author=self.user, text='Та же картинка', image=name
+        )
+        self.assertEqual(self.refs(name), 2)
+        first.delete()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(self.refs(name), 1)
+        second.delete()
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+
+    def test_replaced_image_is_released(self):
+        """Новая картинка поста берёт ссылку, старая её отдаёт."""
+        post = self.create_post()
+        post = Post.objects.using(post._state.db).get(pk=post.pk)
+        old = post.image.name
+        post.image = SimpleUploadedFile('new.gif', OTHER_GIF)
+        post.save()
+        self.assertEqual(self.refs(post.image.name), 1)
+        self.assertFalse(default_storage.exists(old))
+        post.text = 'Новый текст'
+        post.save()
+        self.assertEqual(self.refs(post.image.name), 1)
+
+    def test_migrate_media(self):
+        """Команда переносит старые картинки в хранилище по хэшу."""
+        old = [
+            default_storage.save('posts/first.gif', ContentFile(SMALL_GIF)),
+            default_storage.save('posts/second.gif', ContentFile(SMALL_GIF)),
+        ]
+        for name in old + old[:1]:
+            Post.objects.create(author=self.user, text='Старый', image=name)
+        out = StringIO()
+        call_command('migrate_media', '--workers', '2', stdout=out)
+        posts = Post.objects.using(shards.for_author(self.user.pk))
+        names = set(posts.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertTrue(storage.is_hashed(name))
+        self.assertEqual(self.refs(name), 3)
+        for path in old:
+            self.assertFalse(
+                os.path.exists(os.path.join(TEMP_MEDIA_ROOT, path))
+            )
+        self.assertIn('Перенесено файлов: 2, постов: 3', out.getvalue())
@@ -1,7 +1,12 @@
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.db import connections
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.conf import settings
+from django.urls import reverse
+from .. import shards
 from ..models import Group, Post
+from ..utils import make_excerpt
 
 User = get_user_model()
 
@@ -55,3 +60,52 @@ class PostModelTest(TestCase):
                     PostModelTest.post._meta.get_field(value).verbose_name,
                     expected
                 )
+
+
+@override_settings(POST_EXCERPT_CHARS=20)
+class PostExcerptTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='writer')
+
+    def test_make_excerpt(self):
+        self.assertEqual(make_excerpt('Короткий пост'),
+                         ('Короткий пост', 2, False))
+        self.assertEqual(
+            make_excerpt('Очень длинный текст, который не влез'),
+            ('Очень длинный текст,', 6, True),
+        )
+        self.assertEqual(make_excerpt('Неразрывноеоченьдлинноеслово'),
+                         ('Неразрывноеоченьдлин', 1, True))
+
+    def test_excerpt_follows_text(self):
+        post = Post.objects.create(author=self.user, text='Коротко')
+        self.assertEqual((post.excerpt, post.has_more), ('Коротко', False))
+        post.text = 'Теперь текст гораздо длиннее превью'
+        post.save(update_fields=['text'])
+        post.refresh_from_db()
+        self.assertEqual(post.excerpt, 'Теперь текст гораздо')
+        self.assertEqual((post.word_count, post.has_more), (5, True))
+
+    def test_deferred_save_does_not_load_text(self):
+        Post.objects.create(author=self.user, text='Текст поста')
+        posts = Post.objects.using(shards.for_author(self.user.pk))
+        post = posts.defer('text').get()
+        post.image_width = 10
+        with CaptureQueriesContext(connections[posts.db]) as context:
+            post.save()
+        for query in context.captured_queries:
+            self.assertNotIn('"posts_post"."text"', query['sql'])
+        self.assertEqual(posts.get().excerpt, 'Текст поста')
+
+    def test_feed_does_not_load_text(self):
+        long_text = 'слово ' * 5000
+        Post.objects.create(author=self.user, text=long_text)
+        posts = Post.objects.using(shards.for_author(self.user.pk))
+        with CaptureQueriesContext(connections[posts.db]) as context:
+            response = self.client.get(reverse('posts:index'))
+        self.assertNotIn(long_text, response.content.decode())
+        self.assertContains(response, 'Всего слов: 5000')
+        for query in context.captured_queries:
+            self.assertNotIn('"posts_post"."text"', query['sql'])
@@ -0,0 +1,111 @@
+from unittest import skipIf
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+# Число запросов к БД на один вызов view авторизованным пользователем,
+# включая загрузку сессии и пользователя. Бюджет не должен зависеть
+# от числа постов и комментариев на странице.
+QUERY_BUDGETS = {
+    'posts:index': 3,
+    'posts:group_list': 4,
+    'posts:profile': 5,
+    # ETag страницы поста ищет автора, чтобы учесть версию его области
+    'posts:post_detail': 5,
+    'posts:follow_index': 4,
+    'posts:post_comments': 1,
+    'posts:post_create': 3,
+    'posts:post_edit': 5,
+    'posts:add_comment': 5,
+    # Подписка и отписка проверяют, не перешёл ли автор порог раскладки
+    'posts:profile_follow': 9,
+    'posts:profile_unfollow': 7,
+}
+
+
+class QueryBudgetMixin:
+    """Проверка, что view укладывается в свой бюджет запросов."""
+
+    def assertQueryBudget(self, url_name, method='get', args=(), data=None):
+        budget = QUERY_BUDGETS[url_name]
+        client_method = getattr(self.client, method)
+        with self.assertNumQueries(budget):
+            client_method(reverse(url_name, args=args), data)
+
+
+@skipIf(
+    settings.DATABASE_SHARDS,
+    'бюджеты посчитаны для одной БД: с шардами ленты спрашивают каждый шард',
+)
+class QueryBudgetTest(QueryBudgetMixin, TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.commenters = [
+            User.objects.create_user(username=f'commenter{i}')
+            for i in range(3)
+        ]
+        cls.groups = [
+            Group.objects.create(
+                title=f'Группа {i}', slug=f'slug-{i}', description='-'
+            )
+            for i in range(3)
+        ]
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def fill(self, posts, comments):
+        """Создаёт посты в разных группах и комментарии к последнему."""
+        for i in range(posts):
+            post = Post.objects.create(
+                author=self.author,
+                group=self.groups[i % len(self.groups)],
+                text=f'Пост {i}',
+            )
+        for i in range(comments):
+            Comment.objects.create(
+                post=post,
+                author=self.commenters[i % len(self.commenters)],
+                text=f'Комментарий {i}',
+            )
+        return post
+
+    def check_read_views(self, post):
+        group = self.groups[0]
+        self.assertQueryBudget('posts:index')
+        self.assertQueryBudget('posts:group_list', args=(group.slug,))
+        self.assertQueryBudget('posts:profile', args=(self.author.username,))
+        self.assertQueryBudget('posts:post_detail', args=(post.pk,))
+        self.assertQueryBudget('posts:follow_index')
+        self.assertQueryBudget('posts:post_comments', args=(post.pk,))
+
+    def test_read_views_with_few_rows(self):
+        self.check_read_views(self.fill(posts=2, comments=2))
+
+    def test_read_views_with_many_rows(self):
+        self.check_read_views(self.fill(posts=25, comments=30))
+
+    def test_write_views(self):
+        post = self.fill(posts=1, comments=0)
+        self.assertQueryBudget('posts:post_create')
+        self.assertQueryBudget('posts:add_comment', method='post',
+                               args=(post.pk,), data={'text': 'Привет'})
+        self.assertQueryBudget('posts:profile_unfollow', method='post',
+                               args=(self.author.username,))
+        self.assertQueryBudget('posts:profile_follow', method='post',
+                               args=(self.author.username,))
+        self.client.force_login(self.author)
+        self.assertQueryBudget('posts:post_edit', args=(post.pk,))
@@ -0,0 +1,95 @@
+from io import StringIO
+from unittest import skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from ..models import Post
+from ..search import SearchPaginator, stem
+
+User = get_user_model()
+
+
+class StemTest(TestCase):
+    def test_word_forms_share_stem(self):
+        forms = {
+            'пост': ('посты', 'постом', 'поста'),
+            'книг': ('книги', 'книгами', 'книгу'),
+            'быстр': ('быстрые', 'быстрого', 'быстрый'),
+        }
+        for expected, words in forms.items():
+            for word in words:
+                with self.subTest(word=word):
+                    self.assertEqual(stem(word), expected)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'FTS5 есть только в SQLite')
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='writer')
+        cls.programming = Post.objects.create(
+            author=cls.user, text='Я люблю программирование на Python'
+        )
+        cls.books = Post.objects.create(
+            author=cls.user, text='Читаю книги, книги и ещё раз книги'
+        )
+        cls.one_book = Post.objects.create(
+            author=cls.user, text='Купил книгу про котов'
+        )
+
+    def search(self, query, cursor=None):
+        return SearchPaginator(query, 10).get_page(cursor)
+
+    def test_finds_other_word_forms(self):
+        """Поиск находит другие формы слова."""
+        self.assertEqual(list(self.search('программированию')),
+                         [self.programming])
+
+    def test_prefix_match(self):
+        self.assertEqual(list(self.search('прогр')), [self.programming])
+
+    def test_results_are_ranked(self):
+        """Более релевантный пост выше."""
+        self.assertEqual(list(self.search('книга')),
+                         [self.books, self.one_book])
+
+    def test_index_follows_edits_and_deletes(self):
+        post = Post.objects.using(self.programming._state.db).get(
+            pk=self.programming.pk
+        )
+        post.text = 'Теперь про садоводство'
+        post.save()
+        self.assertEqual(list(self.search('программирование')), [])
+        self.assertEqual(list(self.search('садоводство')), [post])
+        post.delete()
+        self.assertEqual(list(self.search('садоводство')), [])
+
+    def test_cursor_pages(self):
+        paginator = SearchPaginator('книги', 1)
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        self.assertEqual(list(first) + list(second),
+                         [self.books, self.one_book])
+        self.assertFalse(second.has_next())
+        back = paginator.get_page(second.previous_cursor)
+        self.assertEqual(list(back), [self.books])
+
+    def test_rebuild_search_index(self):
+        Post.objects.bulk_create([
+            Post(author=self.user, text='Неиндексированный пост про кактусы'),
+        ])
+        self.assertEqual(list(self.search('кактусы')), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(len(self.search('кактусы')), 1)
+
+    @override_settings(POST_PAGES=1)
+    def test_search_view(self):
+        response = Client().get(reverse('posts:search'), {'q': 'книги'})
+        self.assertTemplateUsed(response, 'posts/search.html')
+        self.assertEqual(list(response.context['page_obj']), [self.books])
+        self.assertContains(response, '?q=%D0%BA%D0%BD%D0%B8%D0%B3%D0%B8')
@@ -0,0 +1,263 @@
+from contextlib import ExitStack
+from datetime import timedelta
+from io import StringIO
+from unittest import skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import (
+    Client, SimpleTestCase, TestCase, override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from .. import checks, follows, shards
+from ..management.commands.rebalance_shards import plan
+from ..models import AuthorShard, Comment, FeedEntry, Group, Post, PostKey
+
+User = get_user_model()
+
+
+class RebalancePlanTest(SimpleTestCase):
+    def test_largest_fitting_author_moves(self):
+        loads = {'shard_1': {1: 10, 2: 5, 3: 1}, 'shard_2': {}}
+        self.assertEqual(plan(loads, 0.1), [(1, 'shard_1', 'shard_2')])
+        self.assertEqual(loads['shard_2'], {1: 10})
+
+    def test_drained_shard_is_emptied(self):
+        loads = {'shard_1': {1: 3}, 'shard_2': {2: 2}, 'shard_3': {}}
+        moves = plan(loads, 0.1, drain=['shard_1'])
+        self.assertEqual(moves, [(1, 'shard_1', 'shard_3')])
+        self.assertEqual(loads['shard_1'], {})
+
+    def test_balanced_shards_stay(self):
+        loads = {'shard_1': {1: 5, 2: 5}, 'shard_2': {3: 9}}
+        self.assertEqual(plan(loads, 0.2), [])
+
+
+class ShardCacheCheckTest(SimpleTestCase):
+    LOCAL = checks.LOCAL_CACHES[0]
+    SHARED = 'django.core.cache.backends.filebased.FileBasedCache'
+
+    def errors(self, aliases, backend):
+        with override_settings(DATABASE_SHARDS=aliases,
+                               CACHES={'default': {'BACKEND': backend}}):
+            return [error.id for error in checks.check_shard_cache(None)]
+
+    def test_shards_need_shared_cache(self):
+        self.assertEqual(self.errors(['shard_1'], self.LOCAL), ['posts.E001'])
+        self.assertEqual(self.errors(['shard_1'], self.SHARED), [])
+        self.assertEqual(self.errors([], self.LOCAL), [])
+
+
+@skipUnless(
+    len(settings.DATABASE_SHARDS) >= 2,
+    'нужны два шарда: DB_SHARDS=shard_1.sqlite3,shard_2.sqlite3'
+    ' python manage.py test posts.tests.test_shards',
+)
+class ShardingTest(TestCase):
+    databases = '__all__'
+
+    @classmethod
+    def setUpTestData(cls):
+        # id соседних пользователей дают разные остатки: авторы
+        # попадают на разные шарды.
+        cls.first = User.objects.create_user(username='first')
+        cls.second = User.objects.create_user(username='second')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def create_posts(self, author, count, start=None, group=None):
+        start = start or timezone.now()
+        posts = []
+        for number in range(count):
+            post = Post.objects.create(
+                author=author, text=f'{author} {number}', group=group
+            )
+            # Посты авторов перемежаются во времени.
+            Post.objects.using(post._state.db).filter(pk=post.pk).update(
+                pub_date=start - timedelta(minutes=2 * number)
+            )
+            posts.append(post)
+        return posts
+
+    def page_ids(self, response):
+        return [post.pk for post in response.context['page_obj']]
+
+    def expected_ids(self, posts):
+        rows = {}
+        for alias in shards.aliases():
+            rows.update(
+                Post.objects.using(alias).filter(pk__in=[p.pk for p in posts])
+                .values_list('pk', 'pub_date')
+            )
+        return sorted(rows, key=lambda pk: (rows[pk], pk), reverse=True)
+
+    def test_posts_and_comments_stay_on_author_shard(self):
+        """Пост - на шарде автора, комментарий - на шарде поста."""
+        post = Post.objects.create(author=self.first, text='Пост')
+        other = Post.objects.create(author=self.second, text='Пост')
+        alias = shards.for_author(self.first.pk)
+        self.assertNotEqual(alias, shards.for_author(self.second.pk))
+        self.assertEqual(post._state.db, alias)
+        self.assertFalse(Post.objects.using(DEFAULT_DB_ALIAS).exists())
+        self.assertEqual(PostKey.objects.get(pk=post.pk).author, self.first)
+        self.assertEqual(AuthorShard.objects.get(author=self.first).shard,
+                         alias)
+        self.assertNotEqual(post.pk, other.pk)
+        Comment.objects.create(post=post, author=self.second, text='Отзыв')
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(Comment.objects.using(alias).count(), 1)
+        self.assertEqual(post.comments.get().author, self.second)
+
+    def test_users_and_groups_are_replicated(self):
+        for alias in settings.DATABASE_SHARDS:
+            self.assertTrue(
+                User.objects.using(alias).filter(username='reader').exists()
+            )
+            self.assertTrue(
+                Group.objects.using(alias).filter(slug='group').exists()
+            )
+
+    def test_profile_and_post_detail_read_one_shard(self):
+        """Профиль и страница поста не обращаются к чужим шардам."""
+        post = Post.objects.create(author=self.first, text='Пост')
+        Comment.objects.create(
+            post=post, author=self.reader, text='Отзыв читателя'
+        )
+        other = [
+            alias for alias in settings.DATABASE_SHARDS
+            if alias != post._state.db
+        ]
+        for url in (
+            reverse('posts:profile', args=('first',)),
+            reverse('posts:post_detail', args=(post.pk,)),
+        ):
+            cache.clear()
+            with ExitStack() as stack:
+                captures = [
+                    stack.enter_context(
+                        CaptureQueriesContext(connections[alias])
+                    )
+                    for alias in other
+                ]
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(sum(len(c) for c in captures), 0, url)
+        self.assertContains(response, 'Отзыв читателя')
+        missing = reverse('posts:post_detail', args=(post.pk + 100,))
+        self.assertEqual(self.client.get(missing).status_code, 404)
+
+    def test_index_and_group_merge_shards(self):
+        """Ленты сливают шарды по (pub_date, id) и листаются курсором."""
+        start = timezone.now()
+        posts = self.create_posts(self.first, 8, start, self.group)
+        posts += self.create_posts(
+            self.second, 8, start - timedelta(minutes=1), self.group
+        )
+        expected = self.expected_ids(posts)
+        for url in (reverse('posts:index'),
+                    reverse('posts:group_list', args=('group',))):
+            response = self.client.get(url)
+            page = response.context['page_obj']
+            self.assertEqual(self.page_ids(response), expected[:10])
+            response = self.client.get(url, {'cursor': page.next_cursor})
+            self.assertEqual(self.page_ids(response), expected[10:])
+            response = self.client.get(url, {'page': 2})
+            self.assertEqual(self.page_ids(response), expected[10:])
+            self.assertEqual(response.context['page_obj'].paginator.count, 16)
+
+    def test_follow_index_reads_posts_from_shards(self):
+        start = timezone.now()
+        follows.follow(self.reader, self.first)
+        follows.follow(self.reader, self.second)
+        posts = self.create_posts(self.first, 3, start)
+        posts += self.create_posts(
+            self.second, 3, start - timedelta(minutes=1)
+        )
+        # Раскладка запомнила дату создания: выравниваем её по постам.
+        for post in posts:
+            FeedEntry.objects.filter(post_id=post.pk).update(
+                pub_date=Post.objects.using(post._state.db)
+                .get(pk=post.pk).pub_date
+            )
+        self.client.force_login(self.reader)
+        response = self.client.get(reverse('posts:follow_index'))
+        self.assertEqual(self.page_ids(response), self.expected_ids(posts))
+
+    def test_deleted_post_leaves_no_feed_entries(self):
+        follows.follow(self.reader, self.first)
+        post = Post.objects.create(author=self.first, text='Пост')
+        self.assertTrue(FeedEntry.objects.filter(post_id=post.pk).exists())
+        post.delete()
+        self.assertFalse(FeedEntry.objects.filter(post_id=post.pk).exists())
+        self.assertFalse(PostKey.objects.filter(pk=post.pk).exists())
+
+    def test_rebalance_moves_whole_authors(self):
+        """Авторы переезжают с постами и комментариями к ним."""
+        crowded = settings.DATABASE_SHARDS[0]
+        for author in (self.first, self.second, self.reader):
+            AuthorShard.objects.create(author=author, shard=crowded)
+        posts = self.create_posts(self.first, 4)
+        self.create_posts(self.second, 3)
+        self.create_posts(self.reader, 1)
+        comment = Comment.objects.create(
+            post=posts[0], author=self.reader, text='Отзыв читателя'
+        )
+        out = StringIO()
+        call_command('rebalance_shards', stdout=out)
+        moved = AuthorShard.objects.get(author=self.first).shard
+        self.assertNotEqual(moved, crowded)
+        self.assertIn('Перенесено авторов: 1, постов: 4', out.getvalue())
+        self.assertFalse(
+            Post.objects.using(crowded).filter(author=self.first).exists()
+        )
+        self.assertFalse(Comment.objects.using(crowded).exists())
+        self.assertEqual(
+            Comment.objects.using(moved).get(text='Отзыв читателя').pk,
+            comment.pk,
+        )
+        response = self.client.get(
+            reverse('posts:post_detail', args=(posts[0].pk,))
+        )
+        self.assertEqual(response.context['post'].comment_count, 1)
+        self.assertContains(response, 'Отзыв читателя')
+
+    def test_rebalance_moves_posts_written_before_sharding(self):
+        Post.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+            [Post(author=self.first, text='Старый пост')]
+        )
+        legacy = Post.objects.using(DEFAULT_DB_ALIAS).get()
+        Comment.objects.using(DEFAULT_DB_ALIAS).bulk_create(
+            [Comment(post=legacy, author=self.reader, text='Старый отзыв')]
+        )
+        old = Comment.objects.using(DEFAULT_DB_ALIAS).get()
+        call_command('rebalance_shards', stdout=StringIO())
+        self.assertFalse(Post.objects.using(DEFAULT_DB_ALIAS).exists())
+        self.assertEqual(shards.for_post(legacy.pk),
+                         shards.for_author(self.first.pk))
+        new = Post.objects.create(author=self.first, text='Новый пост')
+        self.assertGreater(new.pk, legacy.pk)
+        alias = shards.for_author(self.first.pk)
+        self.assertTrue(
+            Comment.objects.using(alias).filter(pk=old.pk).exists()
+        )
+        comment = Comment.objects.create(
+            post=new, author=self.reader, text='Новый отзыв'
+        )
+        self.assertGreater(comment.pk, old.pk)
+        response = self.client.get(
+            reverse('posts:post_detail', args=(legacy.pk,))
+        )
+        self.assertContains(response, 'Старый пост')
@@ -0,0 +1,123 @@
+import json
+from xml.etree import ElementTree
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils.http import http_date
+
+from ..models import Group, Post
+
+User = get_user_model()
+
+ATOM = '{http://www.w3.org/2005/Atom}'
+
+
+class SyndicationTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.group = Group.objects.create(
+            title='Книги', slug='books', description='Про книги'
+        )
+        cls.old = Post.objects.create(
+            author=cls.author, text='Старый пост без группы'
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Новый пост про книги'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def get(self, name, fmt, *args, **headers):
+        return self.client.get(reverse(name, args=(*args, fmt)), **headers)
+
+    def test_rss(self):
+        response = self.get('posts:feed', 'rss')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'],
+                         'application/rss+xml; charset=utf-8')
+        root = ElementTree.fromstring(b''.join(response.streaming_content))
+        titles = [item.findtext('description')
+                  for item in root.iter('item')]
+        self.assertEqual(titles, [self.post.text, self.old.text])
+        self.assertEqual(response['Last-Modified'],
+                         http_date(self.post.pub_date.timestamp()))
+
+    def test_atom_group_feed(self):
+        response = self.get('posts:group_feed', 'atom', self.group.slug)
+        root = ElementTree.fromstring(b''.join(response.streaming_content))
+        entries = list(root.iter(f'{ATOM}entry'))
+        self.assertEqual(len(entries), 1)
+        self.assertEqual(entries[0].findtext(f'{ATOM}summary'),
+                         self.post.text)
+
+    def test_json_author_feed(self):
+        response = self.get('posts:author_feed', 'json',
+                            self.author.username)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(data['version'], 'https://jsonfeed.org/version/1.1')
+        self.assertEqual(
+            [item['content_text'] for item in data['items']],
+            [self.post.text, self.old.text],
+        )
+        self.assertEqual(data['items'][0]['tags'], [self.group.title])
+
+    @override_settings(SYNDICATION_ITEMS=1)
+    def test_items_are_limited(self):
+        response = self.get('posts:feed', 'json')
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data['items']), 1)
+
+    def test_unknown_feeds(self):
+        for name, args in (
+            ('posts:feed', ('xml',)),
+            ('posts:group_feed', ('missing', 'rss')),
+            ('posts:author_feed', ('missing', 'rss')),
+        ):
+            with self.subTest(name=name, args=args):
+                response = self.client.get(reverse(name, args=args))
+                self.assertEqual(response.status_code, 404)
+
+    def test_unchanged_poll_skips_post_table(self):
+        etag = self.get('posts:feed', 'rss')['ETag']
+        with self.assertNumQueries(0):
+            response = self.get('posts:feed', 'rss', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        last_modified = self.get('posts:feed', 'atom')['Last-Modified']
+        with self.assertNumQueries(0):
+            response = self.get('posts:feed', 'atom',
+                                HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_new_post_changes_etag(self):
+        etag = self.get('posts:author_feed', 'rss',
+                        self.author.username)['ETag']
+        Post.objects.create(author=self.author, text='Ещё один пост')
+        response = self.get('posts:author_feed', 'rss', self.author.username,
+                            HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_edit_and_delete_change_etag(self):
+        posts = Post.objects.using(self.old._state.db)
+        for change in (
+            lambda: posts.get(pk=self.old.pk).save(),
+            lambda: posts.get(pk=self.old.pk).delete(),
+        ):
+            etag = self.get('posts:feed', 'rss')['ETag']
+            change()
+            response = self.get('posts:feed', 'rss', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+
+    def test_pages_link_feeds(self):
+        response = self.client.get(
+            reverse('posts:group_list', args=(self.group.slug,))
+        )
+        self.assertContains(
+            response, reverse('posts:group_feed', args=('books', 'atom'))
+        )
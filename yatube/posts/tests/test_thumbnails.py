@@ -0,0 +1,192 @@
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from .. import shards, thumbnails
+from ..models import Post
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+def run_on_commit(func):
+    func()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_WORKERS=0)
+class ThumbnailPipelineTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='photographer')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def create_post(self):
+        with mock.patch('posts.thumbnails.transaction.on_commit'):
+            return Post.objects.create(
+                author=self.user,
+                text='Пост с картинкой',
+                image=SimpleUploadedFile(
+                    'small.gif', SMALL_GIF, content_type='image/gif'
+                ),
+            )
+
+    def test_render_shows_placeholder_and_queues_thumbnail(self):
+        """Рендер не строит миниатюру, а ставит её в очередь."""
+        post = self.create_post()
+        with mock.patch('posts.thumbnails.submit') as submit:
+            with mock.patch('posts.thumbnails.transaction.on_commit',
+                            run_on_commit):
+                response = self.client.get(
+                    reverse('posts:post_detail', args=(post.pk,))
+                )
+        self.assertContains(response, 'Изображение обрабатывается')
+        submit.assert_called_once_with(post.image.name)
+
+    def test_failed_thumbnail_is_not_resubmitted_on_each_render(self):
+        """Испорченная картинка не строится заново при каждом рендере."""
+        post = self.create_post()
+        address = reverse('posts:post_detail', args=(post.pk,))
+        with mock.patch('posts.thumbnails.generate',
+                        side_effect=OSError('файл испорчен')) as generate, \
+                mock.patch('posts.thumbnails.transaction.on_commit',
+                           run_on_commit), \
+                self.assertLogs('posts.thumbnails', 'ERROR'):
+            for _ in range(3):
+                response = self.client.get(address)
+                self.assertContains(response, 'Изображение обрабатывается')
+        generate.assert_called_once_with(post.image.name)
+
+    def test_generate_changes_etag_and_cached_pages(self):
+        """Страницы с заглушкой устаревают, когда миниатюры построены."""
+        post = self.create_post()
+        address = reverse('posts:post_detail', args=(post.pk,))
+        self.client.logout()
+        with mock.patch('posts.thumbnails.submit'):
+            etag = self.client.get(address)['ETag']
+            self.client.get(reverse('posts:index'))
+        thumbnails.generate(post.image.name)
+        response = self.client.get(address, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Изображение обрабатывается')
+        self.assertNotContains(
+            self.client.get(reverse('posts:index')),
+            'Изображение обрабатывается',
+        )
+
+    def test_post_create_generates_thumbnails(self):
+        """После сохранения картинки страница отдаёт готовую миниатюру."""
+        with mock.patch('posts.thumbnails.transaction.on_commit',
+                        run_on_commit):
+            self.client.post(reverse('posts:post_create'), {
+                'text': 'Новый пост',
+                'image': SimpleUploadedFile(
+                    'small.gif', SMALL_GIF, content_type='image/gif'
+                ),
+            })
+        post = Post.objects.using(shards.for_author(self.user.pk)).get(
+            text='Новый пост'
+        )
+        self.assertTrue(post.image)
+        with mock.patch('posts.thumbnails.submit') as submit:
+            response = self.client.get(
+                reverse('posts:post_detail', args=(post.pk,))
+            )
+        submit.assert_not_called()
+        self.assertContains(response, f'{settings.MEDIA_URL}cache/')
+
+    def test_post_form_stores_image_metadata(self):
+        """PostForm запоминает размеры, формат и объём картинки."""
+        with mock.patch('posts.thumbnails.transaction.on_commit'):
+            self.client.post(reverse('posts:post_create'), {
+                'text': 'Новый пост',
+                'image': SimpleUploadedFile(
+                    'small.gif', SMALL_GIF, content_type='image/gif'
+                ),
+            })
+        post = Post.objects.using(shards.for_author(self.user.pk)).get(
+            text='Новый пост'
+        )
+        self.assertEqual(
+            (post.image_width, post.image_height, post.image_format,
+             post.image_size),
+            (2, 1, 'gif', len(SMALL_GIF)),
+        )
+
+    def test_generate_fills_missing_metadata(self):
+        """Построение миниатюр заполняет сведения у импортированных постов."""
+        post = self.create_post()
+        self.assertIsNone(post.image_width)
+        thumbnails.generate(post.image.name)
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_format), (2, 'gif'))
+
+    @skipIf(
+        settings.DATABASE_SHARDS,
+        'число запросов посчитано для одной БД',
+    )
+    def test_feed_page_preloads_thumbnails(self):
+        """Страница ленты читает записи миниатюр без запроса на картинку."""
+        for _ in range(3):
+            thumbnails.generate(self.create_post().image.name)
+        self.client.logout()
+        cache.clear()
+        with self.assertNumQueries(2):
+            # Посты страницы и одна выборка записей миниатюр на все.
+            response = self.client.get(reverse('posts:index'))
+        self.assertContains(response, '<picture>', count=3)
+        with self.assertNumQueries(2):
+            # Автор и его посты; записи миниатюр уже в кэше.
+            self.client.get(reverse('posts:profile', args=(self.user,)))
+
+    def test_picture_lists_renditions(self):
+        """<picture> отдаёт WebP и JPEG в ширинах не больше исходной."""
+        post = self.create_post()
+        call_command('generate_thumbnails', '--workers', '0',
+                     stdout=StringIO())
+        response = self.client.get(
+            reverse('posts:post_detail', args=(post.pk,))
+        )
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, '.webp 480w, ')
+        self.assertContains(response, '.jpg 960w"')
+        # Исходная картинка шириной 2px: варианты 1.5x и 2x не нужны.
+        self.assertNotContains(response, '1440w')
+
+    def test_renditions_follow_settings(self):
+        with override_settings(THUMBNAIL_SRCSET=(1, 2),
+                               THUMBNAIL_FORMATS=('WEBP', 'BMP-NOPE')):
+            variants = list(thumbnails.renditions('detail', 4000))
+        self.assertEqual(
+            [(fmt, width) for fmt, width, _, _ in variants],
+            [(None, 960), ('WEBP', 960), (None, 1920), ('WEBP', 1920)],
+        )
+        self.assertEqual(variants[-1][2], '1920x678')
@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from ..models import AuthorCounters, Comment, FeedEntry, Follow, Group, Post
+from ..search import SearchPaginator
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@skipIf(
+    settings.DATABASE_SHARDS,
+    'import_posts пишет в одну БД и с DATABASE_SHARDS не запускается',
+)
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class TransferCommandsTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.dump_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dump_dir)
+        author = User.objects.create_user(username='author')
+        reader = User.objects.create_user(username='reader')
+        group = Group.objects.create(
+            title='Книги', slug='books', description='Про книги'
+        )
+        post = Post.objects.create(
+            author=author, group=group, text='Пост про книги'
+        )
+        Post.objects.create(author=author, text='Пост без группы')
+        Comment.objects.create(post=post, author=reader, text='Отличный пост')
+        Follow.objects.create(user=reader, author=author)
+        self.pub_date = post.pub_date
+
+    def dump_path(self, name):
+        return os.path.join(self.dump_dir, name)
+
+    def round_trip(self, name):
+        path = self.dump_path(name)
+        call_command('export_posts', path, stdout=StringIO())
+        for model in (Follow, Comment, Post, Group, User):
+            model.objects.all().delete()
+        call_command('import_posts', path, stdout=StringIO())
+
+    def assert_restored(self):
+        post = Post.objects.get(text='Пост про книги')
+        self.assertEqual(post.author.username, 'author')
+        self.assertEqual(post.group.slug, 'books')
+        self.assertEqual(post.pub_date, self.pub_date)
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(post.comments.get().author.username, 'reader')
+        self.assertEqual(Post.objects.count(), 2)
+        self.assertEqual(Group.objects.get().description, 'Про книги')
+        reader = User.objects.get(username='reader')
+        self.assertEqual(
+            FeedEntry.objects.filter(user=reader).count(), 2
+        )
+        self.assertEqual(list(SearchPaginator('книга', 10).get_page()),
+                         [post])
+
+    def test_jsonl_round_trip(self):
+        self.round_trip('dump.jsonl')
+        self.assert_restored()
+
+    def test_csv_round_trip(self):
+        self.round_trip('dump.csv')
+        self.assert_restored()
+
+    def test_round_trip_with_small_user_cache(self):
+        with mock.patch('posts.transfer.USER_CACHE_SIZE', 1):
+            self.round_trip('dump.jsonl')
+        self.assert_restored()
+
+    @override_settings(FEED_FANOUT_LIMIT=3)
+    def test_import_switches_popular_authors_to_merge(self):
+        """Посты популярного автора не копируются в ленты подписчиков."""
+        path = self.dump_path('dump.jsonl')
+        with open(path, 'w', encoding='utf-8') as dump:
+            for i in range(5):
+                dump.write(json.dumps({
+                    'type': 'post', 'author': 'star', 'text': f'Пост {i}',
+                }) + '\n')
+            for i in range(20):
+                dump.write(json.dumps({
+                    'type': 'follow', 'user': f'fan{i}', 'author': 'star',
+                }) + '\n')
+        call_command('import_posts', path, stdout=StringIO())
+        star = User.objects.get(username='star')
+        self.assertEqual(
+            AuthorCounters.objects.get(author=star).feed_mode,
+            AuthorCounters.MERGE,
+        )
+        self.assertFalse(FeedEntry.objects.filter(author=star).exists())
+        fan = Client()
+        fan.force_login(User.objects.get(username='fan0'))
+        response = fan.get(reverse('posts:follow_index'))
+        self.assertContains(response, 'Пост 4')
+
+    def test_export_to_stdout(self):
+        out = StringIO()
+        call_command('export_posts', '-', '--format', 'jsonl', stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 5)
+        self.assertIn('"type": "follow"', lines[-1])
+
+    def test_import_copies_images_and_skips_orphans(self):
+        images = os.path.join(self.dump_dir, 'images')
+        os.makedirs(os.path.join(images, 'posts'))
+        with open(os.path.join(images, 'posts', 'cat.gif'), 'wb') as image:
+            image.write(SMALL_GIF)
+        path = self.dump_path('dump.jsonl')
+        with open(path, 'w', encoding='utf-8') as dump:
+            dump.write(
+                '{"type": "post", "id": 7, "author": "newcomer",'
+                ' "text": "Кот", "image": "posts/cat.gif"}\n'
+                '{"type": "comment", "post": 8, "author": "newcomer",'
+                ' "text": "Комментарий к чужому посту"}\n'
+            )
+        out = StringIO()
+        call_command('import_posts', path, '--images', images,
+                     stdout=out, stderr=StringIO())
+        post = Post.objects.get(text='Кот')
+        self.assertEqual(post.author.username, 'newcomer')
+        self.assertTrue(
+            os.path.exists(os.path.join(TEMP_MEDIA_ROOT, post.image.name))
+        )
+        self.assertIn('пропущено: 1', out.getvalue())
+        self.assertEqual(post.comment_count, 0)
+
+    def test_import_skips_images_outside_images_dir(self):
+        images = os.path.join(self.dump_dir, 'images')
+        os.makedirs(images)
+        with open(self.dump_path('secret.gif'), 'wb') as image:
+            image.write(SMALL_GIF)
+        path = self.dump_path('dump.jsonl')
+        with open(path, 'w', encoding='utf-8') as dump:
+            dump.write(
+                '{"type": "post", "author": "newcomer", "text": "Вверх",'
+                ' "image": "../secret.gif"}\n'
+                '{"type": "post", "author": "newcomer", "text": "Корень",'
+                f' "image": "{self.dump_path("secret.gif")}"}}\n'
+            )
+        out = StringIO()
+        call_command('import_posts', path, '--images', images,
+                     stdout=out, stderr=StringIO())
+        self.assertIn('пропущено: 2', out.getvalue())
+        self.assertFalse(
+            Post.objects.filter(text__in=['Вверх', 'Корень'])
+            .exclude(image='').exists()
+        )
@@ -1,15 +1,31 @@
+import base64
+import json
+import warnings
+
 from django import forms
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.conf import settings
 from ..models import Comment, Follow, Group, Post
 from django.core.cache import cache
+from django.core.cache.backends.base import CacheKeyWarning
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connections
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .. import shards
+from ..utils import CursorPaginator
 
 User = get_user_model()
 
 
+def author_posts(author):
+    """Посты автора: при шардировании они лежат на его шарде."""
+    return Post.objects.using(shards.for_author(author.pk))
+
+
 class PostPagesTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -41,6 +57,7 @@ class PostPagesTest(TestCase):
                 image=uploaded,
             ) for i in range(settings.COUNT_POSTS)]
         Post.objects.bulk_create(cls.posts)
+        cls.post = author_posts(cls.user).first()
 
         cls.comment = Comment.objects.create(
             text='Тестовый комментарий',
@@ -61,6 +78,7 @@ class PostPagesTest(TestCase):
         }
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.authorised_client = Client()
         self.authorised_client.force_login(PostPagesTest.user)
@@ -92,21 +110,21 @@ class PostPagesTest(TestCase):
                 self.assertTemplateUsed(response, template)
 
     def test_home_page_show_correct_context(self):
-        page = Post.objects.select_related('author', 'group').all()[:10]
+        page = author_posts(self.user).select_related('author', 'group')[:10]
         response = self.authorised_client.get(reverse('posts:index'))
         self.assertEqual(
             list(response.context.get('page_obj').object_list), list(page)
         )
 
     def test_page_show_correct_context_group(self):
-        page = Post.objects.filter(group=self.group).all()[:10]
+        page = author_posts(self.user).filter(group=self.group)[:10]
         response = self.authorised_client.get(
             reverse('posts:group_list', kwargs={'slug': 'test-slug'}))
         self.assertEqual(list(response.context.get(
             'page_obj').object_list), list(page))
 
     def test_page_show_correct_context_author(self):
-        page = Post.objects.filter(author=self.user).all()[:10]
+        page = author_posts(self.user).filter(author=self.user)[:10]
         response = self.authorised_client.get(
             reverse('posts:profile', kwargs={'username': 'Post_writer'}))
         self.assertEqual(list(response.context.get(
@@ -196,6 +214,9 @@ class PaginatorViewsTest(TestCase):
         cls.authorised_client.force_login(cls.user)
         cls.guest_client = Client()
 
+    def setUp(self):
+        cache.clear()
+
     def test_first_page_contains_ten_records(self):
         addresses = [
             reverse('posts:index'),
@@ -216,6 +237,68 @@ class PaginatorViewsTest(TestCase):
             response = self.authorised_client.get(address + '?page=2')
             self.assertEqual(len(response.context['page_obj']), 3)
 
+    def test_cards_are_separated_once(self):
+        """Между карточками ленты ровно одна черта."""
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, '<hr>', count=9)
+
+    def test_cursor_pages_walk_forward_and_back(self):
+        """Курсор ведёт на следующую страницу и обратно."""
+        addresses = [
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': 'test-slug'}),
+            reverse('posts:profile', kwargs={'username': 'Post_writer'}),
+        ]
+        for address in addresses:
+            with self.subTest(address=address):
+                first = self.guest_client.get(address).context['page_obj']
+                self.assertFalse(first.has_previous())
+                second = self.guest_client.get(
+                    address, {'cursor': first.next_cursor}
+                ).context['page_obj']
+                self.assertEqual(len(second), 3)
+                self.assertFalse(second.has_next())
+                back = self.guest_client.get(
+                    address, {'cursor': second.previous_cursor}
+                ).context['page_obj']
+                self.assertEqual(list(back), list(first))
+
+    def test_cursor_pages_with_equal_pub_date(self):
+        """Посты с одинаковой датой не теряются и не повторяются."""
+        author_posts(self.user).update(pub_date=timezone.now())
+        paginator = CursorPaginator(
+            author_posts(self.user), settings.POST_PAGES
+        )
+        first = paginator.get_page()
+        second = paginator.get_page(first.next_cursor)
+        seen = [post.pk for post in list(first) + list(second)]
+        self.assertEqual(len(seen), settings.COUNT_POSTS)
+        self.assertEqual(len(set(seen)), settings.COUNT_POSTS)
+
+    def test_cursor_page_uses_single_query(self):
+        """Страница курсора стоит один запрос без COUNT(*)."""
+        posts = author_posts(self.user)
+        paginator = CursorPaginator(posts, settings.POST_PAGES)
+        cursor = paginator.get_page().next_cursor
+        with self.assertNumQueries(1, using=posts.db):
+            paginator.get_page(cursor)
+
+    def test_cursor_past_the_end_gives_empty_page(self):
+        paginator = CursorPaginator(
+            author_posts(self.user), settings.POST_PAGES
+        )
+        last = author_posts(self.user).order_by('pub_date', 'pk').first()
+        page = paginator.get_page(paginator.encode_cursor(last))
+        self.assertEqual(list(page), [])
+        self.assertFalse(page.has_other_pages())
+
+    def test_broken_cursor_shows_first_page(self):
+        response = self.guest_client.get(
+            reverse('posts:index'), {'cursor': 'not-a-cursor'}
+        )
+        self.assertEqual(len(response.context['page_obj']), 10)
+        self.assertFalse(response.context['page_obj'].has_previous())
+
 
 class FollowViewsTest(TestCase):
     @classmethod
@@ -314,3 +397,278 @@ class FollowViewsTest(TestCase):
         response = self.author_client.get(
             reverse('posts:follow_index'))
         self.assertNotIn(post, response.context['page_obj'].object_list)
+
+
+class PageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='cached_writer')
+        cls.group = Group.objects.create(
+            title='Кэшируемая группа',
+            slug='cached-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            group=cls.group,
+            text='Закэшированный пост',
+        )
+        cls.addresses = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(cls.group.slug,)),
+            reverse('posts:profile', args=(cls.user.username,)),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_anonymous_page_is_served_from_cache(self):
+        """Повторный анонимный запрос не обращается к БД."""
+        for address in self.addresses:
+            with self.subTest(address=address):
+                first = self.guest_client.get(address)
+                with self.assertNumQueries(0):
+                    second = self.guest_client.get(address)
+                self.assertEqual(first.content, second.content)
+                self.assertEqual(first['Content-Type'], second['Content-Type'])
+
+    def test_new_post_invalidates_cached_pages(self):
+        """Новый пост сбрасывает кэш ленты, группы и профиля."""
+        for address in self.addresses:
+            self.guest_client.get(address)
+        Post.objects.create(
+            author=self.user, group=self.group, text='Свежий пост'
+        )
+        for address in self.addresses:
+            with self.subTest(address=address):
+                response = self.guest_client.get(address)
+                self.assertContains(response, 'Свежий пост')
+
+    def test_moved_post_invalidates_old_group(self):
+        """Перенос поста в другую группу сбрасывает кэш старой группы."""
+        address = reverse('posts:group_list', args=(self.group.slug,))
+        self.assertContains(self.guest_client.get(address), 'Закэшированный')
+        post = author_posts(self.user).get(pk=self.post.pk)
+        post.group = None
+        post.save()
+        self.assertNotContains(
+            self.guest_client.get(address), 'Закэшированный'
+        )
+
+    def test_cursor_pages_are_cached_separately(self):
+        Post.objects.bulk_create(
+            Post(author=self.user, text=f'Пост {i}')
+            for i in range(settings.POST_PAGES)
+        )
+        address = reverse('posts:index')
+        first = self.guest_client.get(address)
+        cursor = first.context['page_obj'].next_cursor
+        second = self.guest_client.get(address, {'cursor': cursor})
+        self.assertNotEqual(first.content, second.content)
+
+    def test_broken_cursors_are_not_cached(self):
+        """Негодный курсор или номер страницы не занимает место в кэше."""
+        address = reverse('posts:index')
+        self.guest_client.get(address)
+        bad_date = base64.urlsafe_b64encode(
+            json.dumps(['n', ['вчера', '1']]).encode()
+        ).decode()
+        for params in ({'cursor': 'garbage'}, {'cursor': bad_date},
+                       {'page': 'last'}):
+            with self.subTest(params=params):
+                response = self.guest_client.get(address, params)
+                self.assertContains(response, 'Закэшированный пост')
+                posts = author_posts(self.user)
+                with CaptureQueriesContext(connections[posts.db]) as queries:
+                    self.guest_client.get(address, params)
+                self.assertTrue(queries)
+
+    def test_cyrillic_scope_gives_valid_cache_key(self):
+        author = User.objects.create_user(username='Писатель')
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', CacheKeyWarning)
+            response = self.guest_client.get(
+                reverse('posts:profile', args=(author.username,))
+            )
+        self.assertEqual(response.status_code, 200)
+
+    def test_post_card_fragment_follows_edits(self):
+        """Карточка поста кэшируется и обновляется после правки."""
+        client = Client()
+        client.force_login(self.user)
+        address = reverse('posts:index')
+        client.get(address)
+        author_posts(self.user).filter(pk=self.post.pk).update(
+            text='Мимо кэша'
+        )
+        self.assertContains(client.get(address), 'Закэшированный пост')
+        post = author_posts(self.user).get(pk=self.post.pk)
+        post.text = 'Исправленный пост'
+        post.save()
+        response = client.get(address)
+        self.assertContains(response, 'Исправленный пост')
+        self.assertNotContains(response, 'Закэшированный пост')
+
+
+@override_settings(COMMENT_PAGES=5)
+class CommentPagesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='commenter')
+        cls.post = Post.objects.create(author=cls.user, text='Обсуждаемый')
+        cls.comments = [
+            Comment.objects.create(
+                post=cls.post, author=cls.user, text=f'Комментарий {i}'
+            )
+            for i in range(7)
+        ]
+
+    def setUp(self):
+        self.client = Client()
+
+    def test_post_detail_renders_first_comment_page(self):
+        """На странице поста только первая страница комментариев."""
+        response = self.client.get(
+            reverse('posts:post_detail', args=(self.post.pk,))
+        )
+        page = response.context['comments']
+        self.assertEqual(list(page), self.comments[:5])
+        self.assertTrue(page.has_next())
+        self.assertContains(
+            response, reverse('posts:post_comments', args=(self.post.pk,))
+        )
+
+    def test_comment_fragment_returns_next_page(self):
+        first = self.client.get(
+            reverse('posts:post_detail', args=(self.post.pk,))
+        ).context['comments']
+        response = self.client.get(
+            reverse('posts:post_comments', args=(self.post.pk,)),
+            {'cursor': first.next_cursor},
+        )
+        self.assertTemplateUsed(response, 'includes/comment_list.html')
+        self.assertEqual(list(response.context['comments']), self.comments[5:])
+        self.assertNotContains(response, 'Показать ещё')
+
+    def test_comment_fragment_as_json(self):
+        response = self.client.get(
+            reverse('posts:post_comments', args=(self.post.pk,)),
+            {'format': 'json'},
+        )
+        data = response.json()
+        self.assertEqual(
+            [comment['id'] for comment in data['comments']],
+            [comment.pk for comment in self.comments[:5]],
+        )
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_comments_of_missing_post_are_not_found(self):
+        address = reverse('posts:post_comments', args=(self.post.pk + 100,))
+        for params in ({}, {'format': 'json'}):
+            with self.subTest(params=params):
+                response = self.client.get(address, params)
+                self.assertEqual(response.status_code, 404)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='etag_writer')
+        cls.reader = User.objects.create_user(username='etag_reader')
+        cls.group = Group.objects.create(
+            title='Группа с ETag',
+            slug='etag-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.user,
+            group=cls.group,
+            text='Пост с ETag',
+        )
+        cls.addresses = (
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(cls.group.slug,)),
+            reverse('posts:profile', args=(cls.user.username,)),
+            reverse('posts:post_detail', args=(cls.post.pk,)),
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def revalidate(self, client, address):
+        etag = client.get(address)['ETag']
+        return client.get(address, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_pages_are_not_modified(self):
+        for address in self.addresses:
+            with self.subTest(address=address):
+                response = self.revalidate(self.guest_client, address)
+                self.assertEqual(response.status_code, 304)
+                self.assertIn('no-cache', response['Cache-Control'])
+                self.assertIn('public', response['Cache-Control'])
+
+    def test_feed_pages_answer_304_without_queries(self):
+        for address in self.addresses:
+            etag = self.guest_client.get(address)['ETag']
+            with self.subTest(address=address), self.assertNumQueries(0):
+                self.guest_client.get(address, HTTP_IF_NONE_MATCH=etag)
+
+    def test_changes_give_new_etag(self):
+        # Какие из addresses меняются: лента, группа, профиль, пост.
+        changes = (
+            (lambda: Post.objects.create(author=self.user, text='Новый'),
+             [True, False, True, True]),
+            (lambda: Comment.objects.create(
+                post=self.post, author=self.reader, text='Комментарий'),
+             [False, False, False, True]),
+            (lambda: Follow.objects.create(user=self.reader, author=self.user),
+             [False, False, True, True]),
+        )
+        for change, expected in changes:
+            etags = [
+                self.guest_client.get(address)['ETag']
+                for address in self.addresses
+            ]
+            change()
+            changed = [
+                self.guest_client.get(
+                    address, HTTP_IF_NONE_MATCH=etag
+                ).status_code == 200
+                for address, etag in zip(self.addresses, etags)
+            ]
+            with self.subTest(expected=expected):
+                self.assertEqual(changed, expected)
+
+    def test_etag_depends_on_user(self):
+        address = self.addresses[0]
+        anonymous = self.guest_client.get(address)['ETag']
+        client = Client()
+        client.force_login(self.reader)
+        response = client.get(address, HTTP_IF_NONE_MATCH=anonymous)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertEqual(self.revalidate(client, address).status_code, 304)
+
+    def test_post_etag_depends_on_csrf_cookie(self):
+        address = self.addresses[3]
+        client = Client()
+        client.force_login(self.reader)
+        etag = client.get(address)['ETag']
+        self.assertEqual(
+            client.get(address, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+        client.cookies[settings.CSRF_COOKIE_NAME] = 'x' * 64
+        response = client.get(address, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_post_is_not_found(self):
+        response = self.guest_client.get(
+            reverse('posts:post_detail', args=(self.post.pk + 100,))
+        )
+        self.assertEqual(response.status_code, 404)
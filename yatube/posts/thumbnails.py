@@ -0,0 +1,324 @@
+"""Подготовка миниатюр Post.image в фоне.
+
+Миниатюры всех размеров из THUMBNAIL_SIZES строит задача очереди
+core.tasks, поставленная при сохранении картинки, а не рендер страницы.
+Бэкенд sorl при рендере только смотрит в key-value store: если
+миниатюры ещё нет, он отправляет её в пул потоков этого процесса
+(чтение страницы не пишет в БД) и отдаёт пустой результат, и шаблон
+рисует заглушку ({% empty %} в теге thumbnail).
+
+Каждый размер из THUMBNAIL_SIZES строится в нескольких ширинах
+(THUMBNAIL_SRCSET) и форматах (THUMBNAIL_FORMATS, плюс запасной JPEG),
+а тег {% picture %} собирает из готовых вариантов <picture> со srcset:
+браузер сам выбирает ширину под экран и формат, который понимает.
+
+Записи key-value store sorl для страницы ленты читаются заранее одним
+cache.get_many (preloaded), так что рендер карточек с картинками не
+делает запроса на каждую картинку. Размеры и формат исходной картинки
+хранятся в самом посте (image_width и т.д.) и файл не открывают.
+
+Если построить миниатюры не удалось (файла нет, он испорчен), рендер
+не ставит их в пул снова THUMBNAIL_FAILURE_TIMEOUT секунд: иначе
+каждая страница с таким постом заново запускала бы построение.
+
+Построив миниатюры, generate сбрасывает версии областей постов с этой
+картинкой (posts.cache): иначе страницы, отрендеренные с заглушкой,
+оставались бы в кэше и отвечали 304 на старый ETag.
+"""
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from PIL import Image
+from sorl.thumbnail import default
+from sorl.thumbnail.base import EXTENSIONS, ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import (
+    EMPTY_VALUE, KVStore as CachedDBKVStore,
+)
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core import tasks
+
+from . import shards
+from .cache import bump_posts, make_key
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+# sorl не знает расширения AVIF, а без него не построить имя файла.
+# Сохранять AVIF Pillow умеет только с плагином; см. formats().
+EXTENSIONS.setdefault('AVIF', 'avif')
+
+FAILED_KEY = 'thumbnail-failed'
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+class PregeneratedThumbnailBackend(ThumbnailBackend):
+    """Не строит миниатюры во время рендера, а ставит их в очередь."""
+
+    def _options(self, source, options):
+        # Те же значения по умолчанию, что в ThumbnailBackend.get_thumbnail,
+        # иначе имя файла миниатюры не совпадёт с построенным.
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_file(self, source, geometry_string, options):
+        """Файл миниатюры source; его key - ключ записи в key-value store."""
+        options = self._options(source, options)
+        name = self._get_thumbnail_filename(source, geometry_string, options)
+        return ImageFile(name, default.storage)
+
+    def lookup(self, file_, geometry_string, **options):
+        """Готовая миниатюра или None; без построения и без очереди."""
+        if not settings.THUMBNAIL_PREGENERATE:
+            return self.generate(file_, geometry_string, **options)
+        return default.kvstore.get(
+            self.thumbnail_file(ImageFile(file_), geometry_string, options)
+        )
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        thumbnail = self.lookup(file_, geometry_string, **options)
+        if thumbnail:
+            return thumbnail
+        schedule(ImageFile(file_).name)
+        return None
+
+    def generate(self, file_, geometry_string, **options):
+        return super().get_thumbnail(file_, geometry_string, **options)
+
+
+class PreloadingKVStore(CachedDBKVStore):
+    """Key-value store sorl в кэше и БД с пакетной подгрузкой записей.
+
+    Внутри preload() записи берутся из словаря, заполненного одним
+    cache.get_many и одним запросом к БД на ключи, которых нет в кэше.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._local = threading.local()
+
+    @contextmanager
+    def preload(self, keys):
+        keys = [add_prefix(key) for key in keys]
+        values = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            found = dict(
+                KVStoreModel.objects.filter(key__in=missing)
+                .values_list('key', 'value')
+            )
+            # Отсутствие записи тоже кэшируется, как в _get_raw.
+            fetched = {key: found.get(key, EMPTY_VALUE) for key in missing}
+            self.cache.set_many(fetched, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+            values.update(fetched)
+        self._local.values = values
+        try:
+            yield
+        finally:
+            self._local.values = {}
+
+    def _get_raw(self, key):
+        values = getattr(self._local, 'values', {})
+        if key not in values:
+            return super()._get_raw(key)
+        value = values[key]
+        return None if value == EMPTY_VALUE else value
+
+    def _set_raw(self, key, value):
+        getattr(self._local, 'values', {}).pop(key, None)
+        super()._set_raw(key, value)
+
+
+def field_storage():
+    # Хранилище входит в ключ миниатюры sorl: берём то же, что у поля,
+    # иначе рендер по Post.image не найдёт построенную здесь миниатюру.
+    return Post._meta.get_field('image').storage
+
+
+def formats():
+    """Форматы из THUMBNAIL_FORMATS, которые Pillow умеет сохранять."""
+    Image.init()
+    return [
+        fmt for fmt in settings.THUMBNAIL_FORMATS
+        if fmt in Image.SAVE and fmt in EXTENSIONS
+    ]
+
+
+def renditions(size, source_width=None):
+    """Варианты размера size: (формат, ширина, геометрия, опции sorl).
+
+    Формат None - запасной JPEG для <img>. Варианты шире исходной
+    картинки (если она известна) не строятся: растянутая картинка не
+    чётче, только тяжелее. Базовый вариант строится всегда.
+    """
+    geometry, options = settings.THUMBNAIL_SIZES[size]
+    width, height = (int(value) for value in geometry.split('x'))
+    for scale in settings.THUMBNAIL_SRCSET:
+        scaled = round(width * scale)
+        if scale > 1 and source_width and scaled > source_width:
+            continue
+        scaled_geometry = f'{scaled}x{round(height * scale)}'
+        yield None, scaled, scaled_geometry, dict(options)
+        for fmt in formats():
+            yield fmt, scaled, scaled_geometry, dict(
+                options, format=fmt,
+                quality=settings.THUMBNAIL_FORMAT_QUALITY.get(
+                    fmt, sorl_settings.THUMBNAIL_QUALITY
+                ),
+            )
+
+
+def variants(image, size, source_width=None):
+    """Готовые варианты картинки: формат -> [(ширина, миниатюра)].
+
+    Если каких-то вариантов ещё нет, картинка ставится в очередь на
+    построение, как в get_thumbnail.
+    """
+    found = defaultdict(list)
+    missing = False
+    for fmt, width, geometry, options in renditions(size, source_width):
+        thumbnail = default.backend.lookup(image, geometry, **options)
+        if thumbnail:
+            found[fmt].append((width, thumbnail))
+        else:
+            missing = True
+    if missing:
+        schedule(image.name)
+    return found
+
+
+def preloaded(posts):
+    """Подгружает записи миниатюр картинок posts на время рендера."""
+    keys = [
+        default.backend.thumbnail_file(
+            ImageFile(post.image), geometry, options
+        ).key
+        for post in posts if post.image
+        for size in settings.THUMBNAIL_SIZES
+        for _, _, geometry, options in renditions(size, post.image_width)
+    ]
+    return default.kvstore.preload(keys)
+
+
+def image_metadata(image, size):
+    """Поля поста со сведениями о картинке PIL image размером size байт."""
+    return {
+        'image_width': image.width,
+        'image_height': image.height,
+        'image_format': (image.format or '').lower(),
+        'image_size': size,
+    }
+
+
+def source_width(name):
+    """Ширина картинки name; у постов без сведений о ней они заполняются.
+
+    Сведений нет у картинок, загруженных в обход PostForm: импорт,
+    старые посты.
+    """
+    widths = set()
+    for posts in shards.querysets(Post.objects.filter(image=name)):
+        widths.update(posts.values_list('image_width', flat=True))
+    if None not in widths:
+        return max(widths, default=None)
+    storage = field_storage()
+    with storage.open(name) as source:
+        metadata = image_metadata(Image.open(source), storage.size(name))
+    for posts in shards.querysets(
+        Post.objects.filter(image=name, image_width=None)
+    ):
+        posts.update(**metadata)
+    return metadata['image_width']
+
+
+@tasks.task
+def generate(name):
+    """Строит все варианты всех настроенных миниатюр для файла name."""
+    source = ImageFile(name, field_storage())
+    width = source_width(name)
+    for size in settings.THUMBNAIL_SIZES:
+        for _, _, geometry, options in renditions(size, width):
+            default.backend.generate(source, geometry, **options)
+    # Страницы, отрендеренные с заглушкой, кэшированы и отдают 304.
+    touched = []
+    for posts in shards.querysets(Post.objects.filter(image=name)):
+        touched.extend(
+            posts.values_list('pk', 'author__username', 'group__slug')
+        )
+    bump_posts(touched)
+
+
+def _build(name):
+    try:
+        generate(name)
+    except Exception:
+        logger.exception('Не удалось построить миниатюры для %s', name)
+        cache.set(
+            make_key(FAILED_KEY, name), True,
+            settings.THUMBNAIL_FAILURE_TIMEOUT,
+        )
+
+
+def _run(name):
+    try:
+        _build(name)
+    finally:
+        with _lock:
+            _pending.discard(name)
+        # У каждого потока пула своё соединение с БД: не оставляем его.
+        connection.close()
+
+
+def get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails',
+            )
+        return _executor
+
+
+def submit(name):
+    """Отправляет файл в пул; один файл не строится дважды параллельно."""
+    if not settings.THUMBNAIL_WORKERS:
+        _build(name)
+        return
+    with _lock:
+        if name in _pending:
+            return
+        _pending.add(name)
+    get_executor().submit(_run, name)
+
+
+def schedule(name):
+    """Ставит построение миниатюр в очередь после фиксации транзакции."""
+    if name and not cache.get(make_key(FAILED_KEY, name)):
+        transaction.on_commit(lambda: submit(name))
+
+
+def pregenerate(name):
+    """Ставит построение миниатюр новой картинки в очередь задач."""
+    if name:
+        tasks.enqueue(generate, name, key=f'thumbnails:{name}')
@@ -0,0 +1,436 @@
+"""Потоковый импорт и экспорт групп, постов, комментариев и подписок.
+
+Дамп - последовательность записей; у каждой есть поле type:
+
+    group    slug, title, description
+    post     id, author, group, text, date, image
+    comment  post, author, text, date
+    follow   user, author
+
+Авторы и подписчики задаются именем пользователя, группа - слагом,
+comment.post - id поста из того же дампа. Формат JSONL (объект на
+строку) или CSV с колонками FIELDS.
+
+Импорт читает дамп потоком и пишет пачками bulk_create, каждая пачка
+в своей транзакции. Соответствие id постов из дампа новым id хранится
+во временной таблице, имена пользователей - в словаре не больше
+USER_CACHE_SIZE, поэтому память не растёт с дампом (кроме слагов
+групп: их мало). Картинки берутся только из каталога --images. bulk_create
+не отправляет сигналы, поэтому в конце импорт сам пересчитывает
+счётчики, раскладывает новые посты и подписки по лентам и сбрасывает
+кэш страниц. Во время импорта в БД не должны писать другие процессы:
+id новых постов и комментариев раздаются заранее.
+"""
+import csv
+import heapq
+import json
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from core import storage
+
+from . import cache, counters, feed, search, shards
+from .models import Comment, Follow, Group, Post, User
+from .utils import set_excerpt
+
+FIELDS = (
+    'type', 'id', 'slug', 'title', 'description', 'user', 'author', 'group',
+    'post', 'text', 'date', 'image',
+)
+CHUNK_SIZE = 2000
+USER_CACHE_SIZE = 50000
+POST_IDS_TABLE = 'transfer_post_ids'
+SQL_BATCH_SIZE = 500
+
+
+def detect_format(path, fmt=None):
+    if fmt:
+        return fmt
+    return 'csv' if path.endswith('.csv') else 'jsonl'
+
+
+def read_records(stream, fmt):
+    if fmt == 'csv':
+        for row in csv.DictReader(stream):
+            yield {key: value or None for key, value in row.items()}
+    else:
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+
+
+class RecordWriter:
+    def __init__(self, stream, fmt):
+        self.stream = stream
+        self.csv = None
+        if fmt == 'csv':
+            self.csv = csv.DictWriter(stream, FIELDS, extrasaction='ignore')
+            self.csv.writeheader()
+
+    def write(self, record):
+        if self.csv:
+            self.csv.writerow(record)
+        else:
+            self.stream.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def _date(value):
+    return value.isoformat() if value else None
+
+
+def export_records(chunk_size=CHUNK_SIZE):
+    """Все записи дампа по порядку: группы, посты, комментарии, подписки."""
+    for slug, title, description in Group.objects.order_by('pk').values_list(
+        'slug', 'title', 'description'
+    ).iterator(chunk_size=chunk_size):
+        yield {'type': 'group', 'slug': slug, 'title': title,
+               'description': description}
+    # id постов сквозные между шардами: потоки сливаются по id.
+    posts = heapq.merge(*(
+        shard.values_list(
+            'pk', 'author__username', 'group__slug', 'text', 'pub_date',
+            'image',
+        ).iterator(chunk_size=chunk_size)
+        for shard in shards.querysets(Post.objects.order_by('pk'))
+    ))
+    for pk, author, group, text, date, image in posts:
+        yield {'type': 'post', 'id': pk, 'author': author, 'group': group,
+               'text': text, 'date': _date(date), 'image': image or None}
+    for shard in shards.querysets(Comment.objects.order_by('pk')):
+        comments = shard.values_list(
+            'post_id', 'author__username', 'text', 'created'
+        )
+        for post, author, text, date in comments.iterator(
+            chunk_size=chunk_size
+        ):
+            yield {'type': 'comment', 'post': post, 'author': author,
+                   'text': text, 'date': _date(date)}
+    follows = Follow.objects.order_by('pk').values_list(
+        'user__username', 'author__username'
+    )
+    for user, author in follows.iterator(chunk_size=chunk_size):
+        yield {'type': 'follow', 'user': user, 'author': author}
+
+
+@contextmanager
+def dump_dates():
+    """Отключает auto_now и auto_now_add, чтобы сохранить даты из дампа."""
+    fields = [
+        field
+        for model in (Post, Comment)
+        for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False)
+        or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _parse_date(value):
+    if not value:
+        return timezone.now()
+    date = parse_datetime(value)
+    if timezone.is_naive(date):
+        date = timezone.make_aware(date)
+    return date
+
+
+def copy_image(source_dir, name):
+    """Копирует картинку в хранилище; возвращает имя в хранилище.
+
+    Имя из дампа не может указывать за пределы source_dir: абсолютные
+    пути и ../ отклоняются.
+    """
+    root = os.path.realpath(source_dir)
+    path = os.path.realpath(os.path.join(root, name))
+    if os.path.commonpath([root, path]) != root:
+        raise SuspiciousFileOperation(f'{name} вне каталога {source_dir}')
+    with open(path, 'rb') as source:
+        return Post._meta.get_field('image').storage.save(name, File(source))
+
+
+class Importer:
+    def __init__(self, chunk_size=CHUNK_SIZE, images=None, workers=4):
+        self.chunk_size = chunk_size
+        self.images = images
+        self.workers = workers
+        self.users = {}
+        self.groups = {}
+        self.pending = {'group': [], 'post': [], 'comment': [], 'follow': []}
+        self.stats = dict.fromkeys(self.pending, 0)
+        self.stats['skipped'] = 0
+        self.errors = []
+        self.touched_authors = set()
+        self.touched_posts = set()
+        self.touched_groups = set()
+        self.first_post_id = self.next_post_id = _next_id(Post)
+        self.next_comment_id = _next_id(Comment)
+        self.first_follow_id = _next_id(Follow)
+
+    def run(self, records):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {POST_IDS_TABLE}'
+                f' (old_id varchar(255) NOT NULL, new_id integer NOT NULL)'
+            )
+        try:
+            with dump_dates(), ThreadPoolExecutor(self.workers) as self.pool:
+                for record in records:
+                    kind = record.get('type')
+                    if kind not in self.pending:
+                        self.skip(f'неизвестный тип записи: {kind}')
+                        continue
+                    self.pending[kind].append(record)
+                    if len(self.pending[kind]) >= self.chunk_size:
+                        self.flush()
+                self.flush()
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE {POST_IDS_TABLE}')
+        self.finish()
+        return self.stats
+
+    def skip(self, reason):
+        self.stats['skipped'] += 1
+        if len(self.errors) < 100:
+            self.errors.append(reason)
+
+    def flush(self):
+        with transaction.atomic():
+            self.import_groups(self.pending['group'])
+            self.import_posts(self.pending['post'])
+            self.import_comments(self.pending['comment'])
+            self.import_follows(self.pending['follow'])
+        for batch in self.pending.values():
+            batch.clear()
+
+    def resolve_users(self, names):
+        names = set(names)
+        if len(self.users) + len(names) > USER_CACHE_SIZE:
+            self.users.clear()
+        missing = {name for name in names if name not in self.users}
+        if not missing:
+            return
+        self.users.update(
+            User.objects.filter(username__in=missing)
+            .values_list('username', 'pk')
+        )
+        new = []
+        for name in missing - set(self.users):
+            user = User(username=name)
+            user.set_unusable_password()
+            new.append(user)
+        if new:
+            User.objects.bulk_create(new)
+            self.users.update(
+                User.objects.filter(username__in=[u.username for u in new])
+                .values_list('username', 'pk')
+            )
+
+    def resolve_groups(self, slugs, titles=None):
+        titles = titles or {}
+        missing = {slug for slug in slugs if slug not in self.groups}
+        if not missing:
+            return
+        self.groups.update(
+            Group.objects.filter(slug__in=missing).values_list('slug', 'pk')
+        )
+        new = [
+            Group(slug=slug, **titles.get(slug, {'title': slug}))
+            for slug in missing - set(self.groups)
+        ]
+        if new:
+            Group.objects.bulk_create(new)
+            self.groups.update(
+                Group.objects.filter(slug__in=[g.slug for g in new])
+                .values_list('slug', 'pk')
+            )
+
+    def import_groups(self, records):
+        if not records:
+            return
+        titles = {
+            record['slug']: {
+                'title': record.get('title') or record['slug'],
+                'description': record.get('description') or '',
+            }
+            for record in records
+        }
+        before = len(self.groups)
+        self.resolve_groups(titles, titles)
+        self.stats['group'] += len(self.groups) - before
+
+    def import_posts(self, records):
+        if not records:
+            return
+        self.resolve_users(record['author'] for record in records)
+        self.resolve_groups(
+            record['group'] for record in records if record.get('group')
+        )
+        images = {
+            index: self.pool.submit(copy_image, self.images, record['image'])
+            for index, record in enumerate(records)
+            if record.get('image') and self.images
+        }
+        posts = []
+        post_ids = []
+        for index, record in enumerate(records):
+            image = record.get('image') or ''
+            if index in images:
+                try:
+                    image = images[index].result()
+                except (OSError, SuspiciousFileOperation) as error:
+                    self.skip(f'картинка поста {record.get("id")}: {error}')
+                    image = ''
+            date = _parse_date(record.get('date'))
+            post = Post(
+                pk=self.next_post_id,
+                author_id=self.users[record['author']],
+                group_id=self.groups.get(record.get('group')),
+                text=record['text'],
+                pub_date=date,
+                updated=date,
+                image=image,
+            )
+            set_excerpt(post)
+            self.next_post_id += 1
+            if record.get('id') is not None:
+                post_ids.append((str(record['id']), post.pk))
+            posts.append(post)
+            self.touched_authors.add(post.author_id)
+            if record.get('group'):
+                self.touched_groups.add(record['group'])
+        Post.objects.bulk_create(posts)
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'INSERT INTO {POST_IDS_TABLE} (old_id, new_id)'
+                f' VALUES (%s, %s)',
+                post_ids,
+            )
+        images = Counter(
+            post.image.name for post in posts
+            if storage.is_hashed(post.image.name)
+        )
+        for name, count in images.items():
+            storage.acquire(name, count)
+        search.get_backend().add((post.pk, post.text) for post in posts)
+        self.stats['post'] += len(posts)
+
+    def import_comments(self, records):
+        if not records:
+            return
+        self.resolve_users(record['author'] for record in records)
+        post_ids = self.new_post_ids(
+            {str(record.get('post')) for record in records}
+        )
+        comments = []
+        for record in records:
+            post_id = post_ids.get(str(record.get('post')))
+            if post_id is None:
+                self.skip(f'комментарий к неизвестному посту {record["post"]}')
+                continue
+            comments.append(Comment(
+                pk=self.next_comment_id,
+                post_id=post_id,
+                author_id=self.users[record['author']],
+                text=record['text'],
+                created=_parse_date(record.get('date')),
+            ))
+            self.next_comment_id += 1
+            self.touched_posts.add(post_id)
+        Comment.objects.bulk_create(comments)
+        self.stats['comment'] += len(comments)
+
+    def new_post_ids(self, old_ids):
+        """Новые id постов дампа: {id из дампа: id в БД}."""
+        found = {}
+        old_ids = sorted(old_ids)
+        with connection.cursor() as cursor:
+            for start in range(0, len(old_ids), SQL_BATCH_SIZE):
+                batch = old_ids[start:start + SQL_BATCH_SIZE]
+                # Повторный id в дампе перекрывает прежний, как в словаре.
+                cursor.execute(
+                    f'SELECT old_id, MAX(new_id) FROM {POST_IDS_TABLE}'
+                    f' WHERE old_id IN ({", ".join(["%s"] * len(batch))})'
+                    f' GROUP BY old_id',
+                    batch,
+                )
+                found.update(cursor.fetchall())
+        return found
+
+    def import_follows(self, records):
+        if not records:
+            return
+        self.resolve_users(
+            name for record in records
+            for name in (record['user'], record['author'])
+        )
+        pairs = {
+            (self.users[record['user']], self.users[record['author']])
+            for record in records
+        }
+        pairs = {(user, author) for user, author in pairs if user != author}
+        existing = set(
+            Follow.objects.filter(
+                user_id__in={user for user, _ in pairs},
+                author_id__in={author for _, author in pairs},
+            ).values_list('user_id', 'author_id')
+        )
+        new = pairs - existing
+        self.stats['skipped'] += len(records) - len(new)
+        Follow.objects.bulk_create(
+            Follow(user_id=user, author_id=author) for user, author in new
+        )
+        self.stats['follow'] += len(new)
+        self.touched_authors.update(author for _, author in new)
+
+    def finish(self):
+        """Обновляет то, что при обычной записи поддерживают сигналы."""
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), [Post, Comment]
+            ):
+                cursor.execute(sql)
+        for batch in _chunks(sorted(self.touched_posts)):
+            counters.recount_comments(batch)
+        scopes = [cache.index_scope()]
+        scopes += [cache.group_scope(slug) for slug in self.touched_groups]
+        for batch in _chunks(sorted(self.touched_authors)):
+            counters.reconcile_authors(batch)
+            # Популярных авторов fan_out_bulk ниже не раскладывает.
+            feed.update_feed_mode(batch)
+            scopes += [
+                cache.author_scope(username)
+                for username in User.objects.filter(pk__in=batch)
+                .values_list('username', flat=True)
+            ]
+        feed.fan_out_bulk(
+            self.first_post_id if self.stats['post'] else None,
+            self.first_follow_id if self.stats['follow'] else None,
+        )
+        cache.bump(*scopes)
+
+
+def _next_id(model):
+    return (model.objects.aggregate(top=Max('pk'))['top'] or 0) + 1
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
@@ -7,11 +7,19 @@ app_name = 'posts'
 urlpatterns = [
 
     path('', views.index, name='index'),
+    path('search/', views.search, name='search'),
+    path('feed/<str:fmt>/', views.feed, name='feed'),
     path('group/<slug:slug>/', views.group_posts, name='group_list'),
+    path('group/<slug:slug>/feed/<str:fmt>/',
+         views.group_feed, name='group_feed'),
     path('profile/<str:username>/', views.profile, name='profile'),
+    path('profile/<str:username>/feed/<str:fmt>/',
+         views.author_feed, name='author_feed'),
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
     path('create/', views.post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
+    path('posts/<int:post_id>/comments/',
+         views.post_comments, name='post_comments'),
     path('posts/<int:post_id>/comment/',
          views.add_comment, name='add_comment'),
     path('follow/', views.follow_index, name='follow_index'),
@@ -20,6 +28,10 @@ urlpatterns = [
          name='profile_follow'),
     path('profile/<str:username>/unfollow/',
          views.profile_unfollow,
-         name='profile_unfollow')
+         name='profile_unfollow'),
+    path('profile/<str:username>/followers/',
+         views.followers, name='followers'),
+    path('profile/<str:username>/following/',
+         views.following, name='following'),
 
 ]
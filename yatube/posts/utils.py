@@ -1,8 +1,222 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+import heapq
+import json
+from collections.abc import Sequence
+from itertools import islice
+
 from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db.models import Q
+
+
+class CursorPage(Sequence):
+    """Страница курсорной пагинации: не знает общего числа страниц."""
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next:
+            return None
+        return self.paginator.encode_cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous:
+            return None
+        return self.paginator.encode_cursor(
+            self.object_list[0], backwards=True
+        )
+
+
+class CursorPaginator:
+    """Keyset-пагинация по упорядоченному набору полей.
+
+    Вместо COUNT(*) и OFFSET каждая страница выбирается условием
+    «строго после последней записи предыдущей страницы», поэтому
+    стоимость запроса не зависит от глубины страницы. Последнее поле
+    ordering должно быть уникальным (обычно pk).
+    """
+    is_cursor = True
+
+    def __init__(self, object_list, per_page, ordering=('-pub_date', '-pk')):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering)
+
+    @staticmethod
+    def _field(name):
+        return name.lstrip('-')
+
+    def _value(self, obj, name):
+        value = obj
+        for attr in self._field(name).split('__'):
+            value = getattr(value, attr)
+        return value
+
+    def encode_cursor(self, obj, backwards=False):
+        position = [str(self._value(obj, name)) for name in self.ordering]
+        payload = json.dumps(['p' if backwards else 'n', position])
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Возвращает (позиция, назад); для плохого курсора (None, False)."""
+        if not cursor:
+            return None, False
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, position = json.loads(
+                base64.urlsafe_b64decode(padded.encode()).decode()
+            )
+        except (ValueError, TypeError, binascii.Error):
+            return None, False
+        if (direction not in ('n', 'p')
+                or not isinstance(position, list)
+                or len(position) != len(self.ordering)):
+            return None, False
+        return position, direction == 'p'
+
+    def clean_cursor(self, cursor):
+        """Курсор в канонической записи или None, если он негодный.
+
+        В отличие от decode_cursor проверяет и значения полей: курсор,
+        который get_page отбросит, сюда не проходит.
+        """
+        position, backwards = self.decode_cursor(cursor)
+        if position is None:
+            return None
+        opts = self.object_list.model._meta
+        values = []
+        for name, value in zip(self.ordering, position):
+            field = self._field(name)
+            field = opts.pk if field == 'pk' else opts.get_field(field)
+            try:
+                values.append(str(field.to_python(value)))
+            except ValidationError:
+                return None
+        return json.dumps(['p' if backwards else 'n', values])
+
+    def _ordering(self, backwards):
+        if not backwards:
+            return self.ordering
+        return tuple(
+            self._field(name) if name.startswith('-') else f'-{name}'
+            for name in self.ordering
+        )
+
+    def _after(self, position, ordering):
+        """Условие «строго после position» для заданного порядка."""
+        condition = Q()
+        equal = {}
+        for name, value in zip(ordering, position):
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            field = self._field(name)
+            condition |= Q(**equal, **{f'{field}__{lookup}': value})
+            equal[field] = value
+        return condition
+
+    def fetch(self, position, backwards, limit):
+        """Выбирает limit записей после position в нужном направлении."""
+        ordering = self._ordering(backwards)
+        queryset = self.object_list.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(position, ordering))
+        return list(queryset[:limit])
+
+    def get_page(self, cursor=None):
+        position, backwards = self.decode_cursor(cursor)
+        try:
+            rows = self.fetch(position, backwards, self.per_page + 1)
+        except (ValidationError, ValueError, TypeError):
+            position, backwards = None, False
+            rows = self.fetch(None, False, self.per_page + 1)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not rows:
+            # Курсор за концом ленты: не от чего строить ссылки.
+            return CursorPage(rows, self, False, False)
+        if backwards:
+            rows.reverse()
+            return CursorPage(rows, self, True, has_more)
+        return CursorPage(rows, self, has_more, position is not None)
+
+
+class MergedCursorPaginator(CursorPaginator):
+    """Курсорная пагинация поверх нескольких упорядоченных источников.
+
+    Каждый источник отдаёт не больше limit записей после курсора,
+    а страница собирается слиянием потоков через кучу. Источники
+    должны возвращать объекты с полями из ordering этого пагинатора.
+    """
+
+    def __init__(self, paginators, per_page, ordering=('-pub_date', '-pk')):
+        super().__init__(None, per_page, ordering)
+        self.paginators = paginators
+
+    def _key(self, obj):
+        return tuple(self._value(obj, name) for name in self.ordering)
+
+    def fetch(self, position, backwards, limit):
+        streams = [
+            paginator.fetch(position, backwards, limit)
+            for paginator in self.paginators
+        ]
+        descending = self.ordering[0].startswith('-')
+        merged = heapq.merge(
+            *streams, key=self._key, reverse=descending != backwards
+        )
+        return list(islice(merged, limit))
+
+
+def make_excerpt(text, limit=None):
+    """Превью текста: (превью, число слов, обрезан ли текст).
+
+    Текст обрезается по границе слова до limit символов.
+    """
+    limit = limit or settings.POST_EXCERPT_CHARS
+    text = str(text)
+    word_count = len(text.split())
+    if len(text) <= limit:
+        return text, word_count, False
+    cut = text[:limit]
+    if not text[limit].isspace() and len(cut.split(None, 1)) > 1:
+        cut = cut.rsplit(None, 1)[0]
+    return cut.rstrip(), word_count, True
+
+
+def set_excerpt(post):
+    post.excerpt, post.word_count, post.has_more = make_excerpt(post.text)
 
 
 def get_page_context(post_list, request):
-    paginator = Paginator(post_list, settings.POST_PAGES)
     page_number = request.GET.get('page')
-    return paginator.get_page(page_number)
+    if page_number is not None:
+        # Старые ссылки вида ?page=N продолжают работать через OFFSET.
+        paginator = Paginator(post_list, settings.POST_PAGES)
+        return paginator.get_page(page_number)
+    paginator = CursorPaginator(post_list, settings.POST_PAGES)
+    return paginator.get_page(request.GET.get('cursor'))
@@ -1,76 +1,212 @@
+from django.http import Http404, JsonResponse
 from django.shortcuts import render, get_object_or_404
 from django.shortcuts import redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import condition, require_POST
 
 from django.conf import settings
-from .utils import get_page_context
-from .models import Follow, Group, Post, User
+from core.db import retry_on_lock
+from . import follows, shards, syndication, thumbnails
+from .cache import (
+    author_scope, cache_feed_page, conditional_page, group_scope, index_scope,
+    post_author_scope, post_scope,
+)
+from .counters import for_author
+from .feed import follow_paginator
+from .search import SearchPaginator
+from .utils import CursorPaginator, get_page_context
+from .models import Comment, Group, Post, User
 from .forms import CommentForm, PostForm
 
 
+@conditional_page(index_scope)
+@cache_feed_page(index_scope)
 def index(request):
-    post_list = Post.objects.select_related('author', 'group')
+    post_list = Post.objects.select_related('author', 'group').defer('text')
     context = {
-        'page_obj': get_page_context(post_list, request),
+        'page_obj': shards.get_page_context(post_list, request),
     }
-    return render(request, 'posts/index.html', context)
+    with thumbnails.preloaded(context['page_obj']):
+        return render(request, 'posts/index.html', context)
 
 
+@conditional_page(group_scope)
+@cache_feed_page(group_scope)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.select_related('author')
+    post_list = group.posts.select_related('author').defer('text')
     context = {
         'group': group,
-        'page_obj': get_page_context(post_list, request),
+        'page_obj': shards.get_page_context(post_list, request),
     }
-    return render(request, 'posts/group_list.html', context)
+    with thumbnails.preloaded(context['page_obj']):
+        return render(request, 'posts/group_list.html', context)
 
 
+@conditional_page(author_scope, forms=True)
+@cache_feed_page(author_scope)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.prefetch_related('group')
+    author = get_object_or_404(
+        User.objects.select_related('counters'), username=username
+    )
+    post_list = author.posts.select_related('group').defer('text')
     following = request.user.is_authenticated
     if following:
         following = author.following.filter(user=request.user).exists()
-    post_count = author.posts.count()
+    counters = for_author(author)
     context = {
         'author': author,
         'page_obj': get_page_context(post_list, request),
-        'post_count': post_count,
+        'post_count': counters.post_count,
+        'follower_count': counters.follower_count,
         'following': following,
     }
-    return render(request, 'posts/profile.html', context)
+    with thumbnails.preloaded(context['page_obj']):
+        return render(request, 'posts/profile.html', context)
 
 
+@conditional_page(post_scope, post_author_scope, forms=True)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    posts_count = post.author.posts.count()
+    post = get_object_or_404(
+        Post.objects.using(shards.for_post(post_id))
+        .select_related('author__counters', 'group'),
+        pk=post_id,
+    )
     title = post.text[:settings.TEXT_TITLE]
     context = {
         'post': post,
-        posts_count: posts_count,
+        'posts_count': for_author(post.author).post_count,
         'title': title,
         'form': CommentForm(),
-        'comments': post.comments.all(),
+        'comments': comment_paginator(post.comments).get_page(),
         'author': post.author,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = None
+    if query:
+        paginator = SearchPaginator(query, settings.POST_PAGES)
+        page_obj = paginator.get_page(request.GET.get('cursor'))
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    with thumbnails.preloaded(page_obj or []):
+        return render(request, 'posts/search.html', context)
+
+
+@condition(etag_func=syndication.etag,
+           last_modified_func=syndication.last_modified)
+def feed(request, fmt):
+    if fmt not in syndication.FORMATS:
+        raise Http404
+    return syndication.feed_response(
+        request, fmt,
+        title='Последние обновления на сайте',
+        link=reverse('posts:index'),
+        description='Новые записи всех авторов',
+        posts=syndication.feed_posts(),
+        newest=syndication.newest(),
+    )
+
+
+@condition(etag_func=syndication.etag,
+           last_modified_func=syndication.last_modified)
+def group_feed(request, fmt, slug):
+    if fmt not in syndication.FORMATS:
+        raise Http404
+    group = get_object_or_404(Group, slug=slug)
+    return syndication.feed_response(
+        request, fmt,
+        title=f'Записи сообщества {group.title}',
+        link=reverse('posts:group_list', args=(slug,)),
+        description=group.description,
+        posts=syndication.feed_posts(slug=slug),
+        newest=syndication.newest(slug=slug),
+    )
+
+
+@condition(etag_func=syndication.etag,
+           last_modified_func=syndication.last_modified)
+def author_feed(request, fmt, username):
+    if fmt not in syndication.FORMATS:
+        raise Http404
+    author = get_object_or_404(User, username=username)
+    return syndication.feed_response(
+        request, fmt,
+        title=f'Записи пользователя {author.get_full_name() or username}',
+        link=reverse('posts:profile', args=(username,)),
+        description=f'Новые записи {username}',
+        posts=syndication.feed_posts(username=username),
+        newest=syndication.newest(username=username),
+    )
+
+
+def comment_paginator(comments):
+    return CursorPaginator(
+        comments.select_related('author'),
+        settings.COMMENT_PAGES,
+        ordering=('created', 'pk'),
+    )
+
+
+def post_comments(request, post_id):
+    """Следующие страницы комментариев: HTML-фрагмент или JSON."""
+    using = shards.for_post(post_id)
+    paginator = comment_paginator(
+        Comment.objects.using(using).filter(post_id=post_id)
+    )
+    comments = paginator.get_page(request.GET.get('cursor'))
+    # У несуществующего поста страница всегда пустая: проверяем пост
+    # только тогда, не тратя запрос на обычные страницы.
+    if not comments and not Post.objects.using(using).filter(
+        pk=post_id
+    ).exists():
+        raise Http404
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'comments': [
+                {
+                    'id': comment.pk,
+                    'author': comment.author.username,
+                    'text': comment.text,
+                    'created': comment.created.isoformat(),
+                }
+                for comment in comments
+            ],
+            'next_cursor': comments.next_cursor,
+        })
+    context = {
+        'post_id': post_id,
+        'comments': comments,
+    }
+    return render(request, 'includes/comment_list.html', context)
+
+
 @login_required
+@retry_on_lock
 def post_create(request):
-    form = PostForm(request.POST or None)
+    form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
         form.save()
+        if post.image:
+            thumbnails.pregenerate(post.image.name)
         return redirect('posts:profile', request.user)
     return render(request, 'posts/create_post.html', {'form': form})
 
 
 @login_required
+@retry_on_lock
 def post_edit(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.using(shards.for_post(post_id)), pk=post_id
+    )
     if request.user != post.author:
         return redirect('posts:post_detail', post_id=post_id)
     form = PostForm(
@@ -81,15 +217,18 @@ def post_edit(request, post_id):
     if not form.is_valid():
         return render(request, 'posts/create_post.html',
                       {'form': form, 'is_edit': True})
-    post.text = form.cleaned_data['text']
-    post.group = form.cleaned_data['group']
-    post.save()
+    post = form.save()
+    if 'image' in form.changed_data and post.image:
+        thumbnails.pregenerate(post.image.name)
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
+@retry_on_lock
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = get_object_or_404(
+        Post.objects.using(shards.for_post(post_id)), pk=post_id
+    )
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -102,30 +241,57 @@ def add_comment(request, post_id):
 @login_required
 def follow_index(request):
     """Старница с постами авторов, на которых подписан текущий пользователь."""
-    post_list = Post.objects.filter(author__following__user=request.user).all()
-    page_obj = get_page_context(post_list, request)
+    paginator = follow_paginator(request.user)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
     context = {
         'following': True,
         'page_obj': page_obj,
     }
-    return render(request, 'posts/follow.html', context)
+    with thumbnails.preloaded(page_obj):
+        return render(request, 'posts/follow.html', context)
 
 
 @login_required
+@require_POST
+@retry_on_lock
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
-    if request.user != author:
-        follow = Follow.objects.filter(user=request.user, author=author)
-        if not follow.exists():
-            follow = Follow.objects.create(user=request.user, author=author)
-            follow.save()
-            return redirect('posts:follow_index')
+    if follows.follow(request.user, author):
+        return redirect('posts:follow_index')
     return redirect('posts:index')
 
 
 @login_required
+@require_POST
+@retry_on_lock
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    follow = get_object_or_404(Follow, user=request.user, author=author)
-    follow.delete()
+    if not follows.unfollow(request.user, author):
+        raise Http404
     return redirect('posts:index')
+
+
+def followers(request, username):
+    author = get_object_or_404(User, username=username)
+    paginator = follows.followers_paginator(author)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    context = {
+        'author': author,
+        'page_obj': page_obj,
+        'users': [follow.user for follow in page_obj],
+        'title': f'Подписчики {username}',
+    }
+    return render(request, 'posts/follow_list.html', context)
+
+
+def following(request, username):
+    user = get_object_or_404(User, username=username)
+    paginator = follows.following_paginator(user)
+    page_obj = paginator.get_page(request.GET.get('cursor'))
+    context = {
+        'author': user,
+        'page_obj': page_obj,
+        'users': [follow.author for follow in page_obj],
+        'title': f'Подписки {username}',
+    }
+    return render(request, 'posts/follow_list.html', context)
@@ -0,0 +1,127 @@
+"""Настройки баз данных из переменных окружения.
+
+DB_ENGINE          sqlite3 (по умолчанию) или postgresql
+DB_NAME            файл SQLite или имя базы PostgreSQL
+DB_USER, DB_PASSWORD, DB_HOST, DB_PORT
+DB_CONN_MAX_AGE    сколько секунд держать соединение открытым между
+                   запросами; 0 - закрывать после каждого запроса
+DB_POOL            pgbouncer - ходить в PostgreSQL через пул PgBouncer
+                   в режиме transaction
+DB_REPLICAS        реплики через запятую: для PostgreSQL - host[:port],
+                   для SQLite - файлы БД (относительные пути - от
+                   каталога проекта, как у db.sqlite3)
+DB_TEST_NAME       файл тестовой БД SQLite; тесты идут на файле, а не
+                   в памяти, чтобы WAL и блокировки работали как в бою
+DB_SHARDS          шарды постов и комментариев через запятую, в том же
+                   виде, что DB_REPLICAS (см. posts/shards.py)
+SEARCH_BACKEND     класс поиска постов; по умолчанию FTS5 для SQLite
+                   и поиск без индекса для PostgreSQL, где таблицы
+                   FTS5 нет (см. posts/search.py)
+
+Реплики получают псевдонимы replica_1, replica_2 и т.д., шарды -
+shard_1, shard_2 и т.д.
+"""
+import os
+
+ENGINES = {
+    'sqlite3': 'core.backends.sqlite3',
+    'postgresql': 'django.db.backends.postgresql',
+}
+SEARCH_BACKENDS = {
+    'sqlite3': 'posts.search.SqliteFTS5Backend',
+    'postgresql': 'posts.search.SimpleSearchBackend',
+}
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def _copy(primary, engine, address, base_dir):
+    database = dict(primary)
+    if engine == 'sqlite3':
+        database['NAME'] = os.path.join(base_dir, address)
+    else:
+        host, _, port = address.partition(':')
+        database['HOST'] = host
+        database['PORT'] = port or primary['PORT']
+    return database
+
+
+def _replica(primary, engine, address, base_dir):
+    replica = _copy(primary, engine, address, base_dir)
+    # В тестах реплика - зеркало тестовой БД основной: те же данные
+    # без отставания (соединение делит core.runner.TestRunner).
+    replica['TEST'] = {'MIRROR': 'default'}
+    return replica
+
+
+def _shard(primary, engine, address, base_dir):
+    shard = _copy(primary, engine, address, base_dir)
+    if engine == 'sqlite3':
+        # Не имя тестовой БД основной: в тестах шард в памяти, а
+        # core.runner.TestRunner кладёт его во временный файл.
+        shard['TEST'] = {}
+    return shard
+
+
+def from_env(environ, base_dir):
+    """Возвращает (DATABASES, список псевдонимов реплик)."""
+    engine = environ.get('DB_ENGINE', 'sqlite3')
+    if engine not in ENGINES:
+        raise ValueError(
+            f'DB_ENGINE должен быть одним из: {", ".join(ENGINES)}'
+        )
+    primary = {
+        'ENGINE': ENGINES[engine],
+        'CONN_MAX_AGE': int(environ.get('DB_CONN_MAX_AGE', 60)),
+    }
+    if engine == 'sqlite3':
+        primary['NAME'] = environ.get(
+            'DB_NAME', os.path.join(base_dir, 'db.sqlite3')
+        )
+        primary['TEST'] = {'NAME': environ.get(
+            'DB_TEST_NAME', os.path.join(base_dir, 'test_db.sqlite3')
+        )}
+    else:
+        primary.update({
+            'NAME': environ.get('DB_NAME', 'yatube'),
+            'USER': environ.get('DB_USER', 'yatube'),
+            'PASSWORD': environ.get('DB_PASSWORD', ''),
+            'HOST': environ.get('DB_HOST', 'localhost'),
+            'PORT': environ.get('DB_PORT', '5432'),
+        })
+        if environ.get('DB_POOL') == 'pgbouncer':
+            # В режиме transaction соединение с сервером меняется между
+            # транзакциями, а серверные курсоры живут дольше транзакции.
+            primary['DISABLE_SERVER_SIDE_CURSORS'] = True
+    databases = {'default': primary}
+    replicas = []
+    for number, address in enumerate(
+        _split(environ.get('DB_REPLICAS', '')), start=1
+    ):
+        alias = f'replica_{number}'
+        databases[alias] = _replica(primary, engine, address, base_dir)
+        replicas.append(alias)
+    return databases, replicas
+
+
+def search_backend(environ):
+    """Бэкенд поиска: из SEARCH_BACKEND или по движку БД."""
+    engine = environ.get('DB_ENGINE', 'sqlite3')
+    return environ.get('SEARCH_BACKEND', SEARCH_BACKENDS.get(engine))
+
+
+def add_shards(databases, environ, base_dir):
+    """Добавляет в databases шарды из DB_SHARDS, возвращает их псевдонимы."""
+    engine = environ.get('DB_ENGINE', 'sqlite3')
+    shards = []
+    for number, address in enumerate(
+        _split(environ.get('DB_SHARDS', '')), start=1
+    ):
+        alias = f'shard_{number}'
+        databases[alias] = _shard(
+            databases['default'], engine, address, base_dir
+        )
+        shards.append(alias)
+    return shards
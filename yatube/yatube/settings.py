@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 
 import os
 
+from . import databases
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -38,6 +40,7 @@ INSTALLED_APPS = [
     'posts.apps.PostsConfig',
     'users.apps.UsersConfig',
     'core.apps.CoreConfig',
+    'api.apps.ApiConfig',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -48,6 +51,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -61,7 +66,8 @@ ROOT_URLCONF = 'yatube.urls'
 TEMPLATES_DIR = os.path.join(BASE_DIR, 'templates')
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.templates.TimedDjangoTemplates',
+        'NAME': 'django',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -79,11 +85,69 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
+# Переменные окружения для БД и реплик описаны в yatube/databases.py
+
+DATABASES, DATABASE_REPLICAS = databases.from_env(os.environ, BASE_DIR)
+# Шарды постов и комментариев (posts.shards); пусто - всё в default
+DATABASE_SHARDS = databases.add_shards(DATABASES, os.environ, BASE_DIR)
+DATABASE_ROUTERS = [
+    'posts.shards.ShardRouter',
+    'core.routers.PrimaryReplicaRouter',
+]
+# Сколько секунд кэшировать шард автора и автора поста
+SHARD_CACHE_TIMEOUT = 24 * 60 * 60
+# View, которые читают из реплик (core.middleware.ReplicaRoutingMiddleware)
+DATABASE_REPLICA_VIEWS = (
+    'posts:index',
+    'posts:group_list',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:follow_index',
+    'posts:feed',
+    'posts:group_feed',
+    'posts:author_feed',
+    'api:posts',
+    'api:post',
+    'api:post_comments',
+    'api:groups',
+    'api:group',
+    'api:user',
+    'api:followers',
+    'api:following',
+)
+# Сколько секунд после записи клиент читает из основной БД
+DATABASE_REPLICA_STICKY_SECONDS = int(
+    os.environ.get('DB_REPLICA_STICKY_SECONDS', 10)
+)
+
+# Применяются к каждому новому соединению с SQLite (core.db)
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    # В режиме WAL NORMAL не портит БД при сбое, теряя лишь последние
+    # транзакции при отключении питания
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    # Отрицательное значение - размер в КиБ
+    'cache_size': -64 * 1024,
+    'temp_store': 'MEMORY',
+}
+# Повтор записи при «database is locked» (core.db.retry_on_lock)
+SQLITE_WRITE_ATTEMPTS = 5
+SQLITE_RETRY_DELAY = 0.05
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# В продакшене задайте файловый или БД-кэш, например:
+# CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# CACHE_LOCATION=/var/tmp/yatube_cache
 
-DATABASES = {
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'BACKEND': os.environ.get(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'yatube'),
     }
 }
 
@@ -133,9 +197,80 @@ LOGIN_REDIRECT_URL = 'posts:index'
 # LOGOUT_REDIRECT_URL = 'posts:index'
 
 POST_PAGES = 10
+COMMENT_PAGES = 20
+FOLLOW_PAGES = 50
 TEXT_TITLE = 30
 TEXT_COUNT = 15
+# Длина превью поста в карточке ленты, символы
+POST_EXCERPT_CHARS = 300
 COUNT_POSTS = 13
+# Авторы с большим числом подписчиков не раскладываются по лентам.
+# Раскладка возвращается, когда подписчиков становится на эту долю
+# меньше порога, чтобы автор у порога не переключался туда и обратно.
+FEED_FANOUT_LIMIT = 1000
+FEED_FANOUT_HYSTERESIS = 0.1
+# Время жизни закэшированной страницы ленты, секунды
+PAGE_CACHE_TIMEOUT = 60 * 5
+# Сколько последних постов отдают ленты RSS, Atom и JSON Feed
+SYNDICATION_ITEMS = 50
+# Размер страницы API по умолчанию и наибольший для параметра limit=
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+# Бэкенд поиска выбирается по DB_ENGINE (см. yatube/databases.py)
+SEARCH_BACKEND = databases.search_backend(os.environ)
+# Метрики запросов (core.middleware.MetricsMiddleware)
+METRICS_ENDPOINT_ENABLED = True
+# Адреса, с которых доступен /metrics/; пустой список - с любых
+METRICS_ALLOWED_IPS = []
+METRICS_FLUSH_SECONDS = 10
+# Снимок, не обновлявшийся столько секунд, - снимок завершившегося
+# процесса: dump_metrics его не учитывает и удаляет
+METRICS_PROCESS_TIMEOUT = 60 * 10
+METRICS_SLOW_REQUEST_MS = 500
+METRICS_SLOW_SAMPLE_RATE = float(
+    os.environ.get('METRICS_SLOW_SAMPLE_RATE', 0.05)
+)
+# Фоновая очередь задач (core.tasks, manage.py run_workers). С
+# TASKS_EAGER задачи выполняются без обработчиков, после фиксации
+# транзакции: так их запускает тестовый раннер, а в разработке -
+# TASKS_EAGER=1. Без TASKS_EAGER_ON_COMMIT - сразу при постановке.
+TASKS_EAGER = os.environ.get('TASKS_EAGER', '0') == '1'
+TASKS_EAGER_ON_COMMIT = True
+TASKS_WORKERS = int(os.environ.get('TASKS_WORKERS', 2))
+TASKS_POOL = os.environ.get('TASKS_POOL', 'thread')
+TASKS_POLL_SECONDS = 1
+TASKS_MAX_ATTEMPTS = 5
+# Пауза перед повтором: TASKS_RETRY_DELAY * 2 ** (попытка - 1), секунды
+TASKS_RETRY_DELAY = 10
+TASKS_RETRY_MAX_DELAY = 60 * 60
+# Задача, выполняемая дольше, считается зависшей и ставится снова
+TASKS_TIMEOUT = 60 * 10
+# Сколько хранить выполненные задачи (и помнить их ключи), секунды
+TASKS_KEEP_DONE = 60 * 60 * 24 * 7
+TEST_RUNNER = 'core.runner.TestRunner'
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Картинка без ссылок удаляется с диска через столько секунд
+MEDIA_COLLECT_DELAY = 60 * 60
+
+# Миниатюры строятся в фоне после сохранения картинки, а не при рендере
+THUMBNAIL_BACKEND = 'posts.thumbnails.PregeneratedThumbnailBackend'
+THUMBNAIL_PREGENERATE = True
+# Записи миниатюр в кэше (и БД); страница ленты читает их одним get_many
+THUMBNAIL_KVSTORE = 'posts.thumbnails.PreloadingKVStore'
+# Число потоков пула миниатюр; 0 — строить сразу в текущем потоке
+THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', 2))
+# Сколько секунд не строить заново миниатюры, построить которые не удалось
+THUMBNAIL_FAILURE_TIMEOUT = 10 * 60
+THUMBNAIL_SIZES = {
+    'detail': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+# Ширины вариантов каждого размера для srcset, доли базовой ширины
+THUMBNAIL_SRCSET = (0.5, 0.75, 1, 1.5, 2)
+# Форматы <source> по убыванию предпочтения; AVIF - только если Pillow
+# умеет его сохранять (pillow-avif-plugin). Запасной <img> - JPEG.
+THUMBNAIL_FORMATS = ('AVIF', 'WEBP')
+# Качество сжатия по форматам: при одинаковом quality WebP и AVIF почти
+# не легче JPEG, а на глаз не хуже и при меньших значениях.
+THUMBNAIL_FORMAT_QUALITY = {'AVIF': 60, 'WEBP': 80}
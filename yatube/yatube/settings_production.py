@@ -0,0 +1,40 @@
+"""Настройки для боевого окружения.
+
+Запуск: DJANGO_SETTINGS_MODULE=yatube.settings_production.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import ALLOWED_HOSTS, TEMPLATES
+
+DEBUG = False
+
+SECRET_KEY = os.environ.get('SECRET_KEY', SECRET_KEY)  # noqa: F405
+
+ALLOWED_HOSTS = os.environ.get(
+    'ALLOWED_HOSTS', ','.join(ALLOWED_HOSTS)
+).split(',')
+
+# /metrics/ выключен; включённый отвечает только адресам сборщика.
+METRICS_ENDPOINT_ENABLED = os.environ.get(
+    'METRICS_ENDPOINT_ENABLED', '0'
+) == '1'
+METRICS_ALLOWED_IPS = os.environ.get(
+    'METRICS_ALLOWED_IPS', '127.0.0.1'
+).split(',')
+
+# Скомпилированные шаблоны держим в памяти процесса: без этого каждый
+# {% include %} в ленте заново читает и разбирает файл шаблона.
+TEMPLATES = [{
+    **TEMPLATES[0],
+    'APP_DIRS': False,
+    'OPTIONS': {
+        **TEMPLATES[0]['OPTIONS'],
+        'loaders': [
+            ('django.template.loaders.cached.Loader', [
+                'django.template.loaders.filesystem.Loader',
+                'django.template.loaders.app_directories.Loader',
+            ]),
+        ],
+    },
+}]